@@ -1,9 +1,144 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from .models import Profile, Activity, Device, StandUp, Movement
+from .models import (
+    Profile, Device, HourlySample, HourlyRollup, DailyRollup, SyncJob, ActivityStats, DayCoverage, Goal, Rule,
+    Notification,
+)
 
-admin.site.register(Profile)
-admin.site.register(Activity)
-admin.site.register(Device)
-admin.site.register(StandUp)
-admin.site.register(Movement)
+# До скольких строк считается точный COUNT(*); дальше показывается оценка
+COUNT_LIMIT = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц без полного COUNT(*).
+
+    Без фильтров на PostgreSQL число строк берётся из статистики планировщика (pg_class.reltuples).
+    В остальных случаях считается не больше COUNT_LIMIT строк (COUNT по подзапросу с LIMIT),
+    так что страницы дальше предела недоступны, но список открывается за постоянное время.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > COUNT_LIMIT:
+                return row[0]
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список без точного подсчёта строк и с сортировкой по первичному ключу.
+
+    date_hierarchy не используется: навигация по годам строится через SELECT DISTINCT по усечённой
+    дате и читает весь индекс. Фильтр по дате в list_filter задаёт диапазон по индексированному полю.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    list_per_page = 50
+
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'email', 'gender', 'birthdate', 'merge_policy')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'preferred_device')
+    search_fields = ('=user__username', 'email')
+
+
+@admin.register(Device)
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ('device_name', 'device_type', 'user', 'last_import_date', 'last_record_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username', 'device_name')
+
+
+@admin.register(HourlySample)
+class HourlySampleAdmin(LargeTableAdmin):
+    # Поиск по точному имени пользователя идёт по уникальному индексу username и индексу (user, timestamp)
+    list_display = ('timestamp', 'user', 'device', 'steps', 'calories', 'distance_m', 'standups', 'movements')
+    list_select_related = ('user', 'device')
+    raw_id_fields = ('user', 'device')
+    search_fields = ('=user__username',)
+    list_filter = ('timestamp',)
+
+
+@admin.register(HourlyRollup)
+class HourlyRollupAdmin(LargeTableAdmin):
+    list_display = ('hour', 'user', 'steps', 'calories', 'distance', 'standups', 'movements')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+    list_filter = ('hour',)
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(LargeTableAdmin):
+    list_display = ('day', 'user', 'steps', 'calories', 'distance', 'standups', 'movements')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+    list_filter = ('day',)
+
+
+@admin.register(DayCoverage)
+class DayCoverageAdmin(LargeTableAdmin):
+    list_display = ('day', 'user', 'device', 'hours')
+    list_select_related = ('user', 'device')
+    raw_id_fields = ('user', 'device')
+    search_fields = ('=user__username',)
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(LargeTableAdmin):
+    # Фильтр по статусу обслуживается индексом (status, run_after)
+    list_display = ('id', 'device', 'user', 'status', 'attempts', 'run_after', 'inserted', 'skipped', 'updated')
+    list_select_related = ('device', 'user')
+    list_filter = ('status',)
+    raw_id_fields = ('device', 'user')
+    search_fields = ('=user__username',)
+
+
+@admin.register(ActivityStats)
+class ActivityStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_steps', 'total_calories', 'total_distance', 'last_sample_at', 'last_ingested_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+
+
+@admin.register(Goal)
+class GoalAdmin(admin.ModelAdmin):
+    list_display = ('user', 'metric', 'daily_target')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+
+
+@admin.register(Rule)
+class RuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'metric', 'threshold', 'hours', 'is_active', 'streak', 'evaluated_until',
+                    'last_fired_on')
+    list_select_related = ('user',)
+    list_filter = ('kind', 'is_active')
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'user', 'message', 'event_at', 'is_read')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'rule')
+    search_fields = ('=user__username',)
@@ -0,0 +1,262 @@
+import hashlib
+import json
+from array import array
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .models import ActivityStats, DailyRollup, HourlyRollup
+from utils.device_ingest import IngestError, authenticate_device, ingest_upload
+from utils.history_export import CONTENT_TYPES, EXTENSIONS, FORMATS, export_history
+from utils.timeseries import METRICS
+
+GRANULARITIES = ('hour', 'day', 'month')
+DEFAULT_SPAN = timedelta(days=1)
+# Сколько точек выдаётся одним куском потокового ответа
+CHUNK_SIZE = 1000
+
+
+async def _aiterate(iterator):
+    """Асинхронный итератор поверх синхронного: каждый кусок читается в потоке ORM через sync_to_async."""
+    next_chunk = sync_to_async(next)
+    done = object()
+    while (chunk := await next_chunk(iterator, done)) is not done:
+        yield chunk
+
+
+def _streaming_response(chunks, content_type):
+    """
+    Потоковый ответ, который и под ASGI отдаётся по кускам.
+
+    Синхронный итератор под ASGI Django целиком собирает в память до отправки, поэтому
+    при ASYNC_VIEWS (запуск через omis_lab2/asgi.py) ответ получает асинхронный итератор.
+    """
+    chunks = iter(chunks)
+    return StreamingHttpResponse(_aiterate(chunks) if settings.ASYNC_VIEWS else chunks, content_type=content_type)
+
+
+def _parse_bound(value):
+    """Граница интервала: дата (полночь в текущем поясе) или дата-время в ISO 8601."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Некорректная дата: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _parse_params(request):
+    to = _parse_bound(request.GET.get('to')) or timezone.now()
+    start = _parse_bound(request.GET.get('from')) or to - DEFAULT_SPAN
+    granularity = request.GET.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity должен быть одним из: {', '.join(GRANULARITIES)}")
+    if start > to:
+        raise ValueError("from не может быть позже to")
+    return start, to, granularity
+
+
+def _bucket_bounds(start, to, granularity):
+    """
+    Начала первой и последней корзины окна: ответ зависит от них, а не от точного времени запроса.
+
+    Без параметра to окно сдвигается вместе с часами, и с началом новой корзины ответ меняется.
+    """
+    if granularity == 'hour':
+        first = timezone.localtime(start).replace(minute=0, second=0, microsecond=0)
+        if first < start:
+            first += timedelta(hours=1)
+        return first, timezone.localtime(to).replace(minute=0, second=0, microsecond=0)
+    tz = timezone.get_current_timezone()
+    first, last = timezone.localtime(start, tz).date(), timezone.localtime(to, tz).date()
+    if granularity == 'month':
+        first, last = first.replace(day=1), last.replace(day=1)
+    return (timezone.make_aware(datetime.combine(first, time.min), tz),
+            timezone.make_aware(datetime.combine(last, time.min), tz))
+
+
+def _validators(request):
+    """(версия данных, детализация, границы корзин окна) либо None, если кэшировать нечего."""
+    # ETag и Last-Modified проверяются одним декоратором: версия читается один раз на запрос
+    if not hasattr(request, '_series_validators'):
+        request._series_validators = _read_validators(request)
+    return request._series_validators
+
+
+def _read_validators(request):
+    data_version = (
+        ActivityStats.objects.filter(user=request.user).values_list('last_ingested_at', flat=True).first()
+    )
+    if data_version is None:
+        return None
+    try:
+        start, to, granularity = _parse_params(request)
+    except ValueError:
+        return None
+    return data_version, granularity, _bucket_bounds(start, to, granularity)
+
+
+def _last_modified(request, metric):
+    validators = _validators(request)
+    if validators is None:
+        return None
+    data_version, _, (_, last_bucket) = validators
+    # Новая корзина в конце окна тоже изменение ответа
+    return max(data_version, last_bucket)
+
+
+def _etag(request, metric):
+    validators = _validators(request)
+    if validators is None:
+        return None
+    data_version, granularity, (first_bucket, last_bucket) = validators
+    # В ETag входят разрешённые границы окна, а не строка запроса: при to по умолчанию она не меняется
+    key = (f"{request.user.id}:{metric}:{granularity}:{first_bucket.isoformat()}:{last_bucket.isoformat()}:"
+           f"{data_version.timestamp()}")
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _rows(user, metric, start, to, granularity):
+    if granularity == 'hour':
+        return (
+            HourlyRollup.objects.filter(user=user, hour__range=(start, to))
+            .order_by('hour')
+            .values_list('hour', metric)
+        )
+    tz = timezone.get_current_timezone()
+    days = DailyRollup.objects.filter(
+        user=user, day__range=(timezone.localtime(start, tz).date(), timezone.localtime(to, tz).date())
+    )
+    if granularity == 'day':
+        return days.order_by('day').values_list('day', metric)
+    return (
+        days.annotate(month=TruncMonth('day'))
+        .values('month')
+        .annotate(total=Sum(metric))
+        .order_by('month')
+        .values_list('month', 'total')
+    )
+
+
+def _timestamp(bucket):
+    if isinstance(bucket, datetime):
+        return int(bucket.timestamp())
+    return int(timezone.make_aware(datetime.combine(bucket, time.min)).timestamp())
+
+
+def _stream(metric, granularity, rows):
+    """
+    JSON с колонками timestamps и values.
+
+    Метки времени отдаются по мере чтения курсора; значения копятся в компактном
+    массиве array('d') (8 байт на точку) и выводятся второй колонкой в конце.
+    """
+    yield f'{{"metric":{json.dumps(metric)},"granularity":{json.dumps(granularity)},"timestamps":['
+    values = array('d')
+    chunk = []
+    for bucket, value in rows.iterator(chunk_size=CHUNK_SIZE):
+        values.append(value or 0)
+        chunk.append(str(_timestamp(bucket)))
+        if len(chunk) >= CHUNK_SIZE:
+            yield (',' if len(values) > len(chunk) else '') + ','.join(chunk)
+            chunk = []
+    if chunk:
+        yield (',' if len(values) > len(chunk) else '') + ','.join(chunk)
+    yield '],"values":['
+    for offset in range(0, len(values), CHUNK_SIZE):
+        part = values[offset:offset + CHUNK_SIZE]
+        yield (',' if offset else '') + ','.join(_format_value(value) for value in part)
+    yield ']}'
+
+
+def _format_value(value):
+    return str(int(value)) if value.is_integer() else repr(round(value, 4))
+
+
+@require_GET
+@login_required
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def metric_series_api(request, metric):
+    """
+    GET /api/metrics/<metric>/?from=&to=&granularity=hour|day|month
+
+    Ряд метрики в колоночном виде. ETag и Last-Modified строятся по версии данных пользователя
+    (ActivityStats.last_ingested_at) и границам корзин окна, поэтому повторный запрос
+    без изменений получает 304.
+    """
+    if metric not in METRICS:
+        return JsonResponse({"error": f"Неизвестная метрика: {metric}"}, status=404)
+    try:
+        start, to, granularity = _parse_params(request)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    rows = _rows(request.user, metric, start, to, granularity)
+    return _streaming_response(_stream(metric, granularity, rows), 'application/json')
+
+
+@require_GET
+@login_required
+def history_export_api(request):
+    """
+    GET /api/history/export/?format=csv|columns&archive=1
+
+    Вся сырая почасовая история пользователя файлом; отдаётся потоком по мере чтения курсора.
+    С archive=1 в выгрузку входят и месяцы, перенесённые в архив политикой хранения.
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        return JsonResponse({"error": f"format должен быть одним из: {', '.join(FORMATS)}"}, status=400)
+    include_archive = request.GET.get('archive') == '1'
+    response = _streaming_response(export_history(request.user, fmt, include_archive=include_archive),
+                                   CONTENT_TYPES[fmt])
+    filename = f"{request.user.username}_history.{EXTENSIONS[fmt]}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@csrf_exempt
+@require_POST
+def device_samples_api(request, device_id):
+    """
+    POST /api/devices/<device_id>/samples/
+
+    Загрузка почасовых записей самим устройством. Заголовки: Authorization: Bearer <токен>,
+    Content-Type: application/json или application/x-ndjson, необязательные Content-Encoding: gzip,
+    Idempotency-Key и X-Content-SHA256 (хеш распакованного тела). Повтор уже принятой загрузки
+    получает прежний ответ со статусом 200 и заголовком Idempotent-Replayed.
+    """
+    try:
+        device = authenticate_device(device_id, request.headers.get('Authorization'))
+        result = ingest_upload(
+            device, request.body, request.content_type,
+            content_encoding=request.headers.get('Content-Encoding'),
+            idempotency_key=request.headers.get('Idempotency-Key'),
+            content_hash=request.headers.get('X-Content-SHA256'),
+        )
+    except IngestError as error:
+        body = {"error": str(error)}
+        if error.errors:
+            body["errors"] = error.errors
+        return JsonResponse(body, status=error.status)
+
+    response = JsonResponse({
+        "records": result.records, "inserted": result.inserted, "skipped": result.skipped, "updated": result.updated,
+    }, status=200 if result.replayed else 201)
+    if result.replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
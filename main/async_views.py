@@ -0,0 +1,91 @@
+from django.contrib.auth.decorators import login_required
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from .models import Device
+from .views import (
+    MOVEMENTS_METRICS, STANDUPS_METRICS, STEPS_METRICS, movements_context, standups_context, steps_context
+)
+from utils.dashboard_cache import acached_series
+from utils.goals import auser_goals
+from utils.live_updates import event_stream, live_since
+from utils.sync_jobs import aenqueue_sync, aenqueue_user_devices, alatest_jobs
+from utils.timeseries import DEFAULT_RANGE
+
+# Асинхронные варианты страниц графиков и синхронизации для ASGI (omis_lab2/asgi.py).
+# Запросы к базе и кэшу идут через async-методы ORM, поэтому один процесс обслуживает
+# много одновременных зрителей, не занимая поток на каждый запрос.
+
+
+async def _user(request):
+    # Шаблоны и контекст-процессоры читают request.user синхронно: подставляем уже загруженного
+    request.user = await request.auser()
+    return request.user
+
+
+@login_required
+async def movements_view(request):
+    user = await _user(request)
+    series = await acached_series(user, MOVEMENTS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/movements.html', movements_context(series, await auser_goals(user)))
+
+
+@login_required
+async def standups_view(request):
+    user = await _user(request)
+    series = await acached_series(user, STANDUPS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/standups.html', standups_context(series, await auser_goals(user)))
+
+
+@login_required
+async def steps_view(request):
+    user = await _user(request)
+    series = await acached_series(user, STEPS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/steps.html', steps_context(series, await auser_goals(user)))
+
+
+@login_required
+async def devices_view(request):
+    user = await _user(request)
+    devices = [device async for device in Device.objects.filter(user=user).order_by('-last_import_date')]
+    jobs = await alatest_jobs(user)
+    for device in devices:
+        device.sync_job = jobs.get(device.id)
+    return render(request, 'main/devices.html', {"devices": devices})
+
+
+@login_required
+async def sync_device(request, device_id):
+    user = await _user(request)
+    device = await aget_object_or_404(Device, id=device_id)
+    if device.user_id != user.id:
+        return redirect('devices')
+
+    # Синхронизация выполняется воркером (manage.py run_sync_workers)
+    await aenqueue_sync(device)
+    return redirect('devices')
+
+
+@login_required
+async def sync_all_devices(request):
+    await aenqueue_user_devices(await _user(request))
+    return redirect('devices')
+
+
+@login_required
+async def live_view(request):
+    """
+    Поток изменений графиков пользователя (Server-Sent Events): после каждой загрузки
+    приходят новые значения задетых корзин, страницы графиков применяют их без перезагрузки.
+    """
+    user = await _user(request)
+    try:
+        # При переподключении браузер сам присылает номер последнего полученного события
+        since = int(request.headers.get('Last-Event-ID') or request.GET['since'])
+    except (KeyError, ValueError):
+        since = live_since()
+    response = StreamingHttpResponse(event_stream(user.id, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Без буферизации в nginx события доходят сразу
+    response['X-Accel-Buffering'] = 'no'
+    return response
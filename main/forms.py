@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 
-from .models import Profile, Device
+from .models import Profile, Device, Goal, Rule
 
 
 class LoginForm(forms.Form):
@@ -40,11 +40,12 @@ class ProfileEditForm(forms.ModelForm):
 
     class Meta:
         model = Profile
-        fields = ['profile_image', 'gender', 'birthdate', 'phone', 'email']
+        fields = ['profile_image', 'gender', 'birthdate', 'phone', 'email', 'merge_policy', 'preferred_device']
 
     def __init__(self, *args, **kwargs):
         user = kwargs.get('user')
         super().__init__(*args, **kwargs)
+        self.fields['preferred_device'].queryset = Device.objects.filter(user_id=self.instance.user_id)
         if user:
             self.fields['username'].initial = user.username
             self.fields['phone'].initial = user.profile.phone
@@ -73,3 +74,35 @@ class DeviceForm(forms.ModelForm):
             'device_name': 'Название устройства',
             'device_type': 'Тип устройства',
         }
+
+
+class GoalsForm(forms.Form):
+    steps = forms.IntegerField(min_value=1, max_value=100000, label='Шагов в день')
+    distance = forms.FloatField(min_value=0.1, max_value=200, label='Километров в день')
+    standups = forms.IntegerField(min_value=1, max_value=24 * 60, label='Вставаний в день')
+
+
+class RuleForm(forms.ModelForm):
+    class Meta:
+        model = Rule
+        fields = ['kind', 'metric', 'threshold', 'hours', 'active_from', 'active_to']
+        help_texts = {
+            'threshold': 'Для низкой активности — значение за час; для дневной цели по шагам, дистанции '
+                         'или вставаниям можно оставить пустым (берётся ваша цель)',
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('kind') == Rule.KIND_LOW_ACTIVITY:
+            if cleaned_data.get('threshold') is None:
+                self.add_error('threshold', 'Укажите порог за час.')
+            if not 1 <= (cleaned_data.get('hours') or 0) <= 24:
+                self.add_error('hours', 'От 1 до 24 часов.')
+        elif cleaned_data.get('kind') == Rule.KIND_DAILY_GOAL:
+            # Цели задаются не по всем метрикам: без своей цели правило никогда бы не сработало
+            if cleaned_data.get('threshold') is None and cleaned_data.get('metric') not in dict(Goal.METRIC_CHOICES):
+                self.add_error('threshold', 'Для этой метрики нет дневной цели, укажите порог.')
+        active_from, active_to = cleaned_data.get('active_from'), cleaned_data.get('active_to')
+        if active_from is not None and active_to is not None and not 0 <= active_from < active_to <= 24:
+            raise forms.ValidationError('Активное окно должно лежать в пределах суток: 0 ≤ начало < конец ≤ 24.')
+        return cleaned_data
@@ -0,0 +1,27 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.analytics import batch_report
+
+
+class Command(BaseCommand):
+    help = 'Ночной отчёт аналитики (тренды, серии целей, аномалии) по всем пользователям в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Глубина истории в сутках')
+        parser.add_argument('--output', help='Файл для JSON-отчёта (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        report = batch_report(days=options['days'])
+        elapsed = time.perf_counter() - started
+
+        output = json.dumps({'days': options['days'], 'users': report}, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        self.stderr.write(f'Пользователей: {len(report)}, {elapsed:.3f} с')
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = ('Переносит сырые почасовые данные старше окна хранения в помесячные архивы, '
+            'оставляя в базе дневные сводки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=settings.RAW_RETENTION_DAYS,
+                            help='Сколько последних суток хранить сырые данные в базе')
+
+    def handle(self, *args, **options):
+        if options['keep_days'] < 1:
+            raise CommandError('--keep-days должен быть положительным')
+        result = apply_retention(options['keep_days'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Граница {result['cutoff']:%Y-%m-%d %H:%M}: перенесено строк {result['archived_rows']}"
+        ))
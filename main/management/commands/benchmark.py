@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+
+from utils.benchmark import run_asgi_benchmark, run_benchmark, run_contention_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон загрузки и страниц метрик на временной тестовой базе; '
+            'результат выводится в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Количество синтетических пользователей')
+        parser.add_argument('--sizes', default='1000,100000',
+                            help='Объёмы истории в почасовых записях через запятую, например 1000,100000,10000000')
+        parser.add_argument('--repeat', type=int, default=20, help='Запросов на каждую страницу')
+        parser.add_argument('--ranges', default='day,week', help='Диапазоны графиков через запятую')
+        parser.add_argument('--output', help='Файл для JSON-результата (по умолчанию stdout)')
+        parser.add_argument('--contention', type=float, metavar='SECONDS',
+                            help='Вместо обычного прогона измерить чтение во время параллельных синхронизаций '
+                                 '(SQLite, профиль по умолчанию против производственного)')
+        parser.add_argument('--readers', type=int, default=4, help='Потоков чтения для --contention')
+        parser.add_argument('--writers', type=int, default=2, help='Потоков синхронизации для --contention')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Вместо обычного прогона сравнить синхронные представления под WSGI '
+                                 'с асинхронными под ASGI при одновременных зрителях')
+        parser.add_argument('--viewers', type=int, default=50, help='Одновременных зрителей для --asgi')
+        parser.add_argument('--rounds', type=int, default=5, help='Обходов страниц каждым зрителем для --asgi')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size]
+        except ValueError:
+            raise CommandError('--sizes должен быть списком целых чисел')
+        if options['users'] < 1 or options['repeat'] < 1:
+            raise CommandError('--users и --repeat должны быть положительными')
+
+        contention = options['contention']
+        if options['asgi'] and contention is not None:
+            raise CommandError('--asgi и --contention запускаются по отдельности')
+        if options['asgi'] and (options['viewers'] < 1 or options['rounds'] < 1):
+            raise CommandError('--viewers и --rounds должны быть положительными')
+        if contention is not None:
+            if connection.vendor != 'sqlite':
+                raise CommandError('--contention измеряет блокировки SQLite и требует базу sqlite3')
+            if contention <= 0 or options['readers'] < 1 or options['writers'] < 1:
+                raise CommandError('--contention, --readers и --writers должны быть положительными')
+            # Потокам нужна общая файловая база: в памяти нет ни WAL, ни блокировок файла
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+
+        log = self.stderr.write if options['verbosity'] > 0 else None
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            if options['asgi']:
+                result = run_asgi_benchmark(viewers=options['viewers'], rounds=options['rounds'], log=log)
+            elif contention is not None:
+                result = run_contention_benchmark(
+                    readers=options['readers'], writers=options['writers'], seconds=contention, log=log,
+                )
+            else:
+                result = run_benchmark(
+                    users=options['users'], sizes=sizes, repeat=options['repeat'],
+                    ranges=[time_range for time_range in options['ranges'].split(',') if time_range], log=log,
+                )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(result, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
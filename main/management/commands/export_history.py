@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.history_export import FORMATS, export_history
+
+
+class Command(BaseCommand):
+    help = 'Выгружает сырую почасовую историю пользователя или всей системы в CSV или колоночный JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Имя пользователя; без него выгружаются все пользователи')
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='Формат выгрузки')
+        parser.add_argument('--output', help='Файл выгрузки; по умолчанию стандартный вывод')
+        parser.add_argument('--include-archive', action='store_true',
+                            help='Добавить месяцы, перенесённые в архив политикой хранения (apply_retention)')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Пользователь {options['user']} не найден")
+
+        chunks = export_history(user, options['format'], include_archive=options['include_archive'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"История выгружена в {options['output']}"))
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import Device
+from utils.activity_processor import BATCH_SIZE, process_activity_data, process_activity_stream
+
+
+class Command(BaseCommand):
+    help = 'Загружает выгрузку устройства (JSON с массивом activities или NDJSON) в почасовые записи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки устройства (.json, .ndjson или .jsonl)')
+        parser.add_argument('--user', required=True, help='Пользователь, которому принадлежат данные')
+        parser.add_argument('--device', type=int, help='id устройства пользователя; без него — первое устройство')
+        parser.add_argument('--stream', action='store_true',
+                            help='Читать файл потоково и писать пачками (для больших выгрузок)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Записей в одной транзакции (--stream)')
+        parser.add_argument('--update-existing', action='store_true', help='Перезаписывать уже сохранённые часы')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user']} не найден")
+        devices = Device.objects.filter(user=user).order_by('id')
+        device = devices.filter(id=options['device']).first() if options['device'] else devices.first()
+        if device is None:
+            raise CommandError('У пользователя нет такого устройства')
+
+        try:
+            if options['stream']:
+                result = process_activity_stream(options['path'], user, batch_size=max(options['batch_size'], 1),
+                                                 update_existing=options['update_existing'], device=device)
+            else:
+                result = process_activity_data(options['path'], user, update_existing=options['update_existing'],
+                                               device=device)
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Вставлено {result.inserted}, пропущено {result.skipped}, обновлено {result.updated}'
+        ))
@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.history_export import FORMATS, IMPORT_BATCH_SIZE, import_history
+
+
+class Command(BaseCommand):
+    help = 'Загружает историю, выгруженную export_history, через пакетный путь загрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки (.csv или колоночный .jsonl)')
+        parser.add_argument('--format', choices=FORMATS, help='Формат; по умолчанию определяется по расширению')
+        parser.add_argument('--user', help='Записать всю историю этому пользователю вместо колонки username')
+        parser.add_argument('--update-existing', action='store_true', help='Перезаписывать уже сохранённые часы')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Записей в одной транзакции')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].endswith('.csv') else 'columns')
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Пользователь {options['user']} не найден")
+
+        try:
+            with open(options['path'], 'r', encoding='utf-8', newline='') as file:
+                result = import_history(file, fmt, user=user, update_existing=options['update_existing'],
+                                        batch_size=max(options['batch_size'], 1))
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Вставлено {result.inserted}, пропущено {result.skipped}, обновлено {result.updated}'
+        ))
@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает часовые и дневные сводки активности из сырых данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help='Имя пользователя (можно указать несколько раз); по умолчанию — все')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        for user in users.iterator():
+            with transaction.atomic():
+                rebuild_rollups(user)
+            self.stdout.write(f'{user.username}: сводки перестроены')
+
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import ActivityStats
+from utils.rollups import TOTAL_FIELDS, lifetime_totals, totals_mismatch
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги активности за всё время и сверяет их с сохранёнными в ActivityStats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Проверить одного пользователя')
+        parser.add_argument('--fix', action='store_true', help='Записать пересчитанные значения при расхождении')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Пользователь {options['user']} не найден")
+            user_ids = [user.id]
+
+        expected = lifetime_totals(user_ids)
+        stats = ActivityStats.objects.all() if user_ids is None else ActivityStats.objects.filter(user_id__in=user_ids)
+        checked_ids = set(stats.values_list('user_id', flat=True))
+        empty = {**dict.fromkeys(TOTAL_FIELDS, 0), 'last_sample_at': None}
+
+        mismatched = 0
+        for user_id in sorted(checked_ids | set(expected)):
+            values = expected.get(user_id, empty)
+            with transaction.atomic():
+                # Блокировка строки не даёт параллельной загрузке сдвинуть итоги между сверкой и записью
+                row, _ = ActivityStats.objects.select_for_update().get_or_create(user_id=user_id)
+                if not totals_mismatch(row, values):
+                    continue
+                # Расхождение перепроверяется под блокировкой: загрузка могла завершиться после общего пересчёта
+                values = lifetime_totals([user_id]).get(user_id, empty)
+                fields = totals_mismatch(row, values)
+                if not fields:
+                    continue
+                mismatched += 1
+                self.stdout.write(self.style.WARNING(
+                    f"Пользователь {user_id}: " + ', '.join(
+                        f"{field} {getattr(row, field)} != {values[field]}" for field in fields
+                    )
+                ))
+                if options['fix']:
+                    for field in fields:
+                        setattr(row, field, values[field])
+                    row.save(update_fields=fields)
+
+        verb = 'исправлено' if options['fix'] else 'найдено расхождений'
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено пользователей: {len(checked_ids | set(expected))}, {verb}: {mismatched}"
+        ))
@@ -0,0 +1,54 @@
+import multiprocessing
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from utils.sync_jobs import POLL_INTERVAL, run_worker, run_worker_pool
+
+
+def _worker(once, poll_interval, threads):
+    # Каждый процесс открывает собственное соединение с базой
+    db.connections.close_all()
+    if threads > 1:
+        run_worker_pool(threads, once=once, poll_interval=poll_interval)
+    else:
+        run_worker(once=once, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры фоновой синхронизации устройств'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов-воркеров')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Потоков в каждом воркере: задачи разных устройств выполняются параллельно')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь и завершиться')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help='Пауза между опросами пустой очереди, сек')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        threads = max(options['threads'], 1)
+        if workers == 1:
+            if threads > 1:
+                processed = run_worker_pool(threads, once=options['once'], poll_interval=options['poll_interval'])
+            else:
+                processed = run_worker(once=options['once'], poll_interval=options['poll_interval'])
+            self.stdout.write(self.style.SUCCESS(f'Обработано задач: {processed}'))
+            return
+
+        db.connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_worker, args=(options['once'], options['poll_interval'], threads))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Запущено воркеров: {workers}')
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
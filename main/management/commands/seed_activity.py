@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.seeding import SEED_BATCH_SIZE, USERNAME_PREFIX, run_seed
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетической почасовой историей активности для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Количество пользователей')
+        parser.add_argument('--days', type=int, default=365, help='Глубина истории, сутки')
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов-генераторов')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора: одинаковое зерно даёт одинаковые данные')
+        parser.add_argument('--end', type=date.fromisoformat, default=None,
+                            help='Дата (ГГГГ-ММ-ДД), до которой генерируется история; по умолчанию сегодня')
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE, help='Строк в одной транзакции записи')
+        parser.add_argument('--prefix', default=USERNAME_PREFIX, help='Префикс имён создаваемых пользователей')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users, --days и --batch-size должны быть положительными')
+        result = run_seed(
+            users=options['users'], days=options['days'], workers=max(options['workers'], 1), seed=options['seed'],
+            end_date=options['end'], batch_size=options['batch_size'], prefix=options['prefix'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано строк {result['rows']} за {result['seconds']:.1f} с ({result['rows_per_s']:.0f} строк/с)"
+        ))
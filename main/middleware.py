@@ -0,0 +1,165 @@
+import cProfile
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from utils.request_metrics import record_request
+
+logger = logging.getLogger('main.metrics')
+
+# Накопленное время рендеринга шаблонов и счётчик SQL текущего запроса; контекст переходит
+# и в потоки sync_to_async, где async-ORM выполняет запросы асинхронных представлений
+_template_time = ContextVar('template_time', default=None)
+_query_recorder = ContextVar('query_recorder', default=None)
+_original_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    elapsed = _template_time.get()
+    if elapsed is None:
+        return _original_render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context, request)
+    finally:
+        elapsed[0] += time.perf_counter() - started
+
+
+# Оборачивается только бэкенд-шаблон, через который идёт render() во view;
+# {% extends %} и {% include %} рендерятся внутри него и дважды не учитываются
+Template.render = _timed_render
+
+
+class _QueryRecorder:
+    """execute_wrapper: считает запросы, время SQL и повторы одинаковых запросов."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _query_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    # Соединения потоковые, поэтому обёртка ставится на каждое новое соединение, а не на текущее
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_recorder)
+for _connection in connections.all(initialized_only=True):
+    _install_query_recorder(None, _connection)
+
+
+class RequestMetricsMiddleware:
+    """
+    Замеры каждого запроса: число SQL-запросов, время SQL, шаблонов и Python.
+
+    Повтор одного и того же SQL не меньше N_PLUS_ONE_THRESHOLD раз помечается как N+1,
+    запросы дольше SLOW_REQUEST_MS пишутся в лог main.metrics. При PROFILE_SAMPLE_RATE > 0
+    доля запросов выполняется под cProfile, и профили медленнее PROFILE_THRESHOLD_MS
+    сохраняются в PROFILE_DIR.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', None)
+        self.n_plus_one_threshold = getattr(settings, 'N_PLUS_ONE_THRESHOLD', 5)
+        self.profile_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.profile_threshold_ms = getattr(settings, 'PROFILE_THRESHOLD_MS', 1000)
+        self.profile_dir = getattr(settings, 'PROFILE_DIR', None)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = _QueryRecorder()
+        template_time = [0.0]
+        tokens = _query_recorder.set(recorder), _template_time.set(template_time)
+        profiler = None
+        if self.profile_rate and self.profile_dir and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+
+        started = time.perf_counter()
+        try:
+            if profiler:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            _query_recorder.reset(tokens[0])
+            _template_time.reset(tokens[1])
+        self._finish(request, time.perf_counter() - started, recorder, template_time[0], profiler)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile видит только текущий поток, поэтому в асинхронном режиме профили не снимаются
+        recorder = _QueryRecorder()
+        template_time = [0.0]
+        tokens = _query_recorder.set(recorder), _template_time.set(template_time)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_recorder.reset(tokens[0])
+            _template_time.reset(tokens[1])
+        self._finish(request, time.perf_counter() - started, recorder, template_time[0], None)
+        return response
+
+    def _finish(self, request, duration, recorder, template_time, profiler):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        if view == 'metrics':
+            return
+
+        repeated = [(sql, count) for sql, count in recorder.statements.most_common(3)
+                    if count >= self.n_plus_one_threshold]
+        slow = self.slow_ms is not None and duration * 1000 >= self.slow_ms
+        record_request(view, duration, recorder.time, template_time, recorder.count, bool(repeated), slow)
+
+        if repeated:
+            logger.warning("N+1 в %s: %s", view, "; ".join(f"{count}× {sql}" for sql, count in repeated))
+        if slow:
+            logger.warning(
+                "Медленный запрос %s %s (%s): %.0f мс, SQL %d шт./%.0f мс, шаблоны %.0f мс",
+                request.method, request.path, view, duration * 1000,
+                recorder.count, recorder.time * 1000, template_time * 1000,
+            )
+        if profiler and duration * 1000 >= self.profile_threshold_ms:
+            self._dump_profile(profiler, view)
+
+    def _dump_profile(self, profiler, view):
+        directory = Path(self.profile_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        suffix = f"{time.strftime('%Y%m%d_%H%M%S')}_{random.randint(0, 9999):04d}"
+        path = directory / f"{view.replace(':', '_')}_{suffix}.prof"
+        profiler.dump_stats(path)
+        logger.info("Профиль запроса сохранён в %s", path)
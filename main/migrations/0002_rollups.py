@@ -0,0 +1,103 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+FIELDS = ('steps', 'calories', 'distance', 'standups', 'movements')
+
+
+def fill_rollups(apps, schema_editor):
+    """Часовые и дневные сводки по уже загруженным Activity, StandUp и Movement; по одному пользователю."""
+    Activity = apps.get_model('main', 'Activity')
+    StandUp = apps.get_model('main', 'StandUp')
+    Movement = apps.get_model('main', 'Movement')
+    HourlyRollup = apps.get_model('main', 'HourlyRollup')
+    DailyRollup = apps.get_model('main', 'DailyRollup')
+    tz = timezone.get_current_timezone()
+
+    user_ids = set(Activity.objects.values_list('user_id', flat=True).distinct())
+    user_ids.update(StandUp.objects.values_list('user_id', flat=True).distinct())
+    user_ids.update(Movement.objects.values_list('user_id', flat=True).distinct())
+
+    for user_id in sorted(user_ids):
+        hours = {}
+
+        def add(timestamp, **values):
+            hour = timezone.localtime(timestamp, tz).replace(minute=0, second=0, microsecond=0)
+            totals = hours.setdefault(hour, dict.fromkeys(FIELDS, 0))
+            for field, value in values.items():
+                totals[field] += value
+
+        for timestamp, steps, calories, distance in (
+            Activity.objects.filter(user_id=user_id).values_list('date', 'steps', 'calories', 'distance').iterator()
+        ):
+            add(timestamp, steps=steps, calories=calories, distance=distance)
+        for timestamp, count in StandUp.objects.filter(user_id=user_id).values_list('timestamp', 'count').iterator():
+            add(timestamp, standups=count)
+        for timestamp, count in Movement.objects.filter(user_id=user_id).values_list('timestamp', 'count').iterator():
+            add(timestamp, movements=count)
+
+        days = {}
+        for hour, totals in hours.items():
+            day = days.setdefault(hour.date(), dict.fromkeys(FIELDS, 0))
+            for field in FIELDS:
+                day[field] += totals[field]
+        HourlyRollup.objects.bulk_create(
+            [HourlyRollup(user_id=user_id, hour=hour, **totals) for hour, totals in hours.items()],
+            batch_size=BATCH_SIZE,
+        )
+        DailyRollup.objects.bulk_create(
+            [DailyRollup(user_id=user_id, day=day, **totals) for day, totals in days.items()],
+            batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('steps', models.IntegerField(default=0)),
+                ('calories', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0)),
+                ('standups', models.IntegerField(default=0)),
+                ('movements', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Сводка за день',
+                'verbose_name_plural': 'Сводки за день',
+                'unique_together': {('user', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('steps', models.IntegerField(default=0)),
+                ('calories', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0)),
+                ('standups', models.IntegerField(default=0)),
+                ('movements', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Сводка за час',
+                'verbose_name_plural': 'Сводки за час',
+                'unique_together': {('user', 'hour')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('inserted', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.device')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Задача синхронизации',
+                'verbose_name_plural': 'Задачи синхронизации',
+                'indexes': [models.Index(fields=['status', 'run_after'], name='main_syncjo_status_c0efe5_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('device',), name='unique_pending_sync_job_per_device')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:21
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_samples(apps, schema_editor):
+    """Перед созданием уникальных индексов оставляем по одной записи на (user, timestamp)."""
+    for model_name in ('StandUp', 'Movement'):
+        model = apps.get_model('main', model_name)
+        duplicates = (
+            model.objects.values('user', 'timestamp')
+            .annotate(first_id=Min('id'), rows=Count('id'))
+            .filter(rows__gt=1)
+        )
+        for duplicate in duplicates.iterator():
+            model.objects.filter(user=duplicate['user'], timestamp=duplicate['timestamp']).exclude(
+                id=duplicate['first_id']
+            ).delete()
+
+
+# Покрывающие индексы для сумм по диапазону времени; INCLUDE поддерживает только PostgreSQL
+COVERING_INDEXES = [
+    ('Activity', models.Index(fields=['user', 'date'], include=['steps', 'calories', 'distance'],
+                              name='activity_user_date_cover')),
+    ('HourlyRollup', models.Index(fields=['user', 'hour'],
+                                  include=['steps', 'calories', 'distance', 'standups', 'movements'],
+                                  name='hourlyrollup_user_hour_cover')),
+    ('DailyRollup', models.Index(fields=['user', 'day'],
+                                 include=['steps', 'calories', 'distance', 'standups', 'movements'],
+                                 name='dailyrollup_user_day_cover')),
+]
+
+
+def add_covering_indexes(apps, schema_editor):
+    if not schema_editor.connection.features.supports_covering_indexes:
+        return
+    for model_name, index in COVERING_INDEXES:
+        schema_editor.add_index(apps.get_model('main', model_name), index)
+
+
+def remove_covering_indexes(apps, schema_editor):
+    if not schema_editor.connection.features.supports_covering_indexes:
+        return
+    for model_name, index in COVERING_INDEXES:
+        schema_editor.remove_index(apps.get_model('main', model_name), index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_sync_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_samples, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='movement',
+            constraint=models.UniqueConstraint(fields=('user', 'timestamp'), name='unique_movement_user_timestamp'),
+        ),
+        migrations.AddConstraint(
+            model_name='standup',
+            constraint=models.UniqueConstraint(fields=('user', 'timestamp'), name='unique_standup_user_timestamp'),
+        ),
+        migrations.RunPython(add_covering_indexes, remove_covering_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_activity_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitystats',
+            name='archived_before',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+COVERING_INDEX = models.Index(fields=['user', 'timestamp'],
+                              include=['steps', 'calories', 'distance_m', 'standups', 'movements'],
+                              name='hourlysample_user_ts_cover')
+
+
+def merge_samples(apps, schema_editor):
+    """Переносит строки Activity, StandUp и Movement в одну строку HourlySample на (user, timestamp)."""
+    Activity = apps.get_model('main', 'Activity')
+    StandUp = apps.get_model('main', 'StandUp')
+    Movement = apps.get_model('main', 'Movement')
+    HourlySample = apps.get_model('main', 'HourlySample')
+
+    user_ids = set(Activity.objects.values_list('user_id', flat=True).distinct())
+    user_ids.update(StandUp.objects.values_list('user_id', flat=True).distinct())
+    user_ids.update(Movement.objects.values_list('user_id', flat=True).distinct())
+
+    for user_id in sorted(user_ids):
+        samples = {}
+
+        def sample(timestamp):
+            return samples.setdefault(timestamp, HourlySample(user_id=user_id, timestamp=timestamp))
+
+        for timestamp, steps, calories, distance in (
+            Activity.objects.filter(user_id=user_id).values_list('date', 'steps', 'calories', 'distance').iterator()
+        ):
+            row = sample(timestamp)
+            row.steps, row.calories, row.distance_m = steps, calories, round(distance * 1000)
+        for timestamp, count in StandUp.objects.filter(user_id=user_id).values_list('timestamp', 'count').iterator():
+            sample(timestamp).standups = count
+        for timestamp, count in Movement.objects.filter(user_id=user_id).values_list('timestamp', 'count').iterator():
+            sample(timestamp).movements = count
+
+        HourlySample.objects.bulk_create(samples.values(), batch_size=BATCH_SIZE)
+
+
+def split_samples(apps, schema_editor):
+    Activity = apps.get_model('main', 'Activity')
+    StandUp = apps.get_model('main', 'StandUp')
+    Movement = apps.get_model('main', 'Movement')
+    HourlySample = apps.get_model('main', 'HourlySample')
+
+    activities, standups, movements = [], [], []
+    for sample in HourlySample.objects.order_by('user_id', 'timestamp').iterator(chunk_size=BATCH_SIZE):
+        activities.append(Activity(user_id=sample.user_id, date=sample.timestamp, steps=sample.steps,
+                                   calories=sample.calories, distance=sample.distance_m / 1000))
+        standups.append(StandUp(user_id=sample.user_id, timestamp=sample.timestamp, count=sample.standups))
+        movements.append(Movement(user_id=sample.user_id, timestamp=sample.timestamp, count=sample.movements))
+        if len(activities) >= BATCH_SIZE:
+            Activity.objects.bulk_create(activities)
+            StandUp.objects.bulk_create(standups)
+            Movement.objects.bulk_create(movements)
+            activities, standups, movements = [], [], []
+    Activity.objects.bulk_create(activities)
+    StandUp.objects.bulk_create(standups)
+    Movement.objects.bulk_create(movements)
+
+
+def add_covering_index(apps, schema_editor):
+    if schema_editor.connection.features.supports_covering_indexes:
+        schema_editor.add_index(apps.get_model('main', 'HourlySample'), COVERING_INDEX)
+
+
+def remove_covering_index(apps, schema_editor):
+    if schema_editor.connection.features.supports_covering_indexes:
+        schema_editor.remove_index(apps.get_model('main', 'HourlySample'), COVERING_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_activity_stats_archived_before'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlySample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('steps', models.PositiveIntegerField(default=0)),
+                ('calories', models.PositiveIntegerField(default=0)),
+                ('distance_m', models.PositiveIntegerField(default=0)),
+                ('standups', models.PositiveSmallIntegerField(default=0)),
+                ('movements', models.PositiveSmallIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Почасовая запись',
+                'verbose_name_plural': 'Почасовые записи',
+                'constraints': [
+                    models.UniqueConstraint(fields=('user', 'timestamp'), name='unique_hourlysample_user_timestamp'),
+                ],
+            },
+        ),
+        migrations.RunPython(merge_samples, split_samples),
+        migrations.RunPython(add_covering_index, remove_covering_index),
+        migrations.DeleteModel(
+            name='Activity',
+        ),
+        migrations.DeleteModel(
+            name='Movement',
+        ),
+        migrations.DeleteModel(
+            name='StandUp',
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def attribute_samples(apps, schema_editor):
+    """Записи, загруженные до привязки к устройствам, относятся к первому устройству пользователя."""
+    Device = apps.get_model('main', 'Device')
+    HourlySample = apps.get_model('main', 'HourlySample')
+
+    first_devices = Device.objects.values('user_id').annotate(device_id=Min('id'))
+    for row in first_devices.iterator():
+        HourlySample.objects.filter(user_id=row['user_id'], device__isnull=True).update(device_id=row['device_id'])
+
+    # Курсор синхронизации продолжает уже загруженную историю
+    cursors = HourlySample.objects.filter(device__isnull=False).values('device_id').annotate(last=Max('timestamp'))
+    for row in cursors.iterator():
+        Device.objects.filter(id=row['device_id']).update(last_record_at=row['last'])
+
+
+def merge_device_samples(apps, schema_editor):
+    """Откат к уникальности (user, timestamp): из записей разных устройств за час остаётся одна."""
+    HourlySample = apps.get_model('main', 'HourlySample')
+    duplicates = (
+        HourlySample.objects.values('user_id', 'timestamp').annotate(keep=Min('id'), rows=models.Count('id'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates.iterator():
+        HourlySample.objects.filter(user_id=row['user_id'], timestamp=row['timestamp']).exclude(
+            id=row['keep']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_hourly_sample'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='hourlysample',
+            name='unique_hourlysample_user_timestamp',
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='last_record_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='hourlysample',
+            name='device',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main.device'),
+        ),
+        migrations.RunPython(attribute_samples, merge_device_samples),
+        migrations.AddField(
+            model_name='profile',
+            name='merge_policy',
+            field=models.CharField(choices=[('sum', 'Суммировать устройства'), ('max', 'Максимум по устройствам'), ('prefer', 'Основное устройство')], default='sum', max_length=10, verbose_name='Объединение данных устройств'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='preferred_device',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.device', verbose_name='Основное устройство'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlysample',
+            index=models.Index(fields=['user', 'timestamp'], name='main_hourly_user_id_e4b619_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlysample',
+            constraint=models.UniqueConstraint(fields=('user', 'device', 'timestamp'), name='unique_hourlysample_user_device_timestamp'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlysample',
+            constraint=models.UniqueConstraint(condition=models.Q(('device__isnull', True)), fields=('user', 'timestamp'), name='unique_hourlysample_user_timestamp_no_device'),
+        ),
+    ]
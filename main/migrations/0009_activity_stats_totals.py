@@ -0,0 +1,67 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:48
+
+from django.db import migrations, models
+from django.db.models import Max, Sum
+
+
+def fill_totals(apps, schema_editor):
+    """
+    Начальные итоги за всё время по уже накопленным дневным сводкам и сырым данным.
+
+    Дневные сводки учитывают и архивированные месяцы, поэтому берутся в первую очередь.
+    Пользователям, у которых сводок нет (они не были построены), итоги считаются по часовым записям.
+    """
+    ActivityStats = apps.get_model('main', 'ActivityStats')
+    DailyRollup = apps.get_model('main', 'DailyRollup')
+    HourlySample = apps.get_model('main', 'HourlySample')
+
+    totals = {
+        row['user_id']: (row['steps'], row['calories'], row['distance'])
+        for row in DailyRollup.objects.values('user_id').annotate(
+            steps=Sum('steps'), calories=Sum('calories'), distance=Sum('distance')
+        ).order_by().iterator()
+    }
+    samples = HourlySample.objects.exclude(user_id__in=list(totals)).values('user_id').annotate(
+        steps=Sum('steps'), calories=Sum('calories'), distance_m=Sum('distance_m')
+    ).order_by()
+    for row in samples.iterator():
+        totals[row['user_id']] = (row['steps'], row['calories'], (row['distance_m'] or 0) / 1000)
+    for user_id, (steps, calories, distance) in totals.items():
+        ActivityStats.objects.update_or_create(user_id=user_id, defaults={
+            'total_steps': steps or 0,
+            'total_calories': calories or 0,
+            'total_distance': distance or 0,
+        })
+    last_samples = HourlySample.objects.values('user_id').annotate(last=Max('timestamp')).order_by()
+    for row in last_samples.iterator():
+        ActivityStats.objects.update_or_create(user_id=row['user_id'], defaults={'last_sample_at': row['last']})
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_device_samples'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitystats',
+            name='last_sample_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='activitystats',
+            name='total_calories',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='activitystats',
+            name='total_distance',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='activitystats',
+            name='total_steps',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_activity_stats_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='api_token_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:53
+
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_coverage(apps, schema_editor):
+    """Маски покрытия по уже сохранённым часам; строки копятся по одному пользователю."""
+    DayCoverage = apps.get_model('main', 'DayCoverage')
+    HourlySample = apps.get_model('main', 'HourlySample')
+    tz = timezone.get_current_timezone()
+    midnights = {}
+
+    def flush(masks):
+        DayCoverage.objects.bulk_create([
+            DayCoverage(user_id=user_id, device_id=device_id, day=day, hours=hours)
+            for (user_id, device_id, day), hours in masks.items()
+        ], batch_size=500)
+
+    masks = {}
+    current_user = None
+    samples = HourlySample.objects.order_by('user_id', 'device_id', 'timestamp').values_list(
+        'user_id', 'device_id', 'timestamp'
+    )
+    for user_id, device_id, timestamp in samples.iterator(chunk_size=2000):
+        if user_id != current_user:
+            flush(masks)
+            masks, current_user = {}, user_id
+        day = timezone.localtime(timestamp, tz).date()
+        if day not in midnights:
+            midnights[day] = timezone.make_aware(datetime.combine(day, time.min), tz).astimezone(dt_timezone.utc)
+        hour = int((timestamp.astimezone(dt_timezone.utc) - midnights[day]) // timedelta(hours=1))
+        key = (user_id, device_id, day)
+        masks[key] = masks.get(key, 0) | (1 << hour)
+    flush(masks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_device_api_token'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayCoverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('hours', models.IntegerField(default=0)),
+                ('device', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main.device')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Покрытие суток',
+                'verbose_name_plural': 'Покрытие суток',
+                'constraints': [models.UniqueConstraint(fields=('user', 'device', 'day'), name='unique_daycoverage_user_device_day'), models.UniqueConstraint(condition=models.Q(('device__isnull', True)), fields=('user', 'day'), name='unique_daycoverage_user_day_no_device')],
+            },
+        ),
+        migrations.RunPython(fill_coverage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_day_coverage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('daily_goal', 'Дневная цель достигнута'), ('low_activity', 'Мало активности несколько часов подряд')], max_length=20, verbose_name='Тип')),
+                ('metric', models.CharField(choices=[('steps', 'Шаги'), ('calories', 'Калории'), ('distance', 'Дистанция, км'), ('standups', 'Вставания'), ('movements', 'Движения')], default='steps', max_length=20, verbose_name='Метрика')),
+                ('threshold', models.FloatField(blank=True, null=True, verbose_name='Порог')),
+                ('hours', models.PositiveSmallIntegerField(default=3, verbose_name='Часов подряд')),
+                ('active_from', models.PositiveSmallIntegerField(default=8, verbose_name='С какого часа')),
+                ('active_to', models.PositiveSmallIntegerField(default=22, verbose_name='До какого часа')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Включено')),
+                ('streak', models.PositiveSmallIntegerField(default=0, editable=False)),
+                ('evaluated_until', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('last_fired_on', models.DateField(blank=True, editable=False, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Правило уведомлений',
+                'verbose_name_plural': 'Правила уведомлений',
+            },
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.CharField(max_length=255)),
+                ('event_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('is_read', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('rule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.rule')),
+            ],
+            options={
+                'verbose_name': 'Уведомление',
+                'verbose_name_plural': 'Уведомления',
+            },
+        ),
+        migrations.CreateModel(
+            name='Goal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('steps', 'Шаги'), ('distance', 'Дистанция, км'), ('standups', 'Вставания')], max_length=20)),
+                ('daily_target', models.FloatField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Цель',
+                'verbose_name_plural': 'Цели',
+                'unique_together': {('user', 'metric')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(fields=['user', 'is_active'], name='main_rule_user_id_4660cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='main_notifi_user_id_db2a78_idx'),
+        ),
+    ]
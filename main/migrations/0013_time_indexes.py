@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_goals_rules_notifications'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['day'], name='main_dailyr_day_16807e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyrollup',
+            index=models.Index(fields=['hour'], name='main_hourly_hour_8f9c19_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlysample',
+            index=models.Index(fields=['timestamp'], name='main_hourly_timesta_862d4f_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Profile(models.Model):
@@ -9,30 +10,33 @@ class Profile(models.Model):
     phone = models.CharField(max_length=20, null=True)
     email = models.EmailField(null=False)
     profile_image = models.ImageField(upload_to='profile/', null=True, blank=True, default='profile/default.jpg')
+    # Как сводятся показания нескольких устройств за один час
+    MERGE_SUM = 'sum'
+    MERGE_MAX = 'max'
+    MERGE_PREFER = 'prefer'
+    MERGE_POLICY_CHOICES = [
+        (MERGE_SUM, 'Суммировать устройства'),
+        (MERGE_MAX, 'Максимум по устройствам'),
+        (MERGE_PREFER, 'Основное устройство'),
+    ]
+    merge_policy = models.CharField(max_length=10, choices=MERGE_POLICY_CHOICES, default=MERGE_SUM, null=False,
+                                    verbose_name='Объединение данных устройств')
+    preferred_device = models.ForeignKey('Device', on_delete=models.SET_NULL, null=True, blank=True,
+                                         related_name='+', verbose_name='Основное устройство')
 
     class Meta:
         verbose_name = 'Профиль'
         verbose_name_plural = 'Профили'
 
 
-class Activity(models.Model):
-    calories = models.IntegerField(null=False)
-    date = models.DateTimeField(null=False)
-    distance = models.FloatField(null=False)
-    steps = models.IntegerField(null=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
-
-    class Meta:
-        verbose_name = 'Действие'
-        verbose_name_plural = 'Действия'
-
-        unique_together = ('user', 'date')
-
-
 class Device(models.Model):
     device_name = models.CharField(max_length=50, null=False)
     device_type = models.CharField(max_length=50, null=False)
     last_import_date = models.DateTimeField(auto_now_add=True, null=False)
+    # Курсор синхронизации: час последней загруженной записи; следующая синхронизация начинается с него
+    last_record_at = models.DateTimeField(null=True, blank=True)
+    # SHA-256 токена для загрузки данных самим устройством (POST /api/devices/<id>/samples/)
+    api_token_hash = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
 
     def __str__(self):
@@ -44,21 +48,226 @@ class Device(models.Model):
         verbose_name_plural = 'Устройства'
 
 
-class StandUp(models.Model):
-    count = models.IntegerField(null=False)
+class HourlySample(models.Model):
+    """
+    Одна почасовая запись устройства: все пять метрик в одной строке на (user, device, timestamp).
+
+    Показания разных устройств за один час хранятся отдельно и сводятся в HourlyRollup
+    по Profile.merge_policy; device пуст у записей, загруженных без привязки к устройству.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, null=True, blank=True)
     timestamp = models.DateTimeField(null=False)
+    steps = models.PositiveIntegerField(null=False, default=0)
+    calories = models.PositiveIntegerField(null=False, default=0)
+    # Дистанция хранится целым числом метров; в сводках и API — километры
+    distance_m = models.PositiveIntegerField(null=False, default=0)
+    standups = models.PositiveSmallIntegerField(null=False, default=0)
+    movements = models.PositiveSmallIntegerField(null=False, default=0)
+
+    @property
+    def distance(self):
+        return self.distance_m / 1000
+
+    class Meta:
+        verbose_name = 'Почасовая запись'
+        verbose_name_plural = 'Почасовые записи'
+
+        # Отдельный индекс по времени — для выборок по всем пользователям (хранение, фильтр в админке)
+        indexes = [models.Index(fields=['user', 'timestamp']), models.Index(fields=['timestamp'])]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device', 'timestamp'],
+                                    name='unique_hourlysample_user_device_timestamp'),
+            models.UniqueConstraint(fields=['user', 'timestamp'], condition=models.Q(device__isnull=True),
+                                    name='unique_hourlysample_user_timestamp_no_device'),
+        ]
+
+
+class DayCoverage(models.Model):
+    """
+    Покрытие суток почасовыми данными устройства: бит i поля hours — i-й час от местной полуночи.
+
+    В сутках перевода часов 23 или 25 часов, поэтому битов может быть до 25.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, null=True, blank=True)
+    day = models.DateField(null=False)
+    hours = models.IntegerField(null=False, default=0)
 
     class Meta:
-        verbose_name = 'Вставание'
-        verbose_name_plural = 'Вставания'
+        verbose_name = 'Покрытие суток'
+        verbose_name_plural = 'Покрытие суток'
 
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device', 'day'], name='unique_daycoverage_user_device_day'),
+            models.UniqueConstraint(fields=['user', 'day'], condition=models.Q(device__isnull=True),
+                                    name='unique_daycoverage_user_day_no_device'),
+        ]
+
+
+class HourlyRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    hour = models.DateTimeField(null=False)
+    steps = models.IntegerField(null=False, default=0)
+    calories = models.IntegerField(null=False, default=0)
+    distance = models.FloatField(null=False, default=0)
+    standups = models.IntegerField(null=False, default=0)
+    movements = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        verbose_name = 'Сводка за час'
+        verbose_name_plural = 'Сводки за час'
+
+        unique_together = ('user', 'hour')
+        indexes = [models.Index(fields=['hour'])]
+
+
+class DailyRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    day = models.DateField(null=False)
+    steps = models.IntegerField(null=False, default=0)
+    calories = models.IntegerField(null=False, default=0)
+    distance = models.FloatField(null=False, default=0)
+    standups = models.IntegerField(null=False, default=0)
+    movements = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        verbose_name = 'Сводка за день'
+        verbose_name_plural = 'Сводки за день'
+
+        unique_together = ('user', 'day')
+        indexes = [models.Index(fields=['day'])]
+
+
+class SyncJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, null=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, null=False)
+    attempts = models.IntegerField(null=False, default=0)
+    max_attempts = models.IntegerField(null=False, default=3)
+    run_after = models.DateTimeField(null=False, default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    updated_at = models.DateTimeField(auto_now=True, null=False)
+    inserted = models.IntegerField(null=False, default=0)
+    skipped = models.IntegerField(null=False, default=0)
+    updated = models.IntegerField(null=False, default=0)
+    error = models.TextField(null=False, blank=True, default='')
+
+    class Meta:
+        verbose_name = 'Задача синхронизации'
+        verbose_name_plural = 'Задачи синхронизации'
+
+        indexes = [models.Index(fields=['status', 'run_after'])]
+        constraints = [
+            # Не больше одной ожидающей задачи на устройство
+            models.UniqueConstraint(fields=['device'], condition=models.Q(status='pending'),
+                                    name='unique_pending_sync_job_per_device'),
+        ]
+
+
+class ActivityStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, null=False, related_name='activity_stats')
+    # Версия данных пользователя: сдвигается при каждой загрузке и перезаписи сводок (пересчёт, архивация);
+    # по ней строятся ETag/Last-Modified API и ключи кэша графиков
+    last_ingested_at = models.DateTimeField(null=True)
+    # Сырые данные до этого момента перенесены в архив; в базе остались только дневные сводки
+    archived_before = models.DateTimeField(null=True)
+    # Итоги за всё время по дневным сводкам; поддерживаются при каждом пересчёте сводок
+    total_steps = models.BigIntegerField(null=False, default=0)
+    total_calories = models.BigIntegerField(null=False, default=0)
+    total_distance = models.FloatField(null=False, default=0)
+    last_sample_at = models.DateTimeField(null=True)
+
+    class Meta:
+        verbose_name = 'Статистика активности'
+        verbose_name_plural = 'Статистика активности'
+
+
+class Goal(models.Model):
+    """Дневная цель пользователя по метрике; для недели, месяца и года умножается на число суток."""
+    METRIC_CHOICES = [
+        ('steps', 'Шаги'),
+        ('distance', 'Дистанция, км'),
+        ('standups', 'Вставания'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, null=False)
+    daily_target = models.FloatField(null=False)
+
+    class Meta:
+        verbose_name = 'Цель'
+        verbose_name_plural = 'Цели'
+
+        unique_together = ('user', 'metric')
+
+
+class Rule(models.Model):
+    """
+    Правило уведомлений, проверяемое при каждой загрузке только по новым часам.
+
+    Состояние между синхронизациями хранится в самой строке: streak — сколько часов подряд
+    выполняется условие низкой активности, evaluated_until — последний проверенный час,
+    last_fired_on — сутки, за которые уже отправлено уведомление о цели.
+    """
+    KIND_DAILY_GOAL = 'daily_goal'
+    KIND_LOW_ACTIVITY = 'low_activity'
+    KIND_CHOICES = [
+        (KIND_DAILY_GOAL, 'Дневная цель достигнута'),
+        (KIND_LOW_ACTIVITY, 'Мало активности несколько часов подряд'),
+    ]
+    METRIC_CHOICES = [
+        ('steps', 'Шаги'),
+        ('calories', 'Калории'),
+        ('distance', 'Дистанция, км'),
+        ('standups', 'Вставания'),
+        ('movements', 'Движения'),
+    ]
 
-class Movement(models.Model):
-    count = models.IntegerField(null=False)
-    timestamp = models.DateTimeField(null=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, null=False, verbose_name='Тип')
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, default='steps', null=False,
+                              verbose_name='Метрика')
+    # Порог: за час для низкой активности; для дневной цели пусто — берётся цель пользователя
+    threshold = models.FloatField(null=True, blank=True, verbose_name='Порог')
+    hours = models.PositiveSmallIntegerField(default=3, null=False, verbose_name='Часов подряд')
+    # Местные часы [active_from, active_to), в которые проверяется низкая активность
+    active_from = models.PositiveSmallIntegerField(default=8, null=False, verbose_name='С какого часа')
+    active_to = models.PositiveSmallIntegerField(default=22, null=False, verbose_name='До какого часа')
+    is_active = models.BooleanField(default=True, null=False, verbose_name='Включено')
+    streak = models.PositiveSmallIntegerField(default=0, null=False, editable=False)
+    evaluated_until = models.DateTimeField(null=True, blank=True, editable=False)
+    last_fired_on = models.DateField(null=True, blank=True, editable=False)
 
     class Meta:
-        verbose_name = 'Движение'
-        verbose_name_plural = 'Движения'
+        verbose_name = 'Правило уведомлений'
+        verbose_name_plural = 'Правила уведомлений'
+
+        indexes = [models.Index(fields=['user', 'is_active'])]
+
+
+class Notification(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    rule = models.ForeignKey(Rule, on_delete=models.SET_NULL, null=True, blank=True)
+    message = models.CharField(max_length=255, null=False)
+    # Час данных, на котором сработало правило
+    event_at = models.DateTimeField(null=False)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    is_read = models.BooleanField(default=False, null=False)
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Уведомления'
+
+        indexes = [models.Index(fields=['user', 'created_at'])]
@@ -1,3 +1,738 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .forms import RuleForm
+from .models import (
+    ActivityStats, DailyRollup, DayCoverage, Device, Goal, HourlyRollup, HourlySample, Notification, Profile, Rule,
+    SyncJob,
+)
+from utils.activity_generator import generate_activity_records
+from utils import activity_processor
+from utils.activity_processor import ingest_activities, iter_activity_records, process_activity_records
+from utils.analytics import batch_report
+from utils.coverage import existing_hours
+from utils.device_ingest import issue_device_token
+from utils.goals import NOTIFY_WINDOW, evaluate_rules
+from utils.history_browser import decode_cursor, encode_cursor, history_page
+from utils.history_export import export_history, import_history
+from utils.retention import apply_retention
+from utils.rollups import lifetime_totals, rebuild_rollups, totals_mismatch
+from utils import sync_jobs
+from utils.sync_jobs import RUNNING_TIMEOUT, claim_next_job, enqueue_sync, run_job
+
+# Тесты не трогают общие файловые кэши запущенного приложения во временном каталоге
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in settings.CACHES
+}
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+@override_settings(CACHES=TEST_CACHES)
+class DashboardQueryPlanTests(TestCase):
+    """Запросы страниц метрик должны идти по индексам, а не полным сканированием таблиц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='explain', password='password')
+        Profile.objects.create(user=cls.user, gender='M', birthdate='2000-01-01', email='explain@example.com')
+        Device.objects.create(user=cls.user, device_name='band', device_type='tracker')
+        process_activity_records(generate_activity_records(hours=24 * 40), cls.user)
+
+    def setUp(self):
+        caches[settings.DASHBOARD_CACHE_ALIAS].clear()
+        self.client.force_login(self.user)
+
+    def _query_plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [row[-1] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+    def _full_scans(self, plan):
+        if connection.vendor == 'sqlite':
+            return [line for line in plan if line.startswith('SCAN main_')]
+        return [line for line in plan if 'Seq Scan on main_' in line]
+
+    def test_dashboard_views_use_indexes(self):
+        for name in ('steps', 'movements', 'standups'):
+            for time_range in ('day', 'week', 'month', 'year'):
+                with self.subTest(view=name, range=time_range):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(reverse(name), {'range': time_range})
+                    self.assertEqual(response.status_code, 200)
+
+                    selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+                    self.assertTrue(any('main_' in sql for sql in selects))
+                    for sql in selects:
+                        self.assertEqual(self._full_scans(self._query_plan(sql)), [], sql)
+
+    def test_admin_date_filters_use_indexes(self):
+        admin_user = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(admin_user)
+        # Те же границы, что у ссылки «Последние 7 дней» фильтра DateFieldListFilter
+        today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        filters = {
+            'main_hourlysample_changelist': ('timestamp', today),
+            'main_hourlyrollup_changelist': ('hour', today),
+            'main_dailyrollup_changelist': ('day', today.date()),
+        }
+        for view, (field, day) in filters.items():
+            with self.subTest(view=view):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(f'admin:{view}'), {
+                        f'{field}__gte': str(day - timedelta(days=7)),
+                        f'{field}__lt': str(day + timedelta(days=1)),
+                    })
+                self.assertEqual(response.status_code, 200)
+
+                selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+                self.assertTrue(any('main_' in sql for sql in selects))
+                for sql in selects:
+                    self.assertEqual(self._full_scans(self._query_plan(sql)), [], sql)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DeviceSamplesApiTests(TestCase):
+    """Загрузка данных самим устройством: токен, ограничения сжатия, идемпотентность и схема записей."""
+
+    def setUp(self):
+        caches[settings.INGEST_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username='device', password='password')
+        Profile.objects.create(user=self.user, gender='M', birthdate='2000-01-01', email='device@example.com')
+        self.device = Device.objects.create(user=self.user, device_name='band', device_type='tracker')
+        self.token = issue_device_token(self.device)
+        self.url = reverse('device_samples_api', args=[self.device.id])
+
+    def _record(self, hour=10, steps=100):
+        return {'date': f'2024-05-01 {hour}:00', 'steps': steps, 'calories': 10, 'distance': 0.1,
+                'standups': 1, 'movements': 5}
+
+    def _post(self, body, token=None, url=None, content_type='application/json', **headers):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        headers = {name.replace('_', '-'): value for name, value in headers.items()}
+        headers.setdefault('Authorization', f'Bearer {token or self.token}')
+        return self.client.post(url or self.url, body, content_type=content_type, headers=headers)
+
+    def test_rejects_missing_and_wrong_tokens(self):
+        self.assertEqual(self._post([self._record()], Authorization='').status_code, 401)
+        self.assertEqual(self._post([self._record()], token='wrong').status_code, 401)
+        other = Device.objects.create(user=self.user, device_name='watch', device_type='watch')
+        url = reverse('device_samples_api', args=[other.id])
+        self.assertEqual(self._post([self._record()], url=url).status_code, 401)
+        self.assertFalse(HourlySample.objects.exists())
+
+    def test_rotated_and_deleted_devices_lose_access(self):
+        self.assertEqual(self._post([self._record()]).status_code, 201)
+        old_token = self.token
+        Device.objects.filter(id=self.device.id).update(api_token_hash=hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(self._post([self._record(11)], token=old_token).status_code, 401)
+
+        new_token = issue_device_token(self.device)
+        self.assertEqual(self._post([self._record(12)], token=new_token).status_code, 201)
+        self.device.delete()
+        self.assertEqual(self._post([self._record(13)], token=new_token).status_code, 401)
+
+    def test_gzip_limits(self):
+        body = gzip.compress(json.dumps([self._record()]).encode())
+        self.assertEqual(self._post(body, Content_Encoding='gzip').status_code, 201)
+        self.assertEqual(self._post(body[:-8], Content_Encoding='gzip').status_code, 400)
+        self.assertEqual(self._post(body, Content_Encoding='br').status_code, 415)
+        with self.settings(INGEST_MAX_PAYLOAD_BYTES=1024):
+            bomb = gzip.compress(b' ' * 4096 + json.dumps([self._record()]).encode())
+            self.assertEqual(self._post(bomb, Content_Encoding='gzip').status_code, 413)
+        with self.settings(INGEST_MAX_BODY_BYTES=16):
+            self.assertEqual(self._post([self._record()]).status_code, 413)
+
+    def test_idempotency_key_replay_and_conflict(self):
+        first = self._post([self._record()], Idempotency_Key='upload-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['inserted'], 1)
+
+        replay = self._post([self._record()], Idempotency_Key='upload-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+
+        conflict = self._post([self._record(steps=200)], Idempotency_Key='upload-1')
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(HourlySample.objects.get().steps, 100)
+
+    def test_same_content_without_key_is_ingested_again(self):
+        self.assertEqual(self._post([self._record()]).status_code, 201)
+        HourlySample.objects.update(steps=1)
+        response = self._post([self._record()])
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(HourlySample.objects.get().steps, 100)
+
+    def test_content_hash_mismatch(self):
+        response = self._post([self._record()], X_Content_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(HourlySample.objects.exists())
+
+    def test_schema_errors_are_reported_per_record(self):
+        records = [self._record(), self._record(11, steps=-1), {**self._record(12), 'date': '2024-05-01 12:30'}, 'x']
+        response = self._post(records)
+        self.assertEqual(response.status_code, 400)
+        errors = {(error['index'], error['field']) for error in response.json()['errors']}
+        self.assertEqual(errors, {(1, 'steps'), (2, 'date'), (3, None)})
+        self.assertFalse(HourlySample.objects.exists())
+
+        ndjson = '\n'.join(json.dumps(record) for record in [self._record(), self._record(11)]).encode()
+        self.assertEqual(self._post(ndjson, content_type='application/x-ndjson').status_code, 201)
+        self.assertEqual(self._post(b'not json').status_code, 400)
+        self.assertEqual(self._post([self._record()], content_type='text/plain').status_code, 415)
+
+
+class RuleEvaluationTests(TestCase):
+    """Правила проверяются только по новым часам, а состояние между загрузками хранится в строке правила."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rules', password='password')
+        self.now = timezone.make_aware(datetime(2024, 5, 10, 12, 30))
+
+    def _hour(self, day, hour):
+        return timezone.make_aware(datetime(2024, 5, day, hour))
+
+    def _hours(self, day, hours, steps=10):
+        HourlyRollup.objects.bulk_create([
+            HourlyRollup(user=self.user, hour=self._hour(day, hour), steps=steps) for hour in hours
+        ])
+
+    def _low_activity_rule(self):
+        return Rule.objects.create(user=self.user, kind=Rule.KIND_LOW_ACTIVITY, metric='steps', threshold=50,
+                                   hours=3, active_from=0, active_to=24)
+
+    def test_low_activity_streak_carries_over_between_uploads(self):
+        rule = self._low_activity_rule()
+        self._hours(10, [8, 9])
+        self.assertEqual(evaluate_rules(self.user, self._hour(10, 8), self._hour(10, 9), now=self.now), [])
+        rule.refresh_from_db()
+        self.assertEqual((rule.streak, rule.evaluated_until), (2, self._hour(10, 9)))
+
+        self._hours(10, [10])
+        notifications = evaluate_rules(self.user, self._hour(10, 10), self._hour(10, 10), now=self.now)
+        self.assertEqual([notification.event_at for notification in notifications], [self._hour(10, 10)])
+        rule.refresh_from_db()
+        self.assertEqual((rule.streak, rule.evaluated_until), (0, self._hour(10, 10)))
+
+    def test_unfinished_hour_and_gaps_are_not_counted(self):
+        rule = self._low_activity_rule()
+        self._hours(10, [8, 9, 11, 12])
+        # Час 10 пропущен и прерывает серию; незаконченный час 12 ещё не проверяется
+        self.assertEqual(evaluate_rules(self.user, self._hour(10, 8), self._hour(10, 12), now=self.now), [])
+        rule.refresh_from_db()
+        self.assertEqual((rule.streak, rule.evaluated_until), (1, self._hour(10, 11)))
+
+    def test_history_outside_notify_window_is_silent(self):
+        rule = self._low_activity_rule()
+        rule.evaluated_until = self._hour(1, 9)
+        rule.streak = 2
+        rule.save()
+        horizon = self._hour(10, 12) - NOTIFY_WINDOW
+        self._hours(1, range(10, 24))
+        self._hours(8, [horizon.hour, horizon.hour + 1])
+
+        self.assertEqual(evaluate_rules(self.user, self._hour(1, 10), horizon + timedelta(hours=1), now=self.now), [])
+        rule.refresh_from_db()
+        # Давняя серия не продолжается: проверка начинается с границы окна уведомлений
+        self.assertEqual((rule.streak, rule.evaluated_until), (2, horizon + timedelta(hours=1)))
+
+    def test_daily_goal_fires_once_per_day(self):
+        Rule.objects.create(user=self.user, kind=Rule.KIND_DAILY_GOAL, metric='steps')
+        DailyRollup.objects.create(user=self.user, day=datetime(2024, 5, 9).date(), steps=12000)
+        DailyRollup.objects.create(user=self.user, day=datetime(2024, 5, 10).date(), steps=5000)
+
+        notifications = evaluate_rules(self.user, self._hour(9, 0), self._hour(10, 11), now=self.now)
+        self.assertEqual([notification.event_at for notification in notifications], [self._hour(9, 0)])
+
+        DailyRollup.objects.filter(day=datetime(2024, 5, 9).date()).update(steps=15000)
+        self.assertEqual(evaluate_rules(self.user, self._hour(9, 20), self._hour(9, 20), now=self.now), [])
+
+        DailyRollup.objects.filter(day=datetime(2024, 5, 10).date()).update(steps=10000)
+        notifications = evaluate_rules(self.user, self._hour(10, 11), self._hour(10, 11), now=self.now)
+        self.assertEqual([notification.event_at for notification in notifications], [self._hour(10, 0)])
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 2)
+
+    def test_daily_goal_rule_needs_threshold_without_goal(self):
+        data = {'kind': Rule.KIND_DAILY_GOAL, 'hours': 3, 'active_from': 8, 'active_to': 22}
+        self.assertTrue(RuleForm({**data, 'metric': 'steps'}).is_valid())
+        self.assertIn('threshold', RuleForm({**data, 'metric': 'calories'}).errors)
+        self.assertTrue(RuleForm({**data, 'metric': 'calories', 'threshold': 2000}).is_valid())
+
+
+class ActivityFileParserTests(SimpleTestCase):
+    """Потоковый разбор файла устройства не зависит от того, где проходят границы чанков."""
+
+    def _parse(self, text, chunk_size, suffix='.json'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(text)
+        self.addCleanup(os.remove, file.name)
+        with mock.patch.object(activity_processor, 'READ_CHUNK_SIZE', chunk_size):
+            return list(iter_activity_records(file.name))
+
+    def test_values_split_at_any_chunk_boundary(self):
+        payload = {
+            'device': {'id': 1234567, 'battery': 0.875, 'calibrated': True, 'note': None},
+            'offset': -2.5e10,
+            'activities': [
+                1234567, 2.5e10, True, None, 's',
+                {'date': '2024-05-01 10:00', 'steps': 1234, 'calories': 56.75, 'distance': 1.5e-1,
+                 'standups': 2, 'movements': 10, 'tags': ['a', {'b': []}]},
+            ],
+            'version': 3,
+        }
+        text = json.dumps(payload, indent=1)
+        for chunk_size in (1, 2, 3, 4, 5, 7, 9, 16, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._parse(text, chunk_size), payload['activities'])
+
+    def test_truncated_file_is_rejected(self):
+        for chunk_size in (1, 3, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                with self.assertRaises(ValueError):
+                    self._parse('{"activities": [1, 2.', chunk_size)
+
+    def test_ndjson_skips_metadata_lines(self):
+        lines = [{'device': 'band'}, {'date': '2024-05-01 10:00', 'steps': 1}, {'date': '2024-05-01 11:00', 'steps': 2}]
+        text = '\n'.join(json.dumps(line) for line in lines) + '\n\n'
+        self.assertEqual(self._parse(text, 3, suffix='.ndjson'), lines[1:])
+
+
+class AnalyticsReportTests(TestCase):
+    def test_batch_report_uses_each_users_goals(self):
+        end = datetime(2024, 5, 10).date()
+        users = [User.objects.create_user(username=name, password='password') for name in ('goal', 'default')]
+        Goal.objects.create(user=users[0], metric='steps', daily_target=100)
+        DailyRollup.objects.bulk_create([
+            DailyRollup(user=user, day=end - timedelta(days=offset), steps=150) for user in users for offset in range(3)
+        ])
+        report = batch_report(days=7, end=end)
+        self.assertEqual(report[users[0].id]['steps']['streaks'], {'current': 3, 'longest': 3})
+        self.assertEqual(report[users[1].id]['steps']['streaks'], {'current': 0, 'longest': 0})
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ingest', password='password')
+        self.device = Device.objects.create(user=self.user, device_name='band', device_type='tracker')
+
+    def _record(self, hour, **values):
+        return {'date': f'2024-05-01 {hour:02d}:00', 'steps': 100, 'calories': 10, 'distance': 0.1,
+                'standups': 1, 'movements': 5, **values}
+
+    def test_out_of_range_values_are_rejected_before_writing(self):
+        for values in ({'steps': -1}, {'standups': 40000}, {'distance': None}, {'movements': True}):
+            with self.subTest(values=values):
+                with self.assertRaises(ValueError):
+                    ingest_activities([self._record(10), self._record(11, **values)], self.user, device=self.device)
+        self.assertFalse(HourlySample.objects.exists())
+        self.assertFalse(DayCoverage.objects.exists())
+
+    def _statements(self, rows, field_count):
+        """Сколько запросов займёт bulk-операция над rows строками с field_count параметрами на строку."""
+        return math.ceil(rows / connection.ops.bulk_batch_size([None] * field_count, [None] * rows))
+
+    def _insert_statements(self, model, rows):
+        return self._statements(rows, len([field for field in model._meta.concrete_fields if not field.primary_key]))
+
+    def _ingest_statements(self, records, update_existing):
+        hours = len(records)
+        if update_existing:
+            # bulk_update: первичный ключ дважды (CASE и WHERE) и пять метрик на строку
+            return self._statements(hours, 7) + self._insert_statements(HourlyRollup, hours)
+        days = len({timezone.localtime(timezone.make_aware(record['date'])).date() for record in records})
+        return (self._insert_statements(HourlySample, hours) + self._insert_statements(HourlyRollup, hours)
+                + self._insert_statements(DailyRollup, days) + self._insert_statements(DayCoverage, days))
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        """Загрузка делает одно и то же число запросов, кроме разбиения bulk-операций по лимиту параметров."""
+        now = datetime(2024, 5, 10, 12)
+        small = list(generate_activity_records(hours=24, now_time=now))
+        counts = {}
+        for update_existing in (False, True):
+            with CaptureQueriesContext(connection) as queries:
+                ingest_activities(small, self.user, update_existing=update_existing, device=self.device)
+            counts[update_existing] = len(queries)
+
+        for hours in (240, 480):
+            user = User.objects.create_user(username=f'ingest-{hours}', password='password')
+            device = Device.objects.create(user=user, device_name='band', device_type='tracker')
+            large = list(generate_activity_records(hours=hours, now_time=now))
+            # Первая загрузка вставляет все часы, вторая перезаписывает их
+            for update_existing in (False, True):
+                with self.subTest(hours=hours, update_existing=update_existing):
+                    extra = (self._ingest_statements(large, update_existing)
+                             - self._ingest_statements(small, update_existing))
+                    with self.assertNumQueries(counts[update_existing] + extra):
+                        ingest_activities(large, user, update_existing=update_existing, device=device)
+
+    def test_rows_missing_from_coverage_are_counted_as_skipped(self):
+        ingest_activities([self._record(10), self._record(11)], self.user, device=self.device)
+        DayCoverage.objects.all().delete()
+        result = ingest_activities([self._record(hour) for hour in (10, 11, 12)], self.user, device=self.device)
+        self.assertEqual((result.inserted, result.skipped), (1, 2))
+        self.assertEqual(HourlySample.objects.count(), 3)
+        dates = [timezone.make_aware(datetime(2024, 5, 1, hour)) for hour in (10, 11, 12, 13)]
+        existing, _ = existing_hours(self.user, self.device, dates)
+        self.assertEqual(existing, set(dates[:3]))
+
+
+class HistoryExportTests(TestCase):
+    """Выгрузка export_history загружается import_history без потерь в обоих форматах."""
+
+    FIELDS = ('device__device_name', 'timestamp', 'steps', 'calories', 'distance_m', 'standups', 'movements')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.source = User.objects.create_user(username='source', password='password')
+        for name in ('band', 'watch'):
+            device = Device.objects.create(user=cls.source, device_name=name, device_type='tracker')
+            process_activity_records(generate_activity_records(hours=50), cls.source, device=device)
+        process_activity_records(generate_activity_records(hours=5), cls.source)
+
+    def _samples(self, user):
+        return sorted(HourlySample.objects.filter(user=user).values_list(*self.FIELDS), key=str)
+
+    def test_round_trip(self):
+        for fmt in ('csv', 'columns'):
+            with self.subTest(fmt=fmt):
+                target = User.objects.create_user(username=f'target-{fmt}', password='password')
+                text = ''.join(export_history(self.source, fmt))
+                result = import_history(io.StringIO(text), fmt, user=target)
+                self.assertEqual((result.inserted, result.skipped), (105, 0))
+                self.assertEqual(self._samples(target), self._samples(self.source))
+
+    @override_settings(ASYNC_VIEWS=True)
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.source)
+        response = await self.async_client.get(reverse('history_export_api'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(content.splitlines()), 106)
+
+    def test_export_streams_synchronously_under_wsgi(self):
+        self.client.force_login(self.source)
+        response = self.client.get(reverse('history_export_api'), {'format': 'columns'})
+        self.assertFalse(response.is_async)
+        self.assertEqual(sum(len(json.loads(line)['date']) for line in response.streaming_content), 105)
+
+    def test_invalid_values_are_rejected_with_record_number(self):
+        target = User.objects.create_user(username='target', password='password')
+        header = 'username,device,date,steps,calories,distance,standups,movements\n'
+        for row in ('x,band,2024-05-01T11:00:00+03:00,-5,1,0.1,0,0',
+                    'x,band,2024-05-01T11:00:00+03:00,5,1,0.1,40000,0',
+                    'x,band,2024-05-01T11:00:00+03:00,five,1,0.1,0,0'):
+            with self.subTest(row=row):
+                text = header + 'x,band,2024-05-01T10:00:00+03:00,5,1,0.1,0,0\n' + row + '\n'
+                with self.assertRaisesMessage(ValueError, 'Запись 2'):
+                    import_history(io.StringIO(text), 'csv', user=target)
+        self.assertFalse(HourlySample.objects.filter(user=target).exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricSeriesApiTests(TestCase):
+    """Условные запросы к ряду метрики: 304 без изменений, 200 после новой загрузки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='series', password='password')
+        cls.device = Device.objects.create(user=cls.user, device_name='band', device_type='tracker')
+        cls.window = {'from': '2024-05-01', 'to': '2024-05-02', 'granularity': 'hour'}
+        ingest_activities([cls._record(hour) for hour in (10, 11)], cls.user, device=cls.device)
+
+    @staticmethod
+    def _record(hour):
+        return {'date': f'2024-05-01 {hour:02d}:00', 'steps': 100, 'calories': 10, 'distance': 0.1,
+                'standups': 1, 'movements': 5}
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('metric_series_api', args=['steps'])
+
+    def _get(self, **headers):
+        headers = {name.replace('_', '-'): value for name, value in headers.items()}
+        return self.client.get(self.url, self.window, headers=headers)
+
+    def test_not_modified_on_matching_validators(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body['values'], [100, 100])
+
+        self.assertEqual(self._get(If_None_Match=response['ETag']).status_code, 304)
+        self.assertEqual(self._get(If_Modified_Since=response['Last-Modified']).status_code, 304)
+
+    def test_new_ingest_changes_validators(self):
+        response = self._get()
+        ingest_activities([self._record(12)], self.user, device=self.device)
+        self.assertEqual(self._get(If_None_Match=response['ETag']).status_code, 200)
+        self.assertEqual(self._get(If_None_Match='"other"').status_code, 200)
+
+    def test_other_window_gets_other_etag(self):
+        etag = self._get()['ETag']
+        self.window = {**self.window, 'to': '2024-05-03'}
+        self.assertNotEqual(self._get()['ETag'], etag)
+        self.assertEqual(self._get(If_None_Match=etag).status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RetentionTests(TestCase):
+    """Старые сырые данные уходят в помесячные архивы, дневные сводки остаются, выгрузка читает архив."""
+
+    def setUp(self):
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        settings_override = self.settings(RAW_ARCHIVE_DIR=archive.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='retention', password='password')
+        self.device = Device.objects.create(user=self.user, device_name='band', device_type='tracker')
+        self.now = timezone.make_aware(datetime(2024, 5, 10, 12))
+        process_activity_records(
+            generate_activity_records(hours=40 * 24, now_time=datetime(2024, 5, 10, 11)), self.user, device=self.device
+        )
+
+    def _daily(self):
+        return list(DailyRollup.objects.filter(user=self.user).order_by('day').values_list('day', 'steps', 'distance'))
+
+    def test_archive_month_and_read_it_back(self):
+        daily = self._daily()
+        exported = ''.join(export_history(self.user))
+        cutoff = timezone.make_aware(datetime(2024, 4, 20))
+
+        result = apply_retention(keep_days=20, now=self.now)
+        self.assertEqual(result['cutoff'], cutoff)
+        self.assertGreater(result['archived_rows'], 0)
+        self.assertFalse(HourlySample.objects.filter(user=self.user, timestamp__lt=cutoff).exists())
+        self.assertTrue(HourlySample.objects.filter(user=self.user, timestamp__gte=cutoff).exists())
+        self.assertFalse(HourlyRollup.objects.filter(user=self.user, hour__lt=cutoff).exists())
+        self.assertEqual(self._daily(), daily)
+        self.user.activity_stats.refresh_from_db()
+        self.assertEqual(self.user.activity_stats.archived_before, cutoff)
+
+        self.assertNotEqual(''.join(export_history(self.user)), exported)
+        self.assertEqual(''.join(export_history(self.user, include_archive=True)), exported)
+
+        # Следующий прогон сдвигает границу вперёд; архив прошлых месяцев дописывается, а не теряется
+        apply_retention(keep_days=5, now=self.now)
+        self.user.activity_stats.refresh_from_db()
+        self.assertEqual(self.user.activity_stats.archived_before, timezone.make_aware(datetime(2024, 5, 5)))
+        self.assertEqual(''.join(export_history(self.user, include_archive=True)), exported)
+        self.assertEqual(self._daily(), daily)
+
+    def test_ingest_into_archived_period_is_skipped(self):
+        apply_retention(keep_days=20, now=self.now)
+        daily = self._daily()
+        record = {'date': '2024-04-10 10:00', 'steps': 1, 'calories': 1, 'distance': 0.1, 'standups': 0, 'movements': 0}
+        result = ingest_activities([record], self.user, update_existing=True, device=self.device)
+        self.assertEqual((result.inserted, result.updated, result.skipped), (0, 0, 1))
+        self.assertEqual(self._daily(), daily)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RollupReconciliationTests(TestCase):
+    """Итоги ActivityStats сходятся с дневными сводками при любом правиле объединения устройств."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='merger', password='password')
+        Profile.objects.create(user=self.user, gender='M', birthdate='2000-01-01', email='merger@example.com')
+        self.band = Device.objects.create(user=self.user, device_name='band', device_type='tracker')
+        self.phone = Device.objects.create(user=self.user, device_name='phone', device_type='phone')
+        # Час 11:00 пишут оба устройства: от правила зависит, сложатся показания или нет
+        for device, hours in ((self.band, ((10, 100), (11, 300))), (self.phone, ((11, 200), (12, 50)))):
+            records = [
+                {'date': f'2024-03-01 {hour}:00', 'steps': steps, 'calories': steps // 10,
+                 'distance': steps / 1000, 'standups': 1, 'movements': 2}
+                for hour, steps in hours
+            ]
+            process_activity_records(records, self.user, device=device)
+
+    def _assert_reconciled(self, steps):
+        stats = ActivityStats.objects.get(user=self.user)
+        daily = DailyRollup.objects.filter(user=self.user).aggregate(steps=Sum('steps'), calories=Sum('calories'))
+        self.assertEqual(stats.total_steps, steps)
+        self.assertEqual((stats.total_steps, stats.total_calories), (daily['steps'], daily['calories']))
+        self.assertEqual(totals_mismatch(stats, lifetime_totals([self.user.id])[self.user.id]), [])
+
+    def test_merge_policies_reconcile(self):
+        self._assert_reconciled(100 + 300 + 200 + 50)
+
+        for policy, steps in ((Profile.MERGE_MAX, 100 + 300 + 50), (Profile.MERGE_SUM, 650)):
+            Profile.objects.filter(user=self.user).update(merge_policy=policy)
+            rebuild_rollups(self.user)
+            self._assert_reconciled(steps)
+
+        # Основное устройство берётся целиком, в часы без него — максимум по остальным
+        Profile.objects.filter(user=self.user).update(merge_policy=Profile.MERGE_PREFER, preferred_device=self.phone)
+        rebuild_rollups(self.user)
+        self._assert_reconciled(100 + 200 + 50)
+
+    def test_policy_change_in_profile_rebuilds_rollups(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('edit_profile'), {
+            'username': 'merger', 'email': 'merger@example.com', 'gender': 'M', 'birthdate': '2000-01-01',
+            'merge_policy': Profile.MERGE_MAX,
+        })
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self._assert_reconciled(450)
+        self.assertEqual(HourlyRollup.objects.get(user=self.user, hour__hour=11).steps, 300)
+
+    def test_reconcile_command_fixes_drift(self):
+        ActivityStats.objects.filter(user=self.user).update(total_steps=1)
+        output = io.StringIO()
+        call_command('reconcile_activity_totals', user='merger', stdout=output)
+        self.assertIn('total_steps 1 != 650', output.getvalue())
+        self.assertEqual(ActivityStats.objects.get(user=self.user).total_steps, 1)
+
+        call_command('reconcile_activity_totals', user='merger', fix=True, stdout=io.StringIO())
+        self._assert_reconciled(650)
+
+
+class HistoryBrowserTests(TestCase):
+    """Keyset-пагинация истории: курсоры в обе стороны без пропусков и повторов, в том числе на равных часах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='history', password='password')
+        cls.devices = [
+            Device.objects.create(user=cls.user, device_name=name, device_type='tracker') for name in ('band', 'phone')
+        ]
+        start = timezone.make_aware(datetime(2024, 2, 1, 8))
+        # Оба устройства пишут одни и те же часы: порядок внутри часа задаёт только id
+        HourlySample.objects.bulk_create(
+            HourlySample(user=cls.user, device=device, timestamp=start + timedelta(hours=hour), steps=hour)
+            for hour in range(7) for device in cls.devices
+        )
+        cls.expected = list(HourlySample.objects.filter(user=cls.user).order_by('-timestamp', '-id'))
+
+    def _walk_older(self, page_size, device_id=None):
+        pages = [history_page(self.user, page_size=page_size, device_id=device_id)]
+        while pages[-1].older:
+            pages.append(history_page(self.user, pages[-1].older, page_size=page_size, device_id=device_id))
+        return pages
+
+    def test_older_pages_cover_history_once(self):
+        for page_size in (1, 3, 5, 14, 20):
+            with self.subTest(page_size=page_size):
+                pages = self._walk_older(page_size)
+                self.assertEqual([row for page in pages for row in page.rows], self.expected)
+                self.assertIsNone(pages[0].newer)
+                self.assertIsNone(pages[-1].older)
+
+    def test_newer_cursor_returns_previous_page(self):
+        pages = self._walk_older(3)
+        # От последней страницы назад к первой — те же страницы в том же порядке строк
+        for previous, page in zip(pages, pages[1:]):
+            back = history_page(self.user, page.newer, direction='newer', page_size=3)
+            self.assertEqual(back.rows, previous.rows)
+            self.assertEqual(back.older, previous.older)
+        self.assertIsNone(history_page(self.user, pages[1].newer, direction='newer', page_size=3).newer)
+
+    def test_device_filter(self):
+        device = self.devices[1]
+        pages = self._walk_older(2, device_id=device.id)
+        self.assertEqual([row for page in pages for row in page.rows],
+                         [row for row in self.expected if row.device_id == device.id])
+
+    def test_malformed_cursor(self):
+        sample = self.expected[0]
+        self.assertEqual(decode_cursor(encode_cursor(sample)), (sample.timestamp, sample.id))
+        naive = f"{timezone.localtime(sample.timestamp).replace(tzinfo=None).isoformat()}_{sample.id}"
+        for cursor in ('garbage', '2024-02-01T10:00:00+01:00', '2024-02-01T10:00:00+01:00_x', '_1', naive):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                history_page(self.user, cursor)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('history'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor_error', response.context)
+        self.assertEqual(response.context['page'].rows, self.expected[:100])
+
+
+class SyncJobTests(TestCase):
+    """Долгая синхронизация отмечается heartbeat и не перехватывается; перехваченный запуск не пишет итог."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='syncer', password='password')
+        self.device = Device.objects.create(user=self.user, device_name='band', device_type='tracker')
+        enqueue_sync(self.device)
+        self.job = claim_next_job()
+
+    def _later(self):
+        # Время «после» RUNNING_TIMEOUT: без отметок задача уже считалась бы брошенной
+        return mock.patch('django.utils.timezone.now', return_value=timezone.now() + RUNNING_TIMEOUT * 2)
+
+    def test_long_running_job_is_not_reclaimed(self):
+        def slow_ingest(records, user, **kwargs):
+            with self._later():
+                records = list(records)
+                self.assertIsNone(claim_next_job())
+            return ingest_activities(records, user, **kwargs)
+
+        with mock.patch.object(sync_jobs, 'process_activity_records', side_effect=slow_ingest):
+            run_job(self.job)
+        job = SyncJob.objects.get(id=self.job.id)
+        self.assertEqual((job.status, job.attempts), (SyncJob.DONE, 1))
+        self.assertGreater(job.inserted, 0)
+
+    def test_reclaimed_job_does_not_overwrite_new_run(self):
+        for during_ingest in (True, False):
+            def reclaimed_ingest(records, user, **kwargs):
+                # Пока загрузка шла, задачу забрал другой воркер
+                SyncJob.objects.filter(id=self.job.id).update(attempts=self.job.attempts + 1)
+                if during_ingest:
+                    with self._later():
+                        records = list(records)
+                return ingest_activities(list(records), user, **kwargs)
+
+            with self.subTest(during_ingest=during_ingest):
+                SyncJob.objects.filter(id=self.job.id).update(status=SyncJob.RUNNING, attempts=1, error='')
+                self.job.refresh_from_db()
+                with mock.patch.object(sync_jobs, 'process_activity_records', side_effect=reclaimed_ingest), \
+                        self.assertLogs('utils.sync_jobs', 'WARNING'):
+                    run_job(self.job)
+                job = SyncJob.objects.get(id=self.job.id)
+                self.assertEqual((job.status, job.attempts, job.inserted), (SyncJob.RUNNING, 2, 0))
+
+
+class MetricsEndpointTests(TestCase):
+    """/metrics/ открыт персоналу и сборщику с токеном, адрес клиента (за прокси — адрес прокси) не учитывается."""
+
+    def test_access(self):
+        url = reverse('metrics')
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+            self.client.force_login(User.objects.create_user(username='ops', password='password', is_staff=True))
+            self.assertEqual(self.client.get(url).status_code, 200)
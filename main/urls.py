@@ -3,7 +3,10 @@ from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
 
-from . import views
+from . import api, async_views, views
+
+# Под ASGI (omis_lab2/asgi.py) страницы графиков и синхронизации обслуживаются асинхронными вариантами
+dashboard = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.home_view, name='home'),
@@ -11,14 +14,27 @@ urlpatterns = [
     path('register/', views.register_view, name='register'),
     path('logout/', LogoutView.as_view(next_page='/'), name='logout'),
     path('health/', views.health_view, name='health'),
-    path('movements/', views.movements_view, name='movements'),
-    path('standups/', views.standups_view, name='standups'),
-    path('steps/', views.steps_view, name='steps'),
-    path('devices/', views.devices_view, name='devices'),
+    path('movements/', dashboard.movements_view, name='movements'),
+    path('standups/', dashboard.standups_view, name='standups'),
+    path('steps/', dashboard.steps_view, name='steps'),
+    path('live/', async_views.live_view, name='live_updates'),
+    path('devices/', dashboard.devices_view, name='devices'),
     path('devices/add/', views.add_device_view, name='add_device'),
-    path('devices/sync/<int:device_id>/', views.sync_device, name='sync_device'),
+    path('devices/sync/<int:device_id>/', dashboard.sync_device, name='sync_device'),
+    path('devices/sync/all/', dashboard.sync_all_devices, name='sync_all_devices'),
+    path('devices/sync/status/', views.sync_status_view, name='sync_status'),
+    path('devices/<int:device_id>/token/', views.device_token_view, name='device_token'),
+    path('coverage/', views.coverage_view, name='coverage'),
+    path('history/', views.history_view, name='history'),
+    path('goals/', views.goals_view, name='goals'),
+    path('goals/rules/<int:rule_id>/delete/', views.delete_rule_view, name='delete_rule'),
+    path('goals/notifications/read/', views.read_notifications_view, name='read_notifications'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit/', views.edit_profile_view, name='edit_profile'),
+    path('api/metrics/<str:metric>/', api.metric_series_api, name='metric_series_api'),
+    path('api/devices/<int:device_id>/samples/', api.device_samples_api, name='device_samples_api'),
+    path('api/history/export/', api.history_export_api, name='history_export_api'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,14 +1,40 @@
+import json
+from datetime import timedelta
+
 from django.contrib.auth import authenticate, login
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Sum, F
+from django.urls import reverse
+from django.db import transaction
+from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 
-from datetime import datetime, timedelta
-
-from .forms import LoginForm, RegistrationForm, ProfileEditForm, DeviceForm
-from .models import Device, Profile, Activity, StandUp
-from utils.activity_generator import generate_activity_data
-from utils.activity_processor import process_activity_data
+from .forms import LoginForm, RegistrationForm, ProfileEditForm, DeviceForm, GoalsForm, RuleForm
+from .models import ActivityStats, Device, Goal, Notification, Profile, Rule
+from utils.sync_jobs import enqueue_sync, enqueue_user_devices, latest_jobs
+from utils.analytics import user_report
+from utils.coverage import BACKFILL_DAYS, completeness, missing_spans
+from utils.device_ingest import issue_device_token
+from utils.goals import user_goals
+from utils.history_browser import history_page
+from utils.live_updates import live_since
+from utils.dashboard_cache import cached_series
+from utils.request_metrics import render_prometheus, scraper_authorized
+from utils.rollups import rebuild_rollups
+from utils.timeseries import DEFAULT_RANGE, RANGE_DAYS
+
+# Глубина истории для аналитики на странице здоровья, сутки
+HEALTH_REPORT_DAYS = 90
+# Сколько суток показывает страница полноты данных по умолчанию и максимум
+COVERAGE_DAYS = 14
+MAX_COVERAGE_DAYS = 90
+# Метрики, которые строит каждая страница графиков
+MOVEMENTS_METRICS = ('distance',)
+STANDUPS_METRICS = ('standups',)
+STEPS_METRICS = ('steps', 'calories')
+# Сколько последних уведомлений показывает страница целей
+NOTIFICATIONS_SHOWN = 50
 
 
 def home_view(request):
@@ -58,23 +84,11 @@ def register_view(request):
 
 @login_required
 def profile_view(request):
-    # Генерация и обработка данных активности
-    json_path, timestamp = generate_activity_data(
-        device_name="default_device",
-        device_type="default_type",
-        user=request.user
-    )
-    process_activity_data(json_path, request.user, timestamp)
-
-    user = request.user
-    activities = Activity.objects.filter(user=user)
-    total_steps = sum(activity.steps for activity in activities)
-    total_calories = sum(activity.calories for activity in activities)
-    total_distance = sum(activity.distance for activity in activities)
-
-    for device in Device.objects.filter(user=user):
-        device.last_import_date = datetime.now()
-        device.save()
+    # Итоги за всё время поддерживаются при загрузке, страница читает одну строку
+    stats = ActivityStats.objects.filter(user=request.user).first() or ActivityStats()
+    total_steps = stats.total_steps
+    total_calories = stats.total_calories
+    total_distance = round(stats.total_distance, 2)
 
     # Отображение профиля
     profile = request.user.profile
@@ -94,6 +108,10 @@ def edit_profile_view(request):
         form = ProfileEditForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
             form.save()
+            if {'merge_policy', 'preferred_device'} & set(form.changed_data):
+                # Часовые и дневные сводки пересчитываются по новому правилу объединения устройств
+                with transaction.atomic():
+                    rebuild_rollups(request.user)
             return redirect('profile')
     else:
         form = ProfileEditForm(instance=profile)
@@ -102,12 +120,16 @@ def edit_profile_view(request):
 
 @login_required
 def health_view(request):
-    return render(request, 'main/heath.html')
+    analytics = user_report(request.user, days=HEALTH_REPORT_DAYS, goals=user_goals(request.user))
+    return render(request, 'main/heath.html', {"analytics": analytics, "analytics_days": HEALTH_REPORT_DAYS})
 
 
 @login_required
 def devices_view(request):
-    devices = Device.objects.filter(user=request.user).order_by('-last_import_date')
+    devices = list(Device.objects.filter(user=request.user).order_by('-last_import_date'))
+    jobs = latest_jobs(request.user)
+    for device in devices:
+        device.sync_job = jobs.get(device.id)
     return render(request, 'main/devices.html', {"devices": devices})
 
 
@@ -134,183 +156,221 @@ def sync_device(request, device_id):
     if device.user != request.user:
         return redirect('devices')  # Перенаправить, если устройство не принадлежит пользователю
 
-    # Генерация и обработка JSON-данных
-    json_path, timestamp = generate_activity_data(
-        device_name=device.device_name, device_type=device.device_type, user=request.user
-    )
-    success = process_activity_data(json_path, request.user, timestamp)
+    # Синхронизация выполняется воркером (manage.py run_sync_workers)
+    enqueue_sync(device)
+    return redirect('devices')
 
-    device.last_import_date = datetime.now()
-    device.save()
 
-    if success:
-        return redirect('devices')  # Перенаправление обратно на страницу устройств
-    else:
-        # Обработка ошибки синхронизации
+@login_required
+def sync_all_devices(request):
+    # Каждое устройство получает свою задачу; воркеры выполняют их параллельно
+    enqueue_user_devices(request.user)
+    return redirect('devices')
+
+
+@login_required
+def device_token_view(request, device_id):
+    # Токен показывается один раз: в базе хранится только его хеш
+    device = get_object_or_404(Device, id=device_id, user=request.user)
+    if request.method != 'POST':
         return redirect('devices')
+    token = issue_device_token(device)
+    upload_url = request.build_absolute_uri(reverse('device_samples_api', args=[device.id]))
+    return render(request, 'main/device_token.html', {"device": device, "token": token, "upload_url": upload_url})
 
 
 @login_required
-def movements_view(request):
-    user = request.user
-    time_range = request.GET.get('range', 'day')  # По умолчанию "день"
-    now = datetime.now()
+def coverage_view(request):
+    """Полнота данных: какие часы последних суток есть в базе и сколько часов не хватает у каждого устройства."""
+    try:
+        day_count = min(max(int(request.GET.get('days', COVERAGE_DAYS)), 1), MAX_COVERAGE_DAYS)
+    except ValueError:
+        day_count = COVERAGE_DAYS
+    now = timezone.now()
+    devices = list(Device.objects.filter(user=request.user).order_by('device_name'))
+    for device in devices:
+        # Те же пропуски, которые запросит у устройства следующая синхронизация
+        device.missing_hours = sum(hours for _, hours in missing_spans(device, now - timedelta(days=BACKFILL_DAYS), now))
+    days = completeness(request.user, day_count)
+    for day in days:
+        # Текущие сутки ещё не закончились: пустые клетки выравнивают столбец итогов
+        day['padding'] = range(max(24 - day['total'], 0))
+    return render(request, 'main/coverage.html', {
+        "days": days,
+        "devices": devices,
+        "backfill_days": BACKFILL_DAYS,
+        "hour_labels": range(24),
+    })
+
+
+@login_required
+def history_view(request):
+    """Сырые почасовые записи пользователя постранично, от новых к старым."""
+    devices = list(Device.objects.filter(user=request.user).order_by('device_name'))
+    device_id = request.GET.get('device')
+    device_id = int(device_id) if device_id and device_id.isdigit() else None
+    direction = 'newer' if request.GET.get('direction') == 'newer' else 'older'
+    context = {"devices": devices, "device_id": device_id}
+    try:
+        context["page"] = history_page(request.user, request.GET.get('cursor'), direction, device_id=device_id)
+    except ValueError:
+        # Испорченная ссылка: показываем первую страницу, но с ошибкой, а не под видом запрошенной
+        context["page"] = history_page(request.user, device_id=device_id)
+        context["cursor_error"] = "Некорректная ссылка на страницу истории, показаны последние записи."
+        return render(request, 'main/history.html', context, status=400)
+    return render(request, 'main/history.html', context)
+
+
+@login_required
+def goals_view(request):
+    """Дневные цели, правила уведомлений и последние уведомления пользователя."""
+    goals = user_goals(request.user)
+    goals_form = GoalsForm(initial={metric: goals[metric] for metric in GoalsForm.base_fields})
+    rule_form = RuleForm()
+    if request.method == 'POST':
+        if request.POST.get('form') == 'goals':
+            goals_form = GoalsForm(request.POST)
+            if goals_form.is_valid():
+                for metric, target in goals_form.cleaned_data.items():
+                    Goal.objects.update_or_create(user=request.user, metric=metric, defaults={'daily_target': target})
+                # Цели входят в контекст страниц графиков, но не в кэшированные ряды: сбрасывать кэш не нужно
+                return redirect('goals')
+        else:
+            rule_form = RuleForm(request.POST)
+            if rule_form.is_valid():
+                rule = rule_form.save(commit=False)
+                rule.user = request.user
+                rule.save()
+                return redirect('goals')
+
+    notifications = list(Notification.objects.filter(user=request.user).order_by('-created_at', '-id')[:NOTIFICATIONS_SHOWN])
+    return render(request, 'main/goals.html', {
+        "goals_form": goals_form,
+        "rule_form": rule_form,
+        "rules": Rule.objects.filter(user=request.user).order_by('id'),
+        "notifications": notifications,
+        "unread": sum(not notification.is_read for notification in notifications),
+    })
+
+
+@login_required
+def delete_rule_view(request, rule_id):
+    rule = get_object_or_404(Rule, id=rule_id, user=request.user)
+    if request.method == 'POST':
+        rule.delete()
+    return redirect('goals')
+
+
+@login_required
+def read_notifications_view(request):
+    if request.method == 'POST':
+        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+    return redirect('goals')
+
+
+@login_required
+def sync_status_view(request):
+    """Статусы последних задач синхронизации для опроса со страницы устройств."""
+    jobs = {
+        device_id: {
+            "status": job.status,
+            "attempts": job.attempts,
+            "inserted": job.inserted,
+            "skipped": job.skipped,
+            "updated": job.updated,
+            "last_import_date": job.device.last_import_date.isoformat(),
+        }
+        for device_id, job in latest_jobs(request.user).items()
+    }
+    return JsonResponse({"jobs": jobs})
+
+
+def live_context(series):
+    """Данные для живых обновлений графика (main/live_updates.html): все метрики ряда и день часовых корзин."""
+    return {
+        'live_updates': settings.LIVE_UPDATES,
+        'live_since': live_since(),
+        'live_values': json.dumps(series.values),
+        'bucket_day': series.buckets[-1].strftime('%Y-%m-%d') if series.buckets else '',
+    }
 
-    if time_range == 'week':
-        start_time = now - timedelta(days=6)  # Последние 7 дней
-    else:
-        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)  # Начало текущих суток
-
-    # Фильтрация данных за выбранный промежуток времени
-    movements = (
-        Activity.objects.filter(user=user, date__gte=start_time, date__lte=now)
-        .annotate(hour=F('date__hour'))  # Добавляем час для группировки
-        .values('hour')
-        .annotate(distance_sum=Sum('distance'))
-        .order_by('hour')
-    )
-
-    # Формируем данные для графика
-    labels = []
-    values = []
-    if time_range == 'day':
-        # Отображаем данные по часам
-        for hour in range(24):
-            labels.append(f"{hour}:00")
-            distance = next((m['distance_sum'] for m in movements if m['hour'] == hour), 0)
-            values.append(round(distance, 2))
-    elif time_range == 'week':
-        # Отображаем данные по дням
-        for day_delta in range(7):
-            day = now - timedelta(days=day_delta)
-            labels.append(day.strftime('%Y-%m-%d'))
-            day_distance = Activity.objects.filter(
-                user=user, date__date=day.date()
-            ).aggregate(Sum('distance'))['distance__sum'] or 0
-            values.append(round(day_distance, 2))
+
+def movements_context(series, goals):
+    values = [round(distance, 2) for distance in series.values['distance']]
 
     # Суммарные данные
     total_distance = round(sum(values), 2)
-    progress_percentage = min((total_distance / (8 if time_range == 'day' else 56)) * 100, 100)
+    goal = goals['distance'] * RANGE_DAYS[series.time_range]
+    progress_percentage = min((total_distance / goal) * 100, 100)
 
-    # Передаем данные в шаблон
-    context = {
-        'labels': labels,
+    return {
+        'labels': series.labels,
         'values': values,
-        'time_range': time_range,
+        'time_range': series.time_range,
         'total_distance': total_distance,
+        'goal': goal,
         'progress_percentage': progress_percentage,
+        **live_context(series),
     }
-    return render(request, 'main/movements.html', context)
 
 
-@login_required
-def standups_view(request):
-    user = request.user
-    time_range = request.GET.get('range', 'day')  # По умолчанию "день"
-    now = datetime.now()
-
-    if time_range == 'week':
-        start_time = now - timedelta(days=6)  # Последние 7 дней
-    else:
-        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)  # Начало текущих суток
-
-    # Фильтрация данных за выбранный промежуток времени
-    standups = (
-        StandUp.objects.filter(user=user, timestamp__gte=start_time, timestamp__lte=now)
-        .annotate(hour=F('timestamp__hour'))  # Добавляем час для группировки
-        .values('hour')
-        .annotate(standups_sum=Sum('count'))
-        .order_by('hour')
-    )
-
-    # Формируем данные для графика
-    labels = []
-    values = []
-    if time_range == 'day':
-        # Отображаем данные по часам
-        for hour in range(24):
-            labels.append(f"{hour}:00")
-            count = next((s['standups_sum'] for s in standups if s['hour'] == hour), 0)
-            values.append(count)
-    elif time_range == 'week':
-        # Отображаем данные по дням
-        for day_delta in range(7):
-            day = now - timedelta(days=day_delta)
-            labels.append(day.strftime('%Y-%m-%d'))
-            day_standups = StandUp.objects.filter(
-                user=user, timestamp__date=day.date()
-            ).aggregate(Sum('count'))['count__sum'] or 0
-            values.append(day_standups)
+def standups_context(series, goals):
+    values = series.values['standups']
 
     # Суммарные данные
     total_standups = sum(values)
-    progress_percentage = min((total_standups / (24 if time_range == 'day' else 168)) * 100, 100)
+    goal = goals['standups'] * RANGE_DAYS[series.time_range]
+    progress_percentage = min((total_standups / goal) * 100, 100)
 
-    # Передаем данные в шаблон
-    context = {
-        'labels': labels,
+    return {
+        'labels': series.labels,
         'values': values,
-        'time_range': time_range,
+        'time_range': series.time_range,
         'total_standups': total_standups,
+        'goal': goal,
         'progress_percentage': progress_percentage,
+        **live_context(series),
     }
-    return render(request, 'main/standups.html', context)
 
 
-@login_required
-def steps_view(request):
-    user = request.user
-    time_range = request.GET.get('range', 'day')  # По умолчанию "день"
-    now = datetime.now()
+def steps_context(series, goals):
+    total_steps = series.total('steps')
+    total_calories = series.total('calories')
+    goal = goals['steps'] * RANGE_DAYS[series.time_range]
+    progress_percentage = min((total_steps / goal) * 100, 700)
 
-    if time_range == 'week':
-        start_time = now - timedelta(days=6)  # Последние 7 дней
-    else:
-        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)  # Начало текущих суток
-
-    # Фильтрация данных за выбранный промежуток времени
-    activities = (
-        Activity.objects.filter(user=user, date__gte=start_time, date__lte=now)
-        .annotate(hour=F('date__hour'))  # Добавляем час для группировки
-        .values('hour')
-        .annotate(steps_sum=Sum('steps'))
-        .order_by('hour')
-    )
-
-    # Формируем данные для графика
-    labels = []
-    values = []
-    if time_range == 'day':
-        # Отображаем данные по часам
-        for hour in range(24):
-            labels.append(f"{hour}:00")
-            steps = next((activity['steps_sum'] for activity in activities if activity['hour'] == hour), 0)
-            values.append(steps)
-    elif time_range == 'week':
-        # Отображаем данные по дням
-        for day_delta in range(7):
-            day = now - timedelta(days=day_delta)
-            labels.append(day.strftime('%Y-%m-%d'))
-            day_steps = activities.filter(date__date=day.date()).aggregate(Sum('steps'))['steps__sum'] or 0
-            values.append(day_steps)
-
-    activities = Activity.objects.filter(user=user, date__gte=start_time).order_by('date')
-    total_steps = sum(activity.steps for activity in activities)
-    total_calories = (
-        Activity.objects.filter(user=user, date__gte=start_time, date__lte=now)
-        .aggregate(total_calories=Sum('calories'))['total_calories']
-        or 0
-    )
-    progress_percentage = min((total_steps / (10000 if time_range == 'day' else 70000)) * 100, 700)
-    # Передаем данные в шаблон
-
-    context = {
-        'labels': labels,
-        'values': values,
-        'time_range': time_range,
+    return {
+        'labels': series.labels,
+        'values': series.values['steps'],
+        'time_range': series.time_range,
         'total_steps': total_steps,
         'total_calories': total_calories,
+        'goal': goal,
         'progress_percentage': progress_percentage,
+        **live_context(series),
     }
-    return render(request, 'main/steps.html', context)
+
+
+@login_required
+def movements_view(request):
+    series = cached_series(request.user, MOVEMENTS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/movements.html', movements_context(series, user_goals(request.user)))
+
+
+@login_required
+def standups_view(request):
+    series = cached_series(request.user, STANDUPS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/standups.html', standups_context(series, user_goals(request.user)))
+
+
+@login_required
+def steps_view(request):
+    series = cached_series(request.user, STEPS_METRICS, request.GET.get('range', DEFAULT_RANGE))
+    return render(request, 'main/steps.html', steps_context(series, user_goals(request.user)))
+
+
+def metrics_view(request):
+    """Метрики запросов в формате Prometheus; доступны персоналу и сборщику с токеном METRICS_TOKEN."""
+    if not request.user.is_staff and not scraper_authorized(request.headers.get('Authorization')):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
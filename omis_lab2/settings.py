@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # from .urls import urlpatterns
@@ -47,7 +48,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware'
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.RequestMetricsMiddleware'
 ]
 
 ROOT_URLCONF = 'omis_lab2.urls'
@@ -80,6 +82,87 @@ DATABASES = {
     }
 }
 
+# Производственный профиль SQLite включается переменной окружения DB_PROFILE=production:
+# WAL (читатели не блокируются записью), PRAGMA при открытии каждого соединения,
+# постоянные соединения и загрузка данных через единственный поток-писатель.
+DB_PROFILE = os.environ.get('DB_PROFILE', 'default')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # 64 МБ страничного кэша на соединение
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,  # мс
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    # Транзакция сразу берёт блокировку записи и ждёт её по busy_timeout,
+    # вместо ошибки "database is locked" при повышении блокировки посреди транзакции
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 5,
+}
+
+INGEST_WRITE_QUEUE = False  # Сериализовать загрузку через поток-писатель (utils.write_queue)
+INGEST_WRITE_LOCK = os.path.join(tempfile.gettempdir(), 'health_ingest.lock')  # Блокировка между процессами
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': SQLITE_PRODUCTION_OPTIONS,
+    })
+    INGEST_WRITE_QUEUE = True
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Графики кэшируются в файлах, общих для веб-процессов: ряд, построенный одним процессом, читают все.
+# Ключ содержит версию данных пользователя (utils.dashboard_cache), так что устаревшие ряды не читаются
+# при любом бэкенде. Альтернативы: LocMemCache (LRU по MAX_ENTRIES, свой кэш у каждого процесса)
+# или локальный Redis ('django.core.cache.backends.redis.RedisCache', LOCATION 'redis://127.0.0.1:6379').
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'health_dashboard_cache'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Ответы на повторные загрузки и токены устройств. Файловый кэш перечисляет каталог при каждой
+    # записи, поэтому здесь память процесса; при нескольких процессах лучше общий Redis/memcached
+    # (повтор, попавший в другой процесс, просто перезапишет те же значения)
+    'ingest': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ingest',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    # Журналы изменений графиков для живых обновлений (utils.live_updates): воркеры синхронизации
+    # пишут, веб-процессы читают, поэтому кэш должен быть общим для процессов
+    'live': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'health_live_updates'),
+        'TIMEOUT': 10 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+DASHBOARD_CACHE_ALIAS = 'dashboard'
+LIVE_CACHE_ALIAS = 'live'  # Журналы событий для потока /live/ (Server-Sent Events)
+INGEST_CACHE_ALIAS = 'ingest'  # Кэш идемпотентности загрузок устройств (main.api.device_samples_api)
+INGEST_MAX_BODY_BYTES = 1024 * 1024  # Предел тела запроса загрузки (в сжатом виде)
+INGEST_MAX_PAYLOAD_BYTES = 8 * 1024 * 1024  # Предел распакованных данных (защита от gzip-бомб)
+INGEST_MAX_RECORDS = 5000  # Почасовых записей в одной загрузке
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -109,6 +192,37 @@ LOGOUT_REDIRECT_URL = '/'
 MEDIA_URL = '/'
 MEDIA_ROOT = os.path.join(BASE_DIR, '')
 
+# Async views
+
+# Асинхронные варианты страниц графиков и синхронизации (main/async_views.py);
+# omis_lab2/asgi.py включает их по умолчанию, WSGI и runserver используют синхронные
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'
+# Живые обновления графиков через Server-Sent Events: каждое открытое соединение под WSGI
+# занимает поток, поэтому по умолчанию включены только вместе с асинхронными представлениями
+LIVE_UPDATES = ASYNC_VIEWS
+
+# Request instrumentation
+
+SLOW_REQUEST_MS = 500  # Запросы дольше порога пишутся в лог main.metrics; None — отключить
+N_PLUS_ONE_THRESHOLD = 5  # Сколько повторов одного SQL за запрос считать N+1
+# Токен сборщика метрик: /metrics/ без входа под персоналом отдаётся только с 'Authorization: Bearer <токен>'.
+# Адрес клиента не проверяется: за обратным прокси REMOTE_ADDR всегда равен адресу прокси
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+PROFILE_SAMPLE_RATE = 0  # Доля запросов под cProfile, например 0.01
+PROFILE_THRESHOLD_MS = 1000
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'health_profiles')
+
+# Raw data retention
+
+RAW_RETENTION_DAYS = 90  # Сколько суток хранить сырые почасовые данные (manage.py apply_retention)
+RAW_ARCHIVE_DIR = BASE_DIR / 'archive'  # Помесячные SQLite-архивы старых сырых данных
+
+# Device payload archive
+
+ACTIVITY_ARCHIVE_DIR = None  # Отдельный каталог для копий выгрузок устройств; None — не сохранять
+ACTIVITY_ARCHIVE_MAX_FILES = 1000
+ACTIVITY_ARCHIVE_MAX_BYTES = 100 * 1024 * 1024
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
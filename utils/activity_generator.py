@@ -1,47 +1,137 @@
 from datetime import datetime, timedelta
+from pathlib import Path
 import random
 import json
+import tempfile
+import uuid
 
+import numpy as np
+from django.conf import settings
+
+DATE_FORMAT = "%Y-%m-%d %H:00"
+# Каталог для generate_activity_data, если архив в настройках не включён
+DEFAULT_ARCHIVE_DIR = Path(tempfile.gettempdir()) / 'activity_archive'
 
-def generate_activity_data(device_name, device_type, user):
-    """Генерирует данные активности за последние 24 часа и сохраняет в JSON-файл."""
-    activities = []
-    now_time = datetime.now()
 
-    for hour in range(24):
-        hour_time = now_time - timedelta(hours=hour)
+def generate_activity_records(hours=24, now_time=None):
+    """Отдаёт почасовые записи активности за последние hours часов без записи на диск."""
+    now_time = now_time or datetime.now()
+    current_hour = now_time.replace(minute=0, second=0, microsecond=0)
 
+    for hour in range(hours):
         # Генерация случайных данных
-        steps = random.randint(0, 500)
-        standups = random.randint(0, 4)
-        movements = random.randint(0, 10)
-        calories = round(random.uniform(5, 100), 2)
-        distance = round(random.uniform(0.05, 1.5), 2)
-
-        # Добавляем данные в список
-        activities.append({
-            "date": hour_time.strftime("%Y-%m-%d %H:00"),
-            "steps": steps,
-            "standups": standups,
-            "movements": movements,
-            "calories": calories,
-            "distance": distance,
-        })
+        yield {
+            "date": current_hour - timedelta(hours=hour),
+            "steps": random.randint(0, 500),
+            "standups": random.randint(0, 4),
+            "movements": random.randint(0, 10),
+            "calories": round(random.uniform(5, 100), 2),
+            "distance": round(random.uniform(0.05, 1.5), 2),
+        }
+
+
+# Доля суточных шагов по часам местного времени: сон, утренний и вечерний пики, обед
+HOURLY_PROFILE = np.array([
+    0.002, 0.001, 0.001, 0.001, 0.002, 0.008, 0.030, 0.075, 0.085, 0.055, 0.045, 0.050,
+    0.075, 0.065, 0.045, 0.045, 0.055, 0.085, 0.090, 0.070, 0.055, 0.035, 0.017, 0.008,
+])
+HOURLY_PROFILE = HOURLY_PROFILE / HOURLY_PROFILE.sum()
+# Множитель активности по дням недели (понедельник — воскресенье)
+WEEKDAY_FACTOR = np.array([1.0, 1.0, 1.02, 1.0, 0.97, 1.15, 0.8])
+# Часы бодрствования, в которые засчитываются вставания
+AWAKE_HOURS = HOURLY_PROFILE > 0.02
+
+
+def generate_history(rng, start, days):
+    """
+    Векторно генерирует почасовую историю одного пользователя за days суток с локальной полуночи start.
+
+    Возвращает словарь массивов NumPy: hour (смещение в часах от start) и значения
+    полей HourlySample. Суточная норма шагов зависит от пользователя, дня недели и
+    случайного разброса по дням, внутри суток распределяется по HOURLY_PROFILE.
+    Результат определяется только состоянием rng, поэтому повторим при том же зерне.
+    """
+    hours = days * 24
+    # Уровень активности и длина шага — постоянные свойства пользователя
+    daily_steps = rng.lognormal(np.log(7500), 0.35)
+    stride_m = rng.uniform(0.65, 0.8)
+    kcal_per_step = rng.uniform(0.035, 0.05)
+
+    weekdays = (start.weekday() + np.arange(days)) % 7
+    day_steps = daily_steps * WEEKDAY_FACTOR[weekdays] * rng.lognormal(0, 0.3, days)
+    hour_of_day = np.tile(np.arange(24), days)
+    expected = np.repeat(day_steps, 24) * HOURLY_PROFILE[hour_of_day] * rng.gamma(4, 0.25, hours)
+    steps = rng.poisson(expected)
+
+    awake = AWAKE_HOURS[hour_of_day]
+    return {
+        "hour": np.arange(hours),
+        "steps": steps,
+        "calories": np.rint(steps * kcal_per_step).astype(np.int64),
+        "distance_m": np.rint(steps * stride_m).astype(np.int64),
+        "standups": np.minimum(rng.poisson(np.where(awake, 1.2, 0.05)), 4),
+        "movements": np.minimum(rng.poisson(steps / 80 + awake), 60),
+    }
+
+
+def _serialize(record):
+    if isinstance(record["date"], datetime):
+        return {**record, "date": record["date"].strftime(DATE_FORMAT)}
+    return record
+
+
+def _rotate_archive(directory, max_files, max_bytes):
+    """Удаляет самые старые файлы архива сверх лимитов по количеству и суммарному размеру."""
+    files = sorted(directory.glob('*.json'), key=lambda path: path.stat().st_mtime, reverse=True)
+    total_bytes = 0
+    for index, path in enumerate(files):
+        total_bytes += path.stat().st_size
+        if index >= max_files or total_bytes > max_bytes:
+            path.unlink(missing_ok=True)
+
+
+def archive_activity_data(records, device_name, device_type, user, now_time=None, directory=None):
+    """
+    Сохраняет выгрузку устройства в архив в компактном JSON.
+
+    Каталог (отдельный, только под архив) берётся из settings.ACTIVITY_ARCHIVE_DIR;
+    если он не задан, ничего не пишется и возвращается None. Старые файлы удаляются
+    по лимитам ACTIVITY_ARCHIVE_MAX_FILES и ACTIVITY_ARCHIVE_MAX_BYTES.
+    """
+    directory = directory or getattr(settings, 'ACTIVITY_ARCHIVE_DIR', None)
+    if not directory:
+        return None
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    now_time = now_time or datetime.now()
 
     # Генерация структуры JSON
     data = {
         "device_name": device_name,
         "device_type": device_type,
-        "activities": activities
+        "activities": [_serialize(record) for record in records]
     }
 
-    # Формирование имени файла
-    timestamp = now_time.strftime("%Y%m%d_%H%M")
-    json_filename = f"{user.username}_{timestamp}.json"
-    json_path = f"/tmp/{json_filename}"
-
-    # Сохранение JSON-файла
+    # Суффикс исключает перезапись при нескольких синхронизациях в одну минуту
+    json_path = directory / f"{user.username}_{now_time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.json"
     with open(json_path, 'w', encoding='utf-8') as json_file:
-        json.dump(data, json_file, indent=4, ensure_ascii=False)
+        json.dump(data, json_file, ensure_ascii=False, separators=(',', ':'))
 
+    _rotate_archive(
+        directory,
+        getattr(settings, 'ACTIVITY_ARCHIVE_MAX_FILES', 1000),
+        getattr(settings, 'ACTIVITY_ARCHIVE_MAX_BYTES', 100 * 1024 * 1024),
+    )
+    return str(json_path)
+
+
+def generate_activity_data(device_name, device_type, user):
+    """Генерирует данные активности за последние 24 часа и сохраняет в JSON-файл."""
+    now_time = datetime.now()
+    records = generate_activity_records(now_time=now_time)
+    json_path = archive_activity_data(
+        records, device_name, device_type, user, now_time=now_time,
+        directory=getattr(settings, 'ACTIVITY_ARCHIVE_DIR', None) or DEFAULT_ARCHIVE_DIR
+    )
+    timestamp = now_time.strftime("%Y%m%d_%H%M")
     return json_path, timestamp
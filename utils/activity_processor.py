@@ -1,50 +1,338 @@
 import json
-from main.models import Activity, StandUp, Movement, Device
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
 
+from django.db import transaction
+from django.utils import timezone
 
-def process_activity_data(json_file_path, user, timestamp) -> bool:
+from main.models import ActivityStats, Device, HourlySample
+from utils.coverage import existing_hours, mark_hours
+from utils.goals import evaluate_rules
+from utils.live_updates import publish_bucket_changes
+from utils.rollups import refresh_rollups
+from utils.write_queue import run_serialized
+
+# Размер пачки для bulk_create/bulk_update (SQLite ограничивает число параметров запроса)
+BATCH_SIZE = 500
+# Сколько символов файла читается за раз при потоковом разборе
+READ_CHUNK_SIZE = 64 * 1024
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+# Верхние пределы столбцов HourlySample (Positive*IntegerField); дистанция в записи — в километрах
+VALUE_LIMITS = {
+    'steps': 2147483647,
+    'calories': 2147483647,
+    'distance': 2147483647 / 1000,
+    'standups': 32767,
+    'movements': 32767,
+}
+
+
+@dataclass
+class IngestResult:
+    """Итог загрузки пачки записей: сколько часов вставлено, пропущено и обновлено."""
+    inserted: int = 0
+    skipped: int = 0
+    updated: int = 0
+
+    def __iadd__(self, other):
+        self.inserted += other.inserted
+        self.skipped += other.skipped
+        self.updated += other.updated
+        return self
+
+
+def parse_activity_date(value):
+    """
+    Разбирает дату вида 'YYYY-MM-DD HH:00' срезами строки, без strptime.
+
+    Записи почасовые, и битовые маски DayCoverage хранят только час: метка не на начале часа
+    отклоняется с ValueError, а не усекается, чтобы два значения за один час не сливались молча.
+    """
+    if isinstance(value, datetime):
+        date = value
+    elif len(value) == 16 and value[4] == '-' and value[7] == '-' and value[10] == ' ' and value[13] == ':':
+        date = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:16]))
+    else:
+        date = datetime.strptime(value, "%Y-%m-%d %H:%M")
+    if date.minute or date.second or date.microsecond:
+        raise ValueError(f"Метка {value} не указывает на начало часа")
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def check_activity_values(record):
+    """
+    Проверяет, что значения записи — неотрицательные числа в пределах столбцов HourlySample.
+
+    Значение вне диапазона отклоняется с ValueError ещё до записи: иначе bulk_create
+    с ignore_conflicts молча отбросил бы строку по ограничению CHECK.
+    """
+    for name, limit in VALUE_LIMITS.items():
+        value = record.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= limit:
+            raise ValueError(f"Запись {record.get('date')}: {name}={value!r}, допустимо число от 0 до {limit:g}")
+
+
+def _device_samples(user, device, start, end):
+    return HourlySample.objects.filter(user=user, device=device, timestamp__range=(start, end))
+
+
+def _fill_sample(sample, record):
+    sample.steps = record["steps"]
+    sample.calories = record["calories"]
+    sample.distance_m = round(record["distance"] * 1000)
+    sample.standups = record["standups"]
+    sample.movements = record["movements"]
+    return sample
+
+
+def _create_rows(user, device, records, dates):
+    HourlySample.objects.bulk_create(
+        [_fill_sample(HourlySample(user=user, device=device, timestamp=date), records[date]) for date in dates],
+        batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def _update_existing(user, device, records, start, end):
+    """
+    Перезаписывает значения уже сохранённых часов (режим upsert).
+
+    Строки выбираются и обновляются через bulk_update, а не ON CONFLICT: у записей без устройства
+    уникальность обеспечивает частичный индекс, который нельзя указать целью конфликта.
+    """
+    samples = [_fill_sample(sample, records[sample.timestamp])
+               for sample in _device_samples(user, device, start, end) if sample.timestamp in records]
+    HourlySample.objects.bulk_update(
+        samples, ['steps', 'calories', 'distance_m', 'standups', 'movements'], batch_size=BATCH_SIZE
+    )
+
+
+def ingest_activities(activities, user, update_existing=False, device=None) -> IngestResult:
+    """
+    Пакетная загрузка почасовых записей устройства.
+
+    Занятые часы определяются по битовым маскам DayCoverage, прочитанным одним запросом
+    за все сутки пачки, и проверяются в памяти; новые строки HourlySample
+    пишутся через bulk_create в одной транзакции вместе с пересчётом задетых часовых
+    и дневных сводок, поэтому число запросов не зависит от количества часов в файле.
+    Уже сохранённые часы пропускаются, а при update_existing=True — перезаписываются.
+    Записи привязываются к device; показания разных устройств за один час не конфликтуют.
+    """
+    result = IngestResult()
+
+    # Дедупликация внутри самой пачки: последняя запись за час побеждает
+    records = {}
+    for activity in activities:
+        check_activity_values(activity)
+        records[parse_activity_date(activity["date"])] = activity
+    if not records:
+        return result
+
+    # Разбор выполняется в вызывающем потоке, запись — через очередь писателя (INGEST_WRITE_QUEUE)
+    return run_serialized(_write_records, records, user, device, update_existing, result)
+
+
+def _write_records(records, user, device, update_existing, result):
+    with transaction.atomic():
+        # Блокировка строки статистики сериализует параллельные загрузки одного пользователя
+        # (например, с разных устройств), чтобы они не перезаписывали одни и те же сводки
+        stats, _ = ActivityStats.objects.select_for_update().get_or_create(user=user)
+
+        # Часы из уже архивированного периода не загружаются: их дневные сводки окончательны
+        archived_before = stats.archived_before
+        if archived_before:
+            archived = [date for date in records if date < archived_before]
+            for date in archived:
+                del records[date]
+            result.skipped += len(archived)
+            if not records:
+                return result
+
+        start, end = min(records), max(records)
+        # Занятые часы определяются по битовым маскам покрытия суток, без выборки самих строк
+        existing, coverage = existing_hours(user, device, records)
+        new_dates = [date for date in records if date not in existing]
+        existing_records = {date: records[date] for date in records if date in existing}
+
+        if update_existing and existing_records:
+            _update_existing(user, device, existing_records, start, end)
+            result.updated = len(existing_records)
+        else:
+            result.skipped += len(existing_records)
+
+        if new_dates:
+            # ignore_conflicts молча отбрасывает строки, которых нет в масках покрытия, но которые
+            # уже есть в таблице: вставленными считаются только реально добавленные строки,
+            # а в покрытии отмечаются только часы, которые после вставки действительно есть в таблице
+            before = _device_samples(user, device, start, end).count()
+            _create_rows(user, device, records, new_dates)
+            present = set(_device_samples(user, device, start, end).values_list('timestamp', flat=True))
+            result.inserted = len(present) - before
+            result.skipped += len(new_dates) - result.inserted
+            mark_hours(user, device, [date for date in new_dates if date in present], coverage)
+
+        if result.inserted or result.updated:
+            refresh_rollups(user, start, end)
+            # Правила уведомлений проверяются по только что пересчитанным часам, без чтения истории
+            evaluate_rules(user, start, end)
+            # Новая версия данных: по ней строятся ETag/Last-Modified API и ключи кэша графиков
+            stats.last_ingested_at = timezone.now()
+            # Итоги за всё время уже сдвинуты в refresh_rollups; update_fields не перетирает их
+            if stats.last_sample_at is None or end > stats.last_sample_at:
+                stats.last_sample_at = end
+            stats.save(update_fields=['last_ingested_at', 'last_sample_at'])
+            # Открытые графики получают новые значения задетых корзин без перезагрузки страницы
+            transaction.on_commit(lambda: publish_bucket_changes(user.id, start, end))
+
+    return result
+
+
+def process_activity_data(json_file_path, user, update_existing=False, device=None):
+    """
+    Загружает JSON-файл устройства в базу.
+
+    Возвращает IngestResult с количеством вставленных, пропущенных и обновлённых часов
+    либо None, если у пользователя нет ни одного устройства.
+    """
     if not Device.objects.filter(user=user).exists():
-        return False
+        return None
 
-    if isinstance(timestamp, str):
-        timestamp = datetime.strptime(timestamp, "%Y%m%d_%H%M")
+    if json_file_path.endswith(NDJSON_SUFFIXES):
+        return process_activity_stream(json_file_path, user, update_existing=update_existing, device=device)
 
     with open(json_file_path, 'r', encoding='utf-8') as file:
         data = json.load(file)
 
-    activities = data.get("activities", [])
+    return ingest_activities(data.get("activities", []), user, update_existing=update_existing, device=device)
 
-    for activity in activities:
-        date_str = activity["date"]
-        date = datetime.strptime(date_str, "%Y-%m-%d %H:%M")
-        date = date.replace(second=0, microsecond=0)
 
-        # Проверяем, существуют ли записи
-        if Activity.objects.filter(date=date, user=user).exists():
-            continue
-        if StandUp.objects.filter(timestamp=date, user=user).exists():
-            continue
-        if Movement.objects.filter(timestamp=date, user=user).exists():
+class _JsonStream:
+    """Буфер поверх файла, из которого JSON-значения вычитываются по одному."""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Первый непробельный символ без его потребления."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Неожиданный конец JSON-файла")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Ожидался символ {char!r} в позиции {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Число на границе чанка декодируется как более короткое ('2.' как 2, '2.5e' как 2.5):
+            # значение закончено, только если за ним идёт разделитель, пробел или конец файла
+            if not self._closed(end) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _closed(self, end):
+        return end < len(self.buffer) and (self.buffer[end].isspace() or self.buffer[end] in ',:]}')
+
+
+def _iter_json_activities(file):
+    """Отдаёт элементы массива activities по одному, не загружая файл целиком."""
+    stream = _JsonStream(file)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == "activities":
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.peek() == ']':
+                        stream.pos += 1
+                        break
+                    stream.expect(',')
+        else:
+            stream.value()
+        if stream.peek() == '}':
+            return
+        stream.expect(',')
+
+
+def _iter_ndjson_activities(file):
+    """NDJSON: одна почасовая запись на строку; строки с метаданными устройства пропускаются."""
+    for line in file:
+        line = line.strip()
+        if not line:
             continue
+        record = json.loads(line)
+        if "date" in record:
+            yield record
+
+
+def iter_activity_records(json_file_path):
+    """Итератор по записям файла устройства (JSON или NDJSON) с постоянным расходом памяти."""
+    with open(json_file_path, 'r', encoding='utf-8') as file:
+        if json_file_path.endswith(NDJSON_SUFFIXES):
+            yield from _iter_ndjson_activities(file)
+        else:
+            yield from _iter_json_activities(file)
+
+
+def _ingest_batches(records, user, batch_size, update_existing, device):
+    result = IngestResult()
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        result += ingest_activities(batch, user, update_existing=update_existing, device=device)
+    return result
 
-        # Создаем записи
-        Activity.objects.create(
-            date=date,
-            steps=activity["steps"],
-            calories=activity["calories"],
-            distance=activity["distance"],
-            user=user
-        )
-        StandUp.objects.create(
-            count=activity["standups"],
-            timestamp=date,
-            user=user
-        )
-        Movement.objects.create(
-            count=activity["movements"],
-            timestamp=date,
-            user=user
-        )
-
-    return True
+
+def process_activity_records(records, user, batch_size=BATCH_SIZE, update_existing=False, device=None):
+    """
+    Загружает записи, полученные напрямую от генератора или устройства, без промежуточного файла.
+
+    Даты могут быть объектами datetime — тогда они не форматируются и не разбираются повторно.
+    """
+    if not Device.objects.filter(user=user).exists():
+        return None
+    return _ingest_batches(records, user, batch_size, update_existing, device)
+
+
+def process_activity_stream(json_file_path, user, batch_size=BATCH_SIZE, update_existing=False, device=None):
+    """
+    Потоковая загрузка больших выгрузок устройства.
+
+    Записи читаются из файла по одной и пишутся в базу пачками по batch_size,
+    каждая пачка — в своей транзакции, так что расход памяти не зависит от размера файла.
+    """
+    if not Device.objects.filter(user=user).exists():
+        return None
+    return _ingest_batches(iter_activity_records(json_file_path), user, batch_size, update_existing, device)
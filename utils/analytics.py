@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from main.models import DailyRollup
+from utils.goals import goals_by_user
+from utils.timeseries import DAILY_GOALS, METRICS
+
+ROLLING_WINDOW = 7
+# Окно, по которому считаются среднее и отклонение для z-оценки
+ANOMALY_WINDOW = 28
+ANOMALY_Z = 3.0
+
+
+@dataclass
+class DailyArrays:
+    """Плотные дневные ряды: days — datetime64[D], values — метрика -> float64 той же длины."""
+    days: np.ndarray
+    values: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.days)
+
+
+def _to_dense(days, columns, start, end):
+    """
+    Раскладывает разреженные строки сводок в непрерывные массивы с нулями в пропусках.
+
+    Ряд начинается с первого дня с данными, чтобы пустая история до подключения
+    устройства не искажала средние и z-оценки.
+    """
+    if len(days):
+        start = max(start, days.min())
+    dense_days = np.arange(start, end + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+    positions = (days - start).astype(np.int64)
+    values = {}
+    for metric, column in columns.items():
+        dense = np.zeros(len(dense_days), dtype=np.float64)
+        dense[positions] = column
+        values[metric] = dense
+    return DailyArrays(days=dense_days, values=values)
+
+
+def load_daily_arrays(user, days=365, end=None, metrics=METRICS):
+    """Дневные ряды пользователя за последние days суток одним колоночным запросом."""
+    end = end or timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    rows = list(
+        DailyRollup.objects.filter(user=user, day__range=(start, end)).order_by('day').values_list('day', *metrics)
+    )
+    columns = list(zip(*rows)) if rows else [[] for _ in range(len(metrics) + 1)]
+    return _to_dense(
+        np.array(columns[0], dtype='datetime64[D]'),
+        {metric: np.array(columns[index + 1], dtype=np.float64) for index, metric in enumerate(metrics)},
+        np.datetime64(start, 'D'), np.datetime64(end, 'D'),
+    )
+
+
+def rolling_mean(values, window=ROLLING_WINDOW):
+    """Скользящее среднее по window точкам; первые window-1 точек усредняются по доступной истории."""
+    cumulative = np.cumsum(np.insert(values, 0, 0.0))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return (cumulative[1:] - cumulative[np.maximum(np.arange(1, len(values) + 1) - window, 0)]) / counts
+
+
+def week_over_week(values):
+    """Сумма последних 7 суток, предыдущих 7 суток и изменение в процентах (None без базы)."""
+    current = float(values[-7:].sum())
+    previous = float(values[-14:-7].sum())
+    change = (current - previous) / previous * 100 if previous else None
+    return {'current': current, 'previous': previous, 'change_percent': change}
+
+
+def goal_streaks(values, goal):
+    """Текущая и максимальная серия суток подряд с выполненной целью."""
+    met = np.concatenate(([False], values >= goal, [False]))
+    edges = np.flatnonzero(np.diff(met.astype(np.int8)))
+    runs = edges[1::2] - edges[::2]
+    longest = int(runs.max()) if len(runs) else 0
+    current = int(runs[-1]) if len(runs) and edges[-1] == len(values) else 0
+    return {'current': current, 'longest': longest}
+
+
+def zscore_anomalies(values, window=ANOMALY_WINDOW, threshold=ANOMALY_Z):
+    """
+    z-оценки относительно предыдущих window суток (без текущей точки).
+
+    Возвращает массив z и булеву маску аномалий |z| >= threshold; точки без достаточной
+    истории или с нулевым разбросом аномалиями не считаются.
+    """
+    count = len(values)
+    cumulative = np.cumsum(np.insert(values, 0, 0.0))
+    cumulative_sq = np.cumsum(np.insert(values * values, 0, 0.0))
+    index = np.arange(count)
+    lo = np.maximum(index - window, 0)
+    n = index - lo
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (cumulative[index] - cumulative[lo]) / n
+        variance = (cumulative_sq[index] - cumulative_sq[lo]) / n - mean * mean
+        std = np.sqrt(np.maximum(variance, 0))
+        z = np.where((n >= window // 2) & (std > 0), (values - mean) / std, 0.0)
+    return z, np.abs(z) >= threshold
+
+
+def summarize(arrays, metrics=METRICS, goals=DAILY_GOALS):
+    """Сводка аналитики по плотным рядам одного пользователя."""
+    summary = {}
+    for metric in metrics:
+        values = arrays.values[metric]
+        z, anomalies = zscore_anomalies(values)
+        metric_summary = {
+            'rolling_mean': float(rolling_mean(values)[-1]) if len(values) else 0.0,
+            'week_over_week': week_over_week(values),
+            'anomalies': [str(day) for day in arrays.days[anomalies]],
+            'latest_z': float(z[-1]) if len(z) else 0.0,
+        }
+        if metric in goals:
+            metric_summary['streaks'] = goal_streaks(values, goals[metric])
+        summary[metric] = metric_summary
+    return summary
+
+
+def user_report(user, days=365, goals=DAILY_GOALS):
+    return summarize(load_daily_arrays(user, days=days), goals=goals)
+
+
+def batch_report(days=90, end=None, metrics=METRICS):
+    """
+    Ночной отчёт по всем пользователям: один запрос по дневным сводкам за период,
+    строки разбиваются по пользователям границами в отсортированном массиве user_id.
+    Серии выполнения целей считаются по целям каждого пользователя (ещё один запрос к Goal).
+    """
+    end = end or timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    rows = list(
+        DailyRollup.objects.filter(day__range=(start, end))
+        .order_by('user_id', 'day')
+        .values_list('user_id', 'day', *metrics)
+        .iterator(chunk_size=10000)
+    )
+    if not rows:
+        return {}
+
+    columns = list(zip(*rows))
+    user_ids = np.array(columns[0], dtype=np.int64)
+    days_column = np.array(columns[1], dtype='datetime64[D]')
+    metric_columns = {metric: np.array(columns[index + 2], dtype=np.float64) for index, metric in enumerate(metrics)}
+
+    report = {}
+    unique_ids, offsets = np.unique(user_ids, return_index=True)
+    bounds = np.append(offsets, len(user_ids))
+    goals = goals_by_user(unique_ids.tolist())
+    for user_id, lo, hi in zip(unique_ids, bounds[:-1], bounds[1:]):
+        arrays = _to_dense(
+            days_column[lo:hi], {metric: column[lo:hi] for metric, column in metric_columns.items()},
+            np.datetime64(start, 'D'), np.datetime64(end, 'D'),
+        )
+        report[int(user_id)] = summarize(arrays, metrics, goals=goals[int(user_id)])
+    return report
@@ -0,0 +1,363 @@
+import asyncio
+import importlib
+import math
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta
+from statistics import quantiles
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import OperationalError, connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import clear_url_caches, reverse
+
+from main.models import Device, Profile
+from utils.activity_generator import generate_activity_records
+from utils.activity_processor import process_activity_records
+from utils.timeseries import build_series
+from utils.write_queue import stop_write_queue
+
+VIEWS = ('steps', 'movements', 'standups', 'profile')
+SYNC_HOURS = 24
+# Прогоны работают с кэшами в памяти процесса: очистка холодного кэша не должна стирать
+# общие файловые кэши запущенного приложения
+BENCHMARK_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{alias}'}
+    for alias in settings.CACHES
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+def _create_users(count):
+    users = []
+    for index in range(count):
+        user = User.objects.create_user(username=f'bench_{index}', password='bench')
+        Profile.objects.create(user=user, gender='M', birthdate='1990-01-01', email=f'bench_{index}@example.com')
+        user.bench_device = Device.objects.create(user=user, device_name='bench', device_type='tracker')
+        users.append(user)
+    return users
+
+
+def _seed(users, hours_from, hours_to, now_time):
+    """Досоздаёт историю каждого пользователя с hours_from до hours_to часов назад."""
+    hours = hours_to - hours_from
+    if hours <= 0:
+        return 0, 0.0
+    started = time.perf_counter()
+    for user in users:
+        process_activity_records(
+            generate_activity_records(hours=hours, now_time=now_time - timedelta(hours=hours_from)), user,
+            device=user.bench_device,
+        )
+    return hours * len(users), time.perf_counter() - started
+
+
+def _measure_sync(user, now_time):
+    records = list(generate_activity_records(hours=SYNC_HOURS, now_time=now_time))
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        process_activity_records(records, user, update_existing=True, device=user.bench_device)
+        elapsed = time.perf_counter() - started
+    return {
+        'records': len(records),
+        'seconds': elapsed,
+        'records_per_s': len(records) / elapsed if elapsed else None,
+        'queries': len(queries),
+    }
+
+
+def _measure_view(client, name, params, repeat):
+    """Задержки страницы при холодном кэше графиков, чтобы измерялся путь через базу."""
+    cache = caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+    url = reverse(name)
+    latencies = []
+    query_counts = []
+    for _ in range(repeat):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} вернул {response.status_code}")
+        query_counts.append(len(queries))
+    return {
+        'p50_ms': _percentile(latencies, 50),
+        'p99_ms': _percentile(latencies, 99),
+        'queries': max(query_counts),
+    }
+
+
+@override_settings(CACHES=BENCHMARK_CACHES)
+def run_benchmark(users=10, sizes=(1000, 100000), repeat=20, ranges=('day', 'week'), log=None):
+    """
+    Нагрузочный прогон в текущей базе: для каждого объёма почасовых записей дозаполняет историю
+    пользователей, затем измеряет синхронизацию и задержки страниц. Возвращает словарь для JSON.
+    """
+    log = log or (lambda message: None)
+    now_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+    bench_users = _create_users(users)
+    client = Client()
+    client.force_login(bench_users[0])
+
+    result = {
+        'commit': _git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'users': users,
+        'repeat': repeat,
+        'tiers': [],
+    }
+
+    seeded_hours = 0
+    for size in sorted(sizes):
+        # История дозаполняется в прошлое, чтобы свежие сутки оставались для замера синхронизации
+        target_hours = max(math.ceil(size / users), SYNC_HOURS)
+        records, elapsed = _seed(bench_users, seeded_hours + SYNC_HOURS, target_hours + SYNC_HOURS, now_time)
+        seeded_hours = max(seeded_hours, target_hours)
+        log(f"{size} строк: загружено {records} записей за {elapsed:.2f} с")
+
+        tier = {
+            'rows': seeded_hours * users,
+            'seed': {
+                'records': records,
+                'seconds': elapsed,
+                'records_per_s': records / elapsed if elapsed else None,
+            },
+            'sync': _measure_sync(bench_users[0], now_time),
+            'views': {},
+        }
+        for name in VIEWS:
+            for time_range in (ranges if name != 'profile' else (None,)):
+                key = name if time_range is None else f'{name}:{time_range}'
+                params = {'range': time_range} if time_range else {}
+                tier['views'][key] = _measure_view(client, name, params, repeat)
+                log(f"  {key}: p50 {tier['views'][key]['p50_ms']:.1f} мс, p99 {tier['views'][key]['p99_ms']:.1f} мс")
+        result['tiers'].append(tier)
+    return result
+
+
+def _contention_phase(users, readers, writers, seconds, options, write_queue):
+    """Читатели строят графики без кэша, пока писатели непрерывно синхронизируют своих пользователей."""
+    db_settings = connections['default'].settings_dict
+    saved_options = db_settings.get('OPTIONS', {})
+    connections.close_all()
+    db_settings['OPTIONS'] = options
+
+    deadline = time.perf_counter() + seconds
+    read_latencies, errors = [], []
+    syncs = [0]
+    lock = threading.Lock()
+
+    def reader(index):
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    build_series(users[index % len(users)], time_range='week')
+                except OperationalError as exc:
+                    with lock:
+                        errors.append(str(exc))
+                    continue
+                with lock:
+                    read_latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+
+    def writer(index):
+        user = users[(readers + index) % len(users)]
+        try:
+            while time.perf_counter() < deadline:
+                records = list(generate_activity_records(hours=SYNC_HOURS))
+                try:
+                    process_activity_records(records, user, update_existing=True, device=user.bench_device)
+                except OperationalError as exc:
+                    with lock:
+                        errors.append(str(exc))
+                    continue
+                with lock:
+                    syncs[0] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=reader, args=(index,)) for index in range(readers)]
+    threads += [threading.Thread(target=writer, args=(index,)) for index in range(writers)]
+    try:
+        with override_settings(INGEST_WRITE_QUEUE=write_queue):
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            stop_write_queue()
+    finally:
+        connections.close_all()
+        db_settings['OPTIONS'] = saved_options
+
+    return {
+        'reads': len(read_latencies),
+        'reads_per_s': len(read_latencies) / elapsed,
+        'read_p50_ms': _percentile(read_latencies, 50) if read_latencies else None,
+        'read_p99_ms': _percentile(read_latencies, 99) if read_latencies else None,
+        'syncs': syncs[0],
+        'syncs_per_s': syncs[0] / elapsed,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
+
+
+@override_settings(CACHES=BENCHMARK_CACHES)
+def run_contention_benchmark(readers=4, writers=2, seconds=10, history_days=30, log=None):
+    """
+    Пропускная способность чтения во время параллельных синхронизаций на файловой базе SQLite:
+    сначала с настройками по умолчанию (журнал DELETE, без очереди записи), затем
+    с производственным профилем (SQLITE_PRODUCTION_OPTIONS и INGEST_WRITE_QUEUE).
+    Режим WAL сохраняется в файле базы, поэтому профиль по умолчанию измеряется первым.
+    """
+    log = log or (lambda message: None)
+    now_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+    users = _create_users(readers + writers)
+    _seed(users, SYNC_HOURS, history_days * 24, now_time)
+
+    result = {
+        'commit': _git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'readers': readers,
+        'writers': writers,
+        'seconds': seconds,
+        'profiles': {},
+    }
+    phases = (
+        ('default', {}, False),
+        ('production', settings.SQLITE_PRODUCTION_OPTIONS, True),
+    )
+    for name, options, write_queue in phases:
+        phase = _contention_phase(users, readers, writers, seconds, options, write_queue)
+        result['profiles'][name] = phase
+        log(f"{name}: {phase['reads_per_s']:.1f} чтений/с, p99 {phase['read_p99_ms'] or 0:.1f} мс, "
+            f"{phase['syncs_per_s']:.1f} синхронизаций/с, ошибок {phase['errors']}")
+    return result
+
+
+ASGI_PAGES = (('steps', {'range': 'day'}), ('movements', {'range': 'week'}), ('standups', {'range': 'month'}),
+              ('devices', {}))
+
+
+def _reload_urlconf():
+    """Маршруты выбирают вариант представлений по ASYNC_VIEWS при импорте, поэтому перечитываются."""
+    importlib.reload(importlib.import_module('main.urls'))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+def _viewer_plan(user, rounds):
+    device = Device.objects.filter(user=user).first()
+    plan = []
+    for _ in range(rounds):
+        plan.extend(('get', reverse(name), params) for name, params in ASGI_PAGES)
+        plan.append(('post', reverse('sync_device', args=[device.id]), {}))
+    return plan
+
+
+def _latency_summary(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 50),
+        'p99_ms': _percentile(latencies, 99),
+    }
+
+
+def _run_wsgi(users, rounds):
+    latencies = []
+    started = time.perf_counter()
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        for method, url, params in _viewer_plan(user, rounds):
+            request_started = time.perf_counter()
+            response = getattr(client, method)(url, params)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url} вернул {response.status_code}")
+    return _latency_summary(latencies, time.perf_counter() - started)
+
+
+async def _run_asgi(users, plans):
+    latencies = []
+
+    async def viewer(user, plan):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        for method, url, params in plan:
+            request_started = time.perf_counter()
+            response = await getattr(client, method)(url, params)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url} вернул {response.status_code}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(viewer(user, plan) for user, plan in zip(users, plans)))
+    return _latency_summary(latencies, time.perf_counter() - started)
+
+
+@override_settings(CACHES=BENCHMARK_CACHES)
+def run_asgi_benchmark(viewers=50, rounds=5, history_days=30, log=None):
+    """
+    Один процесс-обработчик под нагрузкой зрителей графиков и запросов синхронизации.
+
+    WSGI: синхронные представления, запросы обрабатываются по одному, как в одном sync-воркере.
+    ASGI: асинхронные представления (ASYNC_VIEWS), все зрители одновременно в одном цикле событий.
+    Каждый зритель rounds раз открывает страницы ASGI_PAGES и ставит синхронизацию устройства.
+    """
+    log = log or (lambda message: None)
+    now_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+    users = _create_users(viewers)
+    _seed(users, 0, history_days * 24, now_time)
+
+    result = {
+        'commit': _git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'viewers': viewers,
+        'rounds': rounds,
+        'paths': {},
+    }
+    try:
+        with override_settings(ASYNC_VIEWS=False):
+            _reload_urlconf()
+            result['paths']['wsgi'] = _run_wsgi(users, rounds)
+        with override_settings(ASYNC_VIEWS=True):
+            _reload_urlconf()
+            plans = [_viewer_plan(user, rounds) for user in users]
+            result['paths']['asgi'] = asyncio.run(_run_asgi(users, plans))
+    finally:
+        _reload_urlconf()
+    for name, path in result['paths'].items():
+        log(f"{name}: {path['requests_per_s']:.1f} запросов/с, p50 {path['p50_ms']:.1f} мс, "
+            f"p99 {path['p99_ms']:.1f} мс")
+    return result
@@ -0,0 +1,150 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import DayCoverage
+
+HOUR = timedelta(hours=1)
+# Сколько суток назад планировщик дозагрузки ищет пропуски при синхронизации
+BACKFILL_DAYS = 7
+
+
+class _Midnights:
+    """Местные полуночи по датам: make_aware вызывается один раз на сутки, а не на каждый час."""
+
+    def __init__(self):
+        self.tz = timezone.get_current_timezone()
+        self.cache = {}
+
+    def __call__(self, day):
+        # В UTC: разность двух меток одного пояса считается по настенному времени и теряет переводы часов
+        if day not in self.cache:
+            self.cache[day] = timezone.make_aware(datetime.combine(day, time.min), self.tz).astimezone(dt_timezone.utc)
+        return self.cache[day]
+
+    def locate(self, timestamp):
+        """(местная дата, номер часа от полуночи) для метки времени."""
+        day = timezone.localtime(timestamp, self.tz).date()
+        return day, int((timestamp.astimezone(dt_timezone.utc) - self(day)) // HOUR)
+
+
+def day_hours(day, midnights=None):
+    """Число часов в местных сутках (23 или 25 в дни перевода часов)."""
+    midnights = midnights or _Midnights()
+    return int((midnights(day + timedelta(days=1)) - midnights(day)) // HOUR)
+
+
+def hour_masks(timestamps, midnights=None):
+    """Битовые маски {дата: hours} для набора часов."""
+    midnights = midnights or _Midnights()
+    masks = {}
+    for timestamp in timestamps:
+        day, hour = midnights.locate(timestamp)
+        masks[day] = masks.get(day, 0) | (1 << hour)
+    return masks
+
+
+def _rows(user, device, days):
+    device_filter = Q(device=device) if device is not None else Q(device__isnull=True)
+    return DayCoverage.objects.filter(device_filter, user=user, day__in=days)
+
+
+def existing_hours(user, device, timestamps):
+    """
+    Какие из часов уже сохранены у устройства: одна выборка масок за все сутки пачки,
+    дальше проверка битов в памяти. Возвращает (множество занятых часов, строки покрытия по датам).
+    """
+    midnights = _Midnights()
+    located = {timestamp: midnights.locate(timestamp) for timestamp in timestamps}
+    rows = {row.day: row for row in _rows(user, device, {day for day, _ in located.values()})}
+    existing = {
+        timestamp for timestamp, (day, hour) in located.items()
+        if day in rows and rows[day].hours >> hour & 1
+    }
+    return existing, rows
+
+
+def mark_hours(user, device, timestamps, rows=None):
+    """
+    Отмечает часы в покрытии: изменённые маски пишутся одним bulk_update, новые сутки — bulk_create.
+
+    rows — строки, уже прочитанные existing_hours в той же транзакции.
+    """
+    masks = hour_masks(timestamps)
+    if not masks:
+        return
+    if rows is None:
+        rows = {row.day: row for row in _rows(user, device, masks)}
+    changed = []
+    created = []
+    for day, mask in masks.items():
+        row = rows.get(day)
+        if row is None:
+            created.append(DayCoverage(user=user, device=device, day=day, hours=mask))
+        elif row.hours | mask != row.hours:
+            row.hours |= mask
+            changed.append(row)
+    DayCoverage.objects.bulk_update(changed, ['hours'], batch_size=500)
+    DayCoverage.objects.bulk_create(created, batch_size=500)
+
+
+def user_coverage(user, first_day, last_day):
+    """Покрытие пользователя по всем устройствам: {дата: маска} — объединение масок устройств."""
+    masks = {}
+    for day, hours in DayCoverage.objects.filter(user=user, day__range=(first_day, last_day)).values_list('day', 'hours'):
+        masks[day] = masks.get(day, 0) | hours
+    return masks
+
+
+def completeness(user, days):
+    """
+    Полнота данных за последние days суток (включая текущие): по каждым суткам список часов
+    с флагом наличия данных. Текущие сутки учитываются только до текущего часа.
+    """
+    midnights = _Midnights()
+    now = timezone.localtime()
+    today = now.date()
+    first_day = today - timedelta(days=days - 1)
+    masks = user_coverage(user, first_day, today)
+    _, current_hour = midnights.locate(now)
+    result = []
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        total = current_hour + 1 if day == today else day_hours(day, midnights)
+        mask = masks.get(day, 0)
+        hours = [bool(mask >> hour & 1) for hour in range(total)]
+        result.append({'day': day, 'hours': hours, 'present': sum(hours), 'total': total})
+    return result
+
+
+def missing_spans(device, start, end):
+    """
+    Планировщик дозагрузки: непрерывные промежутки часов [start, end) без данных устройства.
+
+    Возвращает список пар (первый час, число часов); start и end выравниваются по часу.
+    """
+    midnights = _Midnights()
+    start = timezone.localtime(start).replace(minute=0, second=0, microsecond=0).astimezone(dt_timezone.utc)
+    end = timezone.localtime(end).replace(minute=0, second=0, microsecond=0).astimezone(dt_timezone.utc)
+    first_day, _ = midnights.locate(start)
+    last_day, _ = midnights.locate(end)
+    masks = dict(_rows(device.user_id, device, [
+        first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)
+    ]).values_list('day', 'hours'))
+
+    spans = []
+    span_start = None
+    hour = start
+    while hour < end:
+        day, bit = midnights.locate(hour)
+        if masks.get(day, 0) >> bit & 1:
+            if span_start is not None:
+                spans.append((span_start, int((hour - span_start) // HOUR)))
+                span_start = None
+        elif span_start is None:
+            span_start = hour
+        hour += HOUR
+    if span_start is not None:
+        spans.append((span_start, int((end - span_start) // HOUR)))
+    return spans
@@ -0,0 +1,110 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from main.models import ActivityStats
+from utils.timeseries import METRICS, Series, abuild_series, bucket_end, build_series, normalize_range
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _key(user_id, generation, metric, time_range, end):
+    return f'dashboard:{user_id}:{generation}:{metric}:{time_range}:{end}'
+
+
+def _generation_query(user):
+    return ActivityStats.objects.filter(user=user).values_list('last_ingested_at', flat=True)
+
+
+def _generation(version):
+    return int(version.timestamp() * 1_000_000) if version else 0
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def cache_stats():
+    """
+    Счётчики попаданий и промахов кэша графиков в текущем процессе.
+
+    Инвалидаций нет: новая версия данных меняет ключ, и старые ряды вытесняются по сроку жизни.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _cache_keys(user, generation, metrics, time_range):
+    time_range = normalize_range(time_range)
+    now = timezone.localtime()
+    end = bucket_end(time_range, now)
+    return time_range, now, {_key(user.id, generation, metric, time_range, end): metric for metric in metrics}
+
+
+def _cached_hit(time_range, keys, found):
+    """Series целиком из кэша либо None, если каких-то метрик там нет (с учётом счётчиков)."""
+    missing = [metric for key, metric in keys.items() if key not in found]
+    _count('hits', len(keys) - len(missing))
+    _count('misses', len(missing))
+    if missing:
+        return None
+    first = found[next(iter(keys))]
+    return Series(time_range=time_range, labels=first['labels'], buckets=first['buckets'],
+                  values={metric: found[key]['values'] for key, metric in keys.items()})
+
+
+def _missing_metrics(keys, found):
+    return tuple(metric for key, metric in keys.items() if key not in found)
+
+
+def _merge_built(series, keys, found):
+    """Entries для записи в кэш по достроенным метрикам; в series добавляются метрики из кэша."""
+    entries = {
+        key: {'labels': series.labels, 'buckets': series.buckets, 'values': series.values[metric]}
+        for key, metric in keys.items() if key not in found
+    }
+    for key, entry in found.items():
+        series.values[keys[key]] = entry['values']
+    return entries
+
+
+def cached_series(user, metrics=METRICS, time_range='day'):
+    """
+    build_series с кэшированием по ключу (пользователь, версия данных, метрика, диапазон, последняя корзина).
+
+    Версия данных — ActivityStats.last_ingested_at, которая сдвигается каждой загрузкой и перезаписью
+    сводок. Она читается до построения ряда, поэтому ряд, собранный до фиксации параллельной загрузки,
+    попадает под старую версию и больше не читается; удалять ключи не нужно. Метрики, которых нет
+    в кэше, достраиваются одним запросом. Срок жизни и вытеснение задаются настройками кэша
+    DASHBOARD_CACHE_ALIAS.
+    """
+    generation = _generation(_generation_query(user).first())
+    time_range, now, keys = _cache_keys(user, generation, metrics, time_range)
+    cache = _cache()
+    found = cache.get_many(keys)
+    series = _cached_hit(time_range, keys, found)
+    if series is None:
+        series = build_series(user, _missing_metrics(keys, found), time_range, now=now)
+        cache.set_many(_merge_built(series, keys, found))
+    return series
+
+
+async def acached_series(user, metrics=METRICS, time_range='day'):
+    """Асинхронный вариант cached_series: кэш и сводки читаются без блокировки цикла событий."""
+    generation = _generation(await _generation_query(user).afirst())
+    time_range, now, keys = _cache_keys(user, generation, metrics, time_range)
+    cache = _cache()
+    found = await cache.aget_many(keys)
+    series = _cached_hit(time_range, keys, found)
+    if series is None:
+        series = await abuild_series(user, _missing_metrics(keys, found), time_range, now=now)
+        await cache.aset_many(_merge_built(series, keys, found))
+    return series
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import secrets
+import zlib
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import Device
+from utils.activity_processor import ingest_activities, parse_activity_date
+
+# Сколько секунд устройство узнаётся по токену без запроса к базе
+TOKEN_CACHE_TIMEOUT = 5 * 60
+# Сколько хранится ответ на загрузку для повторов с тем же Idempotency-Key
+IDEMPOTENCY_TIMEOUT = 24 * 60 * 60
+# Сколько ошибок проверки возвращается клиенту
+MAX_REPORTED_ERRORS = 20
+
+# Схема почасовой записи: тип и допустимый диапазон каждого поля
+SAMPLE_SCHEMA = {
+    'steps': (int, 0, 100000),
+    'calories': ((int, float), 0, 100000),
+    'distance': ((int, float), 0, 200),
+    'standups': (int, 0, 60),
+    'movements': (int, 0, 32767),
+}
+
+
+class IngestError(Exception):
+    """Ошибка загрузки, которую нужно вернуть устройству с HTTP-статусом status."""
+
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors or []
+
+
+@dataclass
+class UploadResult:
+    """Ответ на загрузку; replayed — ответ взят из кэша, база не затрагивалась."""
+    records: int
+    inserted: int = 0
+    skipped: int = 0
+    updated: int = 0
+    replayed: bool = False
+
+
+def _cache():
+    return caches[settings.INGEST_CACHE_ALIAS]
+
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _token_key(token_hash):
+    return f'ingest:token:{token_hash}'
+
+
+def issue_device_token(device):
+    """Выпускает новый токен устройства; в базе хранится только его хеш, прежний токен перестаёт действовать."""
+    if device.api_token_hash:
+        _cache().delete(_token_key(device.api_token_hash))
+    token = secrets.token_urlsafe(32)
+    device.api_token_hash = _token_hash(token)
+    device.save(update_fields=['api_token_hash'])
+    return token
+
+
+def authenticate_device(device_id, authorization):
+    """
+    Устройство по заголовку 'Authorization: Bearer <токен>'.
+
+    Кэшируется только соответствие хеша токена номеру устройства: строка устройства читается
+    заново при каждом запросе, так что удалённое устройство или сменённый токен сразу дают 401.
+    """
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise IngestError('Требуется заголовок Authorization: Bearer <токен устройства>', status=401)
+    token_hash = _token_hash(token.strip())
+    key = _token_key(token_hash)
+    cached_id = _cache().get(key)
+    if cached_id is not None and cached_id != device_id:
+        raise IngestError('Неверный токен устройства', status=401)
+    device = Device.objects.select_related('user').filter(id=device_id, api_token_hash=token_hash).first()
+    if device is None:
+        if cached_id is not None:
+            _cache().delete(key)
+        raise IngestError('Неверный токен устройства', status=401)
+    if cached_id is None:
+        _cache().set(key, device.id, TOKEN_CACHE_TIMEOUT)
+    return device
+
+
+def decode_body(body, content_encoding):
+    """Распаковывает gzip с ограничением размера результата."""
+    if len(body) > settings.INGEST_MAX_BODY_BYTES:
+        raise IngestError('Слишком большой запрос', status=413)
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        payload = body
+    elif encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            payload = decompressor.decompress(body, settings.INGEST_MAX_PAYLOAD_BYTES + 1)
+        except zlib.error:
+            raise IngestError('Повреждённое gzip-содержимое')
+        if decompressor.unconsumed_tail or len(payload) > settings.INGEST_MAX_PAYLOAD_BYTES:
+            raise IngestError('Слишком большие распакованные данные', status=413)
+        if not decompressor.eof:
+            raise IngestError('Повреждённое gzip-содержимое')
+    else:
+        raise IngestError(f'Неподдерживаемое сжатие: {encoding}', status=415)
+    if len(payload) > settings.INGEST_MAX_PAYLOAD_BYTES:
+        raise IngestError('Слишком большие распакованные данные', status=413)
+    return payload
+
+
+def _is_ndjson(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type not in ('application/json', 'application/x-ndjson', 'application/jsonl'):
+        raise IngestError(f'Неподдерживаемый тип содержимого: {content_type}', status=415)
+    return content_type != 'application/json'
+
+
+def parse_payload(payload, ndjson):
+    """Записи из JSON ({"activities": [...]} как в выгрузке устройства, или массив) либо NDJSON."""
+    try:
+        text = payload.decode('utf-8')
+        if ndjson:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        data = json.loads(text)
+    except ValueError as error:
+        raise IngestError(f'Некорректный JSON: {error}')
+    if isinstance(data, dict):
+        data = data.get('activities')
+    if not isinstance(data, list):
+        raise IngestError('Ожидается массив записей или объект с ключом activities')
+    return data
+
+
+def _parse_date(value):
+    if not isinstance(value, str):
+        raise ValueError
+    # ISO 8601 с секундами или часовым поясом; начало часа проверяет parse_activity_date
+    if len(value) > 16:
+        return parse_activity_date(datetime.fromisoformat(value))
+    return parse_activity_date(value)
+
+
+def validate_records(records):
+    """Проверяет записи по SAMPLE_SCHEMA; даты разбираются в datetime. Ошибки собираются по всем записям."""
+    if not records:
+        raise IngestError('Пустая загрузка')
+    if len(records) > settings.INGEST_MAX_RECORDS:
+        raise IngestError(f'Не больше {settings.INGEST_MAX_RECORDS} записей в одной загрузке', status=413)
+    errors = []
+    valid = []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({'index': index, 'field': None, 'message': 'Запись должна быть объектом'})
+            continue
+        clean = {}
+        try:
+            clean['date'] = _parse_date(record.get('date'))
+        except ValueError:
+            errors.append({'index': index, 'field': 'date',
+                           'message': "Ожидается час 'YYYY-MM-DD HH:00' или ISO 8601"})
+        for name, (types, low, high) in SAMPLE_SCHEMA.items():
+            value = record.get(name)
+            if isinstance(value, bool) or not isinstance(value, types):
+                errors.append({'index': index, 'field': name, 'message': 'Обязательное числовое поле'})
+            elif not low <= value <= high:
+                errors.append({'index': index, 'field': name, 'message': f'Допустимо от {low} до {high}'})
+            else:
+                clean[name] = value
+        valid.append(clean)
+    if errors:
+        raise IngestError('Запись не прошла проверку', errors=errors[:MAX_REPORTED_ERRORS])
+    return valid
+
+
+def ingest_upload(device, body, content_type, content_encoding=None, idempotency_key=None, content_hash=None):
+    """
+    Принимает загрузку устройства: распаковка, проверка хеша, дедупликация, проверка схемы, запись.
+
+    Повтор с тем же Idempotency-Key получает сохранённый ответ из кэша INGEST_CACHE_ALIAS
+    без обращения к базе; тот же ключ с другим содержимым (SHA-256 распакованных данных) —
+    конфликт (409). Загрузка без ключа всегда записывается: устройство может законно прислать
+    те же значения повторно, например после сброса. Новые данные пишутся через ingest_activities
+    с перезаписью часов: последняя выгрузка устройства за час считается верной.
+    """
+    ndjson = _is_ndjson(content_type)
+    payload = decode_body(body, content_encoding)
+    digest = hashlib.sha256(payload).hexdigest()
+    if content_hash and content_hash.strip().lower() != digest:
+        raise IngestError('Хеш содержимого не совпадает с X-Content-SHA256')
+
+    if idempotency_key is not None and not (0 < len(idempotency_key) <= 255 and idempotency_key.isprintable()):
+        raise IngestError('Idempotency-Key должен быть непустой печатной строкой до 255 символов')
+
+    cache = _cache()
+    key_entry = None
+    if idempotency_key:
+        key_entry = f'ingest:key:{device.id}:{hashlib.sha256(idempotency_key.encode()).hexdigest()}'
+        cached = cache.get(key_entry)
+        if cached is not None:
+            if cached['hash'] != digest:
+                raise IngestError('Idempotency-Key уже использован для другого содержимого', status=409)
+            return UploadResult(**cached['result'], replayed=True)
+
+    records = validate_records(parse_payload(payload, ndjson))
+    ingested = ingest_activities(records, device.user, update_existing=True, device=device)
+    result = UploadResult(records=len(records), **asdict(ingested))
+
+    # Курсор синхронизации продвигается так же, как после серверной синхронизации
+    last_hour = max(record['date'] for record in records)
+    Device.objects.filter(id=device.id).update(last_import_date=timezone.now())
+    Device.objects.filter(Q(last_record_at__isnull=True) | Q(last_record_at__lt=last_hour), id=device.id).update(
+        last_record_at=last_hour
+    )
+
+    if key_entry:
+        entry = {'hash': digest, 'result': {name: value for name, value in asdict(result).items() if name != 'replayed'}}
+        cache.set(key_entry, entry, IDEMPOTENCY_TIMEOUT)
+    return result
@@ -0,0 +1,156 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from main.models import DailyRollup, Goal, HourlyRollup, Notification, Rule
+from utils.timeseries import DAILY_GOALS
+
+HOUR = timedelta(hours=1)
+# Насколько старые данные ещё порождают уведомления: импорт истории не засыпает пользователя событиями
+NOTIFY_WINDOW = timedelta(hours=48)
+# Поля состояния правила, которые сохраняются после проверки
+RULE_STATE_FIELDS = ['streak', 'evaluated_until', 'last_fired_on']
+METRIC_LABELS = dict(Rule.METRIC_CHOICES)
+
+
+def _goals(rows):
+    goals = dict(DAILY_GOALS)
+    # Цели хранятся как float; целые значения показываются без дробной части
+    goals.update((metric, int(target) if target.is_integer() else target) for metric, target in rows)
+    return goals
+
+
+def user_goals(user):
+    """Дневные цели пользователя; метрики без своей цели берут значение по умолчанию из DAILY_GOALS."""
+    return _goals(Goal.objects.filter(user=user).values_list('metric', 'daily_target'))
+
+
+def goals_by_user(user_ids):
+    """Дневные цели нескольких пользователей одним запросом: {user_id: цели как у user_goals}."""
+    rows = {user_id: [] for user_id in user_ids}
+    for user_id, metric, target in Goal.objects.filter(user_id__in=rows).values_list(
+        'user_id', 'metric', 'daily_target'
+    ):
+        rows[user_id].append((metric, target))
+    return {user_id: _goals(user_rows) for user_id, user_rows in rows.items()}
+
+
+async def auser_goals(user):
+    return _goals([row async for row in Goal.objects.filter(user=user).values_list('metric', 'daily_target')])
+
+
+def _format(value):
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+def _daily_goal(rule, days, goals):
+    """Уведомление за каждые новые сутки, в которые дневная сумма дошла до цели; не больше одного в сутки."""
+    target = rule.threshold if rule.threshold is not None else goals.get(rule.metric)
+    if not target:
+        return []
+    notifications = []
+    for day, values in sorted(days.items()):
+        if values[rule.metric] < target or (rule.last_fired_on and day <= rule.last_fired_on):
+            continue
+        rule.last_fired_on = day
+        notifications.append(Notification(
+            user_id=rule.user_id, rule=rule,
+            message=f"Дневная цель достигнута {day:%d.%m.%Y}: {METRIC_LABELS[rule.metric]} "
+                    f"{_format(round(values[rule.metric], 2))} из {_format(target)}",
+            event_at=timezone.make_aware(datetime.combine(day, time.min)),
+        ))
+    return notifications
+
+
+def _hour_start(value):
+    return timezone.localtime(value).replace(minute=0, second=0, microsecond=0).astimezone(dt_timezone.utc)
+
+
+def _first_hour(rule, first_hour, horizon):
+    """С какого часа проверять правило: с часа после прошлой проверки, иначе с начала загрузки."""
+    if rule.evaluated_until is None:
+        return first_hour
+    # Часы между проверками (например, незаконченный тогда час) досматриваются по сводкам
+    if rule.evaluated_until + HOUR < horizon:
+        rule.streak = 0
+        return horizon
+    return rule.evaluated_until + HOUR
+
+
+def _low_activity(rule, hours, first_hour, last_hour):
+    """
+    Проходит часы [first_hour, last_hour] по порядку, продолжая серию, накопленную прошлыми загрузками.
+
+    Час без данных, час вне активного окна или час с активностью от порога прерывает серию;
+    после срабатывания серия начинается заново, так что уведомление приходит раз в rule.hours часов.
+    """
+    notifications = []
+    hour = first_hour
+    while hour <= last_hour:
+        values = hours.get(hour)
+        local_hour = timezone.localtime(hour).hour
+        if values is None or not rule.active_from <= local_hour < rule.active_to or values[rule.metric] >= rule.threshold:
+            rule.streak = 0
+        else:
+            rule.streak += 1
+            if rule.streak >= rule.hours:
+                rule.streak = 0
+                notifications.append(Notification(
+                    user_id=rule.user_id, rule=rule, event_at=hour,
+                    message=f"Меньше {_format(rule.threshold)} ({METRIC_LABELS[rule.metric]}) в час "
+                            f"{rule.hours} ч подряд, до {timezone.localtime(hour + HOUR):%d.%m.%Y %H:%M}",
+                ))
+        hour += HOUR
+    rule.evaluated_until = last_hour
+    return notifications
+
+
+def evaluate_rules(user, start, end, now=None):
+    """
+    Проверяет правила пользователя по часам [start, end], только что пересчитанным в сводках.
+
+    Вызывается в транзакции загрузки после refresh_rollups, под блокировкой ActivityStats,
+    поэтому состояние правил не гоняется между параллельными загрузками. Читаются только
+    часовые и дневные сводки загруженного окна, так что стоимость зависит от объёма новых
+    данных, а не от длины истории. Незаконченный текущий час не проверяется: его данные
+    ещё будут дополнены. Возвращает созданные уведомления.
+    """
+    rules = list(Rule.objects.filter(user=user, is_active=True))
+    if not rules:
+        return []
+    now = now or timezone.now()
+    current_hour = _hour_start(now)
+    horizon = current_hour - NOTIFY_WINDOW
+    first_hour = max(_hour_start(start), horizon)
+    last_hour = min(_hour_start(end), current_hour - HOUR)
+
+    notifications = []
+    daily_goal = [rule for rule in rules if rule.kind == Rule.KIND_DAILY_GOAL]
+    first_day = max(timezone.localtime(start).date(), timezone.localtime(horizon).date())
+    last_day = timezone.localtime(end).date()
+    if daily_goal and first_day <= last_day:
+        goals = user_goals(user)
+        days = {
+            row['day']: row for row in DailyRollup.objects.filter(
+                user=user, day__range=(first_day, last_day)
+            ).values('day', *METRIC_LABELS)
+        }
+        for rule in daily_goal:
+            notifications += _daily_goal(rule, days, goals)
+
+    low_activity = {
+        rule: _first_hour(rule, first_hour, horizon) for rule in rules
+        if rule.kind == Rule.KIND_LOW_ACTIVITY and rule.threshold is not None
+    }
+    low_activity = {rule: begin for rule, begin in low_activity.items() if begin <= last_hour}
+    if low_activity:
+        hours = {
+            row['hour']: row for row in HourlyRollup.objects.filter(
+                user=user, hour__range=(min(low_activity.values()), last_hour)
+            ).values('hour', *METRIC_LABELS)
+        }
+        for rule, begin in low_activity.items():
+            notifications += _low_activity(rule, hours, begin, last_hour)
+
+    Rule.objects.bulk_update(rules, RULE_STATE_FIELDS)
+    return Notification.objects.bulk_create(notifications)
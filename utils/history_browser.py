@@ -0,0 +1,72 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.db.models import Q
+
+from main.models import HourlySample
+
+PAGE_SIZE = 100
+
+
+@dataclass
+class HistoryPage:
+    """Страница сырой истории: строки от новых к старым и курсоры соседних страниц (None — страницы нет)."""
+    rows: list = field(default_factory=list)
+    older: str = None
+    newer: str = None
+
+
+def encode_cursor(sample):
+    return f"{sample.timestamp.isoformat()}_{sample.id}"
+
+
+def decode_cursor(cursor):
+    """Курсор '<ISO-время>_<id>' -> (timestamp, id); некорректный курсор — ValueError."""
+    timestamp, _, sample_id = (cursor or '').rpartition('_')
+    timestamp = datetime.fromisoformat(timestamp)
+    # encode_cursor пишет время со смещением; без него сравнение с timestamp зависело бы от часового пояса
+    if timestamp.tzinfo is None:
+        raise ValueError(f"Курсор без часового пояса: {cursor}")
+    return timestamp, int(sample_id)
+
+
+def history_page(user, cursor=None, direction='older', page_size=PAGE_SIZE, device_id=None):
+    """
+    Страница сырых почасовых записей пользователя с keyset-пагинацией по (timestamp, id).
+
+    Вместо OFFSET следующая страница начинается условием «строго раньше последней показанной
+    строки», которое обслуживается индексом (user, timestamp); поэтому глубокие страницы стоят
+    столько же, сколько первая. direction='newer' листает к новым записям от курсора.
+    """
+    samples = HourlySample.objects.filter(user=user).select_related('device')
+    if device_id is not None:
+        samples = samples.filter(device_id=device_id)
+
+    newer = direction == 'newer'
+    if cursor:
+        timestamp, sample_id = decode_cursor(cursor)
+        # Избыточное условие диапазона по timestamp позволяет СУБД начать обход индекса с курсора
+        if newer:
+            samples = samples.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=sample_id),
+                                     timestamp__gte=timestamp)
+        else:
+            samples = samples.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=sample_id),
+                                     timestamp__lte=timestamp)
+    order = ('timestamp', 'id') if newer else ('-timestamp', '-id')
+    # Лишняя строка показывает, есть ли страница дальше, без COUNT(*)
+    rows = list(samples.order_by(*order)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if newer:
+        rows.reverse()
+
+    page = HistoryPage(rows=rows)
+    if rows:
+        # Листая к новым, мы пришли со страницы старее; листая к старым от курсора — со страницы новее
+        if newer:
+            page.older = encode_cursor(rows[-1])
+            page.newer = encode_cursor(rows[0]) if has_more else None
+        else:
+            page.older = encode_cursor(rows[-1]) if has_more else None
+            page.newer = encode_cursor(rows[0]) if cursor else None
+    return page
@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import chain
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from main.models import ActivityStats, Device, HourlySample
+from utils.activity_processor import IngestResult, check_activity_values, ingest_activities
+from utils.retention import archived_months, month_start, query_archive
+
+FORMATS = ('csv', 'columns')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'columns': 'application/x-ndjson'}
+EXTENSIONS = {'csv': 'csv', 'columns': 'jsonl'}
+# Поля записи устройства (как в JSON-выгрузке), дистанция — в километрах
+RECORD_FIELDS = ('date', 'steps', 'calories', 'distance', 'standups', 'movements')
+COLUMNS = ('username', 'device') + RECORD_FIELDS
+INT_FIELDS = ('steps', 'calories', 'standups', 'movements')
+# Строк на один кусок ответа и на одну выборку серверного курсора
+CHUNK_SIZE = 2000
+# Записей на одну транзакцию загрузки при импорте
+IMPORT_BATCH_SIZE = 5000
+
+
+def _history_rows(user=None):
+    """Сырые почасовые строки в порядке индекса (пользователь, устройство, час)."""
+    samples = HourlySample.objects.all()
+    if user is not None:
+        samples = samples.filter(user=user)
+    return (
+        samples.order_by('user_id', 'device_id', 'timestamp')
+        .values_list('user__username', 'device__device_name', 'timestamp',
+                     'steps', 'calories', 'distance_m', 'standups', 'movements')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def _archive_rows(user=None):
+    """
+    Сырые строки из помесячных архивов (utils.retention) в том же виде, что и _history_rows.
+
+    Архив читается по месяцу на пользователя, так что в памяти не больше месяца строк.
+    """
+    stats = ActivityStats.objects.filter(archived_before__isnull=False).select_related('user').order_by('user_id')
+    if user is not None:
+        stats = stats.filter(user=user)
+    months = archived_months()
+    for row in stats:
+        devices = dict(Device.objects.filter(user=row.user).values_list('id', 'device_name'))
+        for year, month in months:
+            start = month_start(year, month)
+            if start >= row.archived_before:
+                break
+            end = month_start(year + month // 12, month % 12 + 1)
+            samples = sorted(query_archive(row.user, start, min(end, row.archived_before)),
+                             key=lambda sample: (sample['device_id'] or 0, sample['date']))
+            for sample in samples:
+                yield (row.user.username, devices.get(sample['device_id']), sample['date'], sample['steps'],
+                       sample['calories'], round(sample['distance'] * 1000), sample['standups'], sample['movements'])
+
+
+def _chunks(rows):
+    tz = timezone.get_current_timezone()
+    chunk = []
+    for username, device, stamp, steps, calories, distance_m, standups, movements in rows:
+        chunk.append((username, device or '', timezone.localtime(stamp, tz).isoformat(),
+                      steps, calories, distance_m / 1000, standups, movements))
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv_stream(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _columns_stream(rows):
+    """Колоночные блоки: одна строка JSON на кусок, в ней по массиву на каждую колонку."""
+    for chunk in _chunks(rows):
+        yield json.dumps(dict(zip(COLUMNS, map(list, zip(*chunk)))), ensure_ascii=False,
+                         separators=(',', ':')) + '\n'
+
+
+def export_history(user=None, fmt='csv', include_archive=False):
+    """
+    Потоковая выгрузка сырой почасовой истории пользователя (или всей системы при user=None).
+
+    Строки читаются серверным курсором кусками по CHUNK_SIZE и сразу отдаются текстом,
+    поэтому расход памяти не зависит от объёма истории. При include_archive=True перед данными
+    базы выгружаются месяцы, перенесённые в архив (utils.retention); такую выгрузку можно
+    загрузить import_history в новую базу.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат должен быть одним из: {', '.join(FORMATS)}")
+    rows = _history_rows(user)
+    if include_archive:
+        rows = chain(_archive_rows(user), rows)
+    return _csv_stream(rows) if fmt == 'csv' else _columns_stream(rows)
+
+
+def _csv_records(file):
+    yield from csv.DictReader(file)
+
+
+def _columns_records(file):
+    for line in file:
+        if line.strip():
+            block = json.loads(line)
+            yield from (dict(zip(block, values)) for values in zip(*block.values()))
+
+
+def _record(row, number):
+    """Запись для ingest_activities из строки файла; ошибка указывает номер записи в файле."""
+    try:
+        record = {field: int(row[field]) for field in INT_FIELDS}
+        record['distance'] = float(row['distance'])
+        record['date'] = datetime.fromisoformat(row['date'])
+        check_activity_values(record)
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f"Запись {number}: {error}")
+    return record
+
+
+class _Targets:
+    """Кэш пользователей и устройств по именам из файла; недостающие устройства создаются."""
+
+    def __init__(self, user):
+        self.user = user
+        self.users = {}
+        self.devices = {}
+
+    def resolve(self, username, device_name):
+        user = self.user
+        if user is None:
+            if username not in self.users:
+                self.users[username] = User.objects.filter(username=username).first()
+                if self.users[username] is None:
+                    raise ValueError(f"Пользователь {username} не найден")
+            user = self.users[username]
+        if not device_name:
+            return user, None
+        key = (user.id, device_name)
+        if key not in self.devices:
+            device = Device.objects.filter(user=user, device_name=device_name).order_by('id').first()
+            self.devices[key] = device or Device.objects.create(
+                user=user, device_name=device_name, device_type='import'
+            )
+        return user, self.devices[key]
+
+
+def import_history(file, fmt='csv', user=None, update_existing=False, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Загружает выгрузку export_history через пакетный путь ingest_activities.
+
+    Строки группируются подряд идущими пачками одного пользователя и устройства, поэтому
+    выгрузка, отсортированная по (пользователь, устройство, час), пишется пачками по batch_size.
+    При заданном user колонка username игнорируется и вся история записывается ему.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат должен быть одним из: {', '.join(FORMATS)}")
+    targets = _Targets(user)
+    result = IngestResult()
+    key, batch = None, []
+    for number, row in enumerate(_csv_records(file) if fmt == 'csv' else _columns_records(file), start=1):
+        row_key = (row.get('username'), row.get('device') or '')
+        if batch and (row_key != key or len(batch) >= batch_size):
+            target_user, device = targets.resolve(*key)
+            result += ingest_activities(batch, target_user, update_existing=update_existing, device=device)
+            batch = []
+        key = row_key
+        batch.append(_record(row, number))
+    if batch:
+        target_user, device = targets.resolve(*key)
+        result += ingest_activities(batch, target_user, update_existing=update_existing, device=device)
+    return result
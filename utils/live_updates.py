@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from main.models import ActivityStats, DailyRollup, HourlyRollup
+from utils.timeseries import METRICS, range_window
+
+# Как часто поток событий заглядывает в журнал пользователя, секунды
+POLL_SECONDS = 1.0
+# Через сколько миллисекунд браузер переподключается после обрыва
+RETRY_MS = 3000
+# Комментарий-пинг держит соединение открытым через прокси и продлевает отметку слушателя
+KEEPALIVE_SECONDS = 15
+# Сколько живёт отметка «у пользователя открыт график»; без неё изменения не публикуются
+LISTENER_TIMEOUT = 45
+# После этого поток закрывается; EventSource переподключается сам и досылает Last-Event-ID
+STREAM_SECONDS = 5 * 60
+# Сколько последних событий хранится в журнале пользователя и как долго
+EVENT_LOG_SIZE = 50
+EVENT_LOG_TIMEOUT = 10 * 60
+# Насколько раньше отрисовки страницы берутся события: значения корзин абсолютные,
+# поэтому повтор уже учтённого изменения безвреден, а пропуск — нет
+REPLAY_NS = 5 * 10 ** 9
+
+
+def _cache():
+    return caches[settings.LIVE_CACHE_ALIAS]
+
+
+def _log_key(user_id):
+    return f'live:events:{user_id}'
+
+
+def _listener_key(user_id):
+    return f'live:listeners:{user_id}'
+
+
+def live_since():
+    """Номер события, с которого страница графика начинает получать изменения."""
+    return time.time_ns() - REPLAY_NS
+
+
+def _values(row):
+    return {metric: row[metric] for metric in METRICS}
+
+
+def bucket_changes(user_id, start, end, now=None):
+    """
+    Новые значения корзин графиков, задетых загрузкой [start, end]:
+    часы текущих суток (диапазон «день»), дни последних 30 суток (неделя и месяц)
+    и месяцы последнего года. Ключи совпадают с подписями корзин в utils.timeseries,
+    у часов перед подписью стоит дата. Читаются только сводки задетого окна.
+    """
+    now = timezone.localtime(now)
+    start, end = timezone.localtime(start), timezone.localtime(end)
+    changes = {}
+
+    day_start, day_end = range_window('day', now)
+    if start < day_end and end >= day_start:
+        changes['hours'] = {
+            f"{day_start.date().isoformat()} {timezone.localtime(row['hour']).hour}:00": _values(row)
+            for row in HourlyRollup.objects.filter(user_id=user_id, hour__range=(max(start, day_start), end))
+            .values('hour', *METRICS)
+        }
+    month_start, month_end = range_window('month', now)
+    if start < month_end and end >= month_start:
+        changes['days'] = {
+            row['day'].isoformat(): _values(row)
+            for row in DailyRollup.objects.filter(
+                user_id=user_id, day__range=(max(start, month_start).date(), end.date())
+            ).values('day', *METRICS)
+        }
+    year_start, year_end = range_window('year', now)
+    if start < year_end and end >= year_start:
+        first_month = max(start, year_start).date().replace(day=1)
+        next_month = (end.date().replace(day=1) + timedelta(days=32)).replace(day=1)
+        changes['months'] = {
+            row['month'].strftime('%Y-%m'): _values(row)
+            for row in DailyRollup.objects.filter(user_id=user_id, day__gte=first_month, day__lt=next_month)
+            .annotate(month=TruncMonth('day')).values('month')
+            .annotate(**{metric: Sum(metric) for metric in METRICS}).order_by()
+        }
+    return {source: buckets for source, buckets in changes.items() if buckets}
+
+
+def publish_bucket_changes(user_id, start, end):
+    """
+    Кладёт изменения корзин в журнал событий пользователя (вызывается после фиксации загрузки).
+
+    Журнал лежит в общем для процессов кэше LIVE_CACHE_ALIAS, поэтому загрузки воркеров
+    синхронизации доходят до потоков событий веб-процессов. Пока у пользователя не открыт
+    ни один график, изменения не считаются и не публикуются.
+    """
+    cache = _cache()
+    if not cache.get(_listener_key(user_id)):
+        return None
+    changes = bucket_changes(user_id, start, end)
+    if not changes:
+        return None
+    event_id = time.time_ns()
+    # Одновременная публикация из двух процессов может потерять одно из событий; следующее
+    # событие по тем же корзинам снова несёт их полные значения
+    events = cache.get(_log_key(user_id), [])[-(EVENT_LOG_SIZE - 1):]
+    events.append((event_id, json.dumps(changes)))
+    cache.set(_log_key(user_id), events, EVENT_LOG_TIMEOUT)
+    return event_id
+
+
+def _message(event, data, event_id=None):
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {data}\n\n'
+
+
+async def event_stream(user_id, since):
+    """
+    Поток Server-Sent Events с изменениями корзин пользователя, начиная с события после since.
+
+    Новые события ищутся в журнале кэша раз в POLL_SECONDS, без запросов к базе. Если до
+    подключения никто не слушал и загрузка успела пройти после отрисовки страницы, её
+    изменения не публиковались: клиент получает событие stale и перезагружает страницу.
+    """
+    cache = _cache()
+    if not await cache.aget(_listener_key(user_id)):
+        last_ingested_at = await ActivityStats.objects.filter(user_id=user_id).values_list(
+            'last_ingested_at', flat=True
+        ).afirst()
+        if last_ingested_at and last_ingested_at.timestamp() * 10 ** 9 > since + REPLAY_NS:
+            yield _message('stale', '{}')
+            return
+    yield f'retry: {RETRY_MS}\n\n'
+
+    started = time.monotonic()
+    last_ping = None
+    while time.monotonic() - started < STREAM_SECONDS:
+        if last_ping is None or time.monotonic() - last_ping >= KEEPALIVE_SECONDS:
+            await cache.aset(_listener_key(user_id), True, LISTENER_TIMEOUT)
+            if last_ping is not None:
+                yield ': ping\n\n'
+            last_ping = time.monotonic()
+        for event_id, data in await cache.aget(_log_key(user_id), []):
+            if event_id > since:
+                since = event_id
+                yield _message('buckets', data, event_id)
+        await asyncio.sleep(POLL_SECONDS)
@@ -0,0 +1,101 @@
+import hmac
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from utils.dashboard_cache import cache_stats
+
+# Границы гистограммы длительности запросов, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.python_time = 0.0
+        self.queries = 0
+        self.n_plus_one = 0
+        self.slow = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+_views = defaultdict(_ViewStats)
+_lock = threading.Lock()
+
+
+def record_request(view, duration, sql_time, template_time, queries, n_plus_one, slow):
+    """Добавляет замер одного запроса к агрегатам представления (в пределах процесса)."""
+    with _lock:
+        stats = _views[view]
+        stats.requests += 1
+        stats.duration += duration
+        stats.sql_time += sql_time
+        stats.template_time += template_time
+        stats.python_time += max(duration - sql_time - template_time, 0)
+        stats.queries += queries
+        stats.n_plus_one += int(n_plus_one)
+        stats.slow += int(slow)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                stats.buckets[index] += 1
+
+
+def snapshot():
+    with _lock:
+        return {view: vars(stats).copy() for view, stats in _views.items()}
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def scraper_authorized(authorization):
+    """Заголовок 'Authorization: Bearer <METRICS_TOKEN>' сборщика метрик; без METRICS_TOKEN — всегда False."""
+    scheme, _, token = (authorization or '').partition(' ')
+    if not settings.METRICS_TOKEN or scheme.lower() != 'bearer':
+        return False
+    return hmac.compare_digest(token.strip().encode(), settings.METRICS_TOKEN.encode())
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """Метрики в текстовом формате Prometheus (exposition format 0.0.4)."""
+    views = snapshot()
+    lines = [
+        '# HELP health_request_duration_seconds Длительность обработки запроса.',
+        '# TYPE health_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(views.items()):
+        label = f'view="{_escape(view)}"'
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            lines.append(f'health_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'health_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats["requests"]}')
+        lines.append(f'health_request_duration_seconds_sum{{{label}}} {stats["duration"]}')
+        lines.append(f'health_request_duration_seconds_count{{{label}}} {stats["requests"]}')
+
+    counters = (
+        ('health_request_queries_total', 'queries', 'Выполнено SQL-запросов.'),
+        ('health_request_sql_seconds_total', 'sql_time', 'Время в SQL.'),
+        ('health_request_template_seconds_total', 'template_time', 'Время рендеринга шаблонов.'),
+        ('health_request_python_seconds_total', 'python_time', 'Время в Python вне SQL и шаблонов.'),
+        ('health_request_n_plus_one_total', 'n_plus_one', 'Запросы с повторяющимся SQL (N+1).'),
+        ('health_request_slow_total', 'slow', 'Запросы дольше порога SLOW_REQUEST_MS.'),
+    )
+    for name, field, help_text in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for view, stats in sorted(views.items()):
+            lines.append(f'{name}{{view="{_escape(view)}"}} {stats[field]}')
+
+    for name, value in sorted(cache_stats().items()):
+        lines.append(f'# TYPE health_dashboard_cache_{name}_total counter')
+        lines.append(f'health_dashboard_cache_{name}_total {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,166 @@
+import sqlite3
+from contextlib import closing
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from main.models import ActivityStats, HourlyRollup, HourlySample
+
+BATCH_SIZE = 5000
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sample (
+    user_id INTEGER NOT NULL, device_id INTEGER NOT NULL, timestamp TEXT NOT NULL,
+    steps INTEGER NOT NULL, calories INTEGER NOT NULL, distance_m INTEGER NOT NULL,
+    standups INTEGER NOT NULL, movements INTEGER NOT NULL,
+    PRIMARY KEY (user_id, device_id, timestamp)
+) WITHOUT ROWID;
+"""
+# device_id записей без устройства (столбец первичного ключа не может быть NULL)
+NO_DEVICE = 0
+SAMPLE_COLUMNS = ('steps', 'calories', 'distance_m', 'standups', 'movements')
+INSERT_SAMPLE = (
+    f'INSERT OR REPLACE INTO sample (user_id, device_id, timestamp, {", ".join(SAMPLE_COLUMNS)}) '
+    f'VALUES ({", ".join("?" * (len(SAMPLE_COLUMNS) + 3))})'
+)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'RAW_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(year, month):
+    """Отдельный SQLite-файл архива на каждый календарный месяц (по местному времени)."""
+    return archive_dir() / f'raw_{year:04d}_{month:02d}.sqlite3'
+
+
+def _to_key(moment):
+    # В архиве время хранится в UTC в ISO-формате, чтобы строки сортировались хронологически
+    return moment.astimezone(dt_timezone.utc).isoformat(timespec='seconds')
+
+
+def _month_bounds(moment):
+    local = timezone.localtime(moment)
+    start = timezone.make_aware(datetime.combine(local.date().replace(day=1), time.min))
+    year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+    end = timezone.make_aware(datetime(year, month, 1))
+    return local.year, local.month, start, end
+
+
+def _archive_month(user, year, month, start, end):
+    """Копирует сырые строки пользователя за [start, end) в архив месяца и удаляет их из базы."""
+    archive_dir().mkdir(parents=True, exist_ok=True)
+    moved = 0
+    samples = HourlySample.objects.filter(user=user, timestamp__gte=start, timestamp__lt=end)
+    with closing(sqlite3.connect(archive_path(year, month))) as archive:
+        archive.executescript(ARCHIVE_SCHEMA)
+        batch = []
+        for row in samples.values_list('device_id', 'timestamp', *SAMPLE_COLUMNS).iterator(chunk_size=BATCH_SIZE):
+            batch.append((user.id, row[0] or NO_DEVICE, _to_key(row[1]), *row[2:]))
+            if len(batch) >= BATCH_SIZE:
+                archive.executemany(INSERT_SAMPLE, batch)
+                moved += len(batch)
+                batch = []
+        archive.executemany(INSERT_SAMPLE, batch)
+        moved += len(batch)
+        # Архив фиксируется до удаления из базы: при сбое строки окажутся в обоих местах, но не потеряются
+        archive.commit()
+
+    samples.delete()
+    return moved
+
+
+def _archive_user(user, cutoff):
+    first = HourlySample.objects.filter(user=user, timestamp__lt=cutoff).aggregate(first=Min('timestamp'))['first']
+    if not first:
+        return 0
+
+    moved = 0
+    with transaction.atomic():
+        # Дневные сводки поддерживаются при каждой загрузке и уже совпадают с сырыми данными
+        month_start = first
+        while month_start < cutoff:
+            year, month, start, end = _month_bounds(month_start)
+            moved += _archive_month(user, year, month, max(start, first), min(end, cutoff))
+            month_start = end
+
+        stats, _ = ActivityStats.objects.get_or_create(user=user)
+        if not stats.archived_before or stats.archived_before < cutoff:
+            stats.archived_before = cutoff
+            stats.save(update_fields=['archived_before'])
+    return moved
+
+
+def apply_retention(keep_days, now=None, log=None):
+    """
+    Политика хранения: сырые почасовые строки и часовые сводки старше keep_days суток
+    (граница выровнена по местной полуночи) переносятся в помесячные SQLite-архивы,
+    в базе за этот период остаются только дневные сводки.
+    """
+    log = log or (lambda message: None)
+    now = timezone.localtime(now) if now else timezone.localtime()
+    cutoff = timezone.make_aware(datetime.combine(now.date() - timedelta(days=keep_days), time.min))
+
+    user_ids = sorted(HourlySample.objects.filter(timestamp__lt=cutoff).values_list('user_id', flat=True).distinct())
+
+    moved = 0
+    for user_id in user_ids:
+        user = User.objects.get(id=user_id)
+        user_moved = _archive_user(user, cutoff)
+        log(f'{user.username}: в архив перенесено {user_moved} строк')
+        moved += user_moved
+
+    dropped_rollups = HourlyRollup.objects.filter(hour__lt=cutoff)
+    # Удаление часовых сводок меняет ответы API и графики: у затронутых пользователей сдвигается версия данных
+    changed_user_ids = set(user_ids) | set(dropped_rollups.values_list('user_id', flat=True).distinct())
+    ActivityStats.objects.filter(user_id__in=changed_user_ids).update(last_ingested_at=timezone.now())
+    dropped, _ = dropped_rollups.delete()
+    log(f'Удалено часовых сводок: {dropped}')
+    return {'cutoff': cutoff, 'archived_rows': moved, 'dropped_hourly_rollups': dropped}
+
+
+def archived_months():
+    """Месяцы (год, месяц), для которых есть файлы архива, по возрастанию."""
+    months = []
+    for path in archive_dir().glob('raw_*_*.sqlite3'):
+        _, year, month = path.stem.split('_')
+        months.append((int(year), int(month)))
+    return sorted(months)
+
+
+def month_start(year, month):
+    return timezone.make_aware(datetime(year, month, 1))
+
+
+def query_archive(user, start, end):
+    """
+    Сырые почасовые данные пользователя за [start, end) из архивных файлов.
+
+    Возвращает список словарей в формате записей устройства с device_id (None — без устройства),
+    отсортированный по времени.
+    """
+    samples = []
+    month_start = start
+    while month_start < end:
+        year, month, _, month_end = _month_bounds(month_start)
+        path = archive_path(year, month)
+        month_start = month_end
+        if not path.exists():
+            continue
+        with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as archive:
+            samples.extend(archive.execute(
+                f'SELECT device_id, timestamp, {", ".join(SAMPLE_COLUMNS)} FROM sample '
+                'WHERE user_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, device_id',
+                (user.id, _to_key(start), _to_key(end)),
+            ))
+
+    return [
+        {'device_id': device_id or None, 'date': timezone.localtime(datetime.fromisoformat(key)), 'steps': steps,
+         'calories': calories, 'distance': distance_m / 1000, 'standups': standups, 'movements': movements}
+        for device_id, key, steps, calories, distance_m, standups, movements in samples
+    ]
@@ -0,0 +1,204 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import F, Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from main.models import ActivityStats, HourlySample, HourlyRollup, DailyRollup, Profile
+
+ROLLUP_FIELDS = ('steps', 'calories', 'distance', 'standups', 'movements')
+BATCH_SIZE = 500
+# Итоги ActivityStats и поля дневных сводок, из которых они складываются
+TOTAL_FIELDS = {'total_steps': 'steps', 'total_calories': 'calories', 'total_distance': 'distance'}
+# Допустимое расхождение накопленной дистанции (погрешность сложения float)
+DISTANCE_TOLERANCE = 1e-6
+# Шаг полной перестройки: история обрабатывается окнами, чтобы не держать её в памяти целиком
+REBUILD_WINDOW = timedelta(days=31)
+
+
+def _local_day_bounds(start, end):
+    """Границы полных локальных суток, покрывающих интервал [start, end]."""
+    tz = timezone.get_current_timezone()
+    first_day = timezone.localtime(start, tz).date()
+    last_day = timezone.localtime(end, tz).date()
+    day_start = timezone.make_aware(datetime.combine(first_day, time.min), tz)
+    day_end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min), tz)
+    return first_day, last_day, day_start, day_end
+
+
+def _hour_bounds(start, end):
+    """Расширяет интервал до границ целых часов."""
+    start = timezone.localtime(start).replace(minute=0, second=0, microsecond=0)
+    end = timezone.localtime(end).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return start, end - timedelta(microseconds=1)
+
+
+def _merge_policy(user):
+    policy = Profile.objects.filter(user=user).values_list('merge_policy', 'preferred_device_id').first()
+    return policy or (Profile.MERGE_SUM, None)
+
+
+def merge_devices(per_device, policy, preferred_device_id=None):
+    """
+    Сводит показания устройств за один час: {device_id: {метрика: значение}} -> {метрика: значение}.
+
+    sum — сумма по устройствам; max — максимум по каждой метрике; prefer — показания основного
+    устройства, а если за этот час их нет, максимум по остальным (без двойного счёта).
+    """
+    if policy == Profile.MERGE_SUM:
+        return {field: sum(values[field] for values in per_device.values()) for field in ROLLUP_FIELDS}
+    if policy == Profile.MERGE_PREFER and preferred_device_id in per_device:
+        return dict(per_device[preferred_device_id])
+    return {field: max(values[field] for values in per_device.values()) for field in ROLLUP_FIELDS}
+
+
+def refresh_hourly(user, start, end):
+    """
+    Пересчитывает часовые сводки пользователя за [start, end] из сырых почасовых записей.
+
+    Записи суммируются по часу внутри каждого устройства одним GROUP BY, после чего
+    устройства сводятся по Profile.merge_policy пользователя.
+    """
+    start, end = _hour_bounds(start, end)
+    policy, preferred_device_id = _merge_policy(user)
+    samples = (
+        HourlySample.objects.filter(user=user, timestamp__range=(start, end))
+        .annotate(bucket=TruncHour('timestamp'))
+        .values('bucket', 'device_id')
+        .annotate(steps_sum=Sum('steps'), calories_sum=Sum('calories'), distance_sum=Sum('distance_m'),
+                  standups_sum=Sum('standups'), movements_sum=Sum('movements'))
+        .order_by()
+    )
+    hours = {}
+    for row in samples:
+        hours.setdefault(row['bucket'], {})[row['device_id']] = {
+            'steps': row['steps_sum'], 'calories': row['calories_sum'], 'distance': row['distance_sum'] / 1000,
+            'standups': row['standups_sum'], 'movements': row['movements_sum'],
+        }
+    rows = [
+        HourlyRollup(user=user, hour=hour, **merge_devices(per_device, policy, preferred_device_id))
+        for hour, per_device in hours.items()
+    ]
+
+    # Окно перезаписывается целиком, чтобы сводка не расходилась с сырыми данными
+    HourlyRollup.objects.filter(user=user, hour__range=(start, end)).delete()
+    HourlyRollup.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def _daily_totals(user, **filters):
+    sums = DailyRollup.objects.filter(user=user, **filters).aggregate(
+        **{total: Sum(field) for total, field in TOTAL_FIELDS.items()}
+    )
+    return {total: value or 0 for total, value in sums.items()}
+
+
+def _add_totals(user, delta):
+    """Прибавляет разницу к итогам одним UPDATE с F(), не перечитывая строку статистики."""
+    if not any(delta.values()):
+        return
+    if not ActivityStats.objects.filter(user=user).update(**{total: F(total) + value for total, value in delta.items()}):
+        ActivityStats.objects.create(user=user, **delta)
+
+
+def refresh_daily(user, start, end):
+    """
+    Пересчитывает дневные сводки за все локальные сутки, задетые интервалом [start, end].
+
+    Итоги ActivityStats сдвигаются на разницу между новыми и прежними сводками этих суток.
+    """
+    first_day, last_day, day_start, day_end = _local_day_bounds(start, end)
+    previous = _daily_totals(user, day__range=(first_day, last_day))
+    DailyRollup.objects.filter(user=user, day__range=(first_day, last_day)).delete()
+    days = (
+        HourlyRollup.objects.filter(user=user, hour__gte=day_start, hour__lt=day_end)
+        .annotate(day=TruncDate('hour', tzinfo=timezone.get_current_timezone()))
+        .values('day')
+        .annotate(**{f'{field}_sum': Sum(field) for field in ROLLUP_FIELDS})
+    )
+    rows = [
+        DailyRollup(user=user, day=row['day'], **{field: row[f'{field}_sum'] for field in ROLLUP_FIELDS})
+        for row in days
+    ]
+    DailyRollup.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    _add_totals(user, {
+        total: sum(getattr(row, field) for row in rows) - previous[total] for total, field in TOTAL_FIELDS.items()
+    })
+
+
+def refresh_rollups(user, start, end):
+    """
+    Инкрементальное обновление сводок после загрузки данных за [start, end].
+
+    Пересчитываются только задетые часы и сутки, поэтому стоимость зависит от размера
+    загруженного окна, а не от всей истории пользователя. Вызывается внутри транзакции загрузки.
+    """
+    refresh_hourly(user, start, end)
+    refresh_daily(user, start, end)
+
+
+def rebuild_rollups(user):
+    """
+    Полная перестройка сводок пользователя из сырых данных.
+
+    Дневные сводки за период, сырые данные которого уже перенесены в архив
+    (ActivityStats.archived_before), сохраняются как есть.
+    """
+    archived_before = ActivityStats.objects.filter(user=user).values_list('archived_before', flat=True).first()
+    if archived_before:
+        HourlyRollup.objects.filter(user=user, hour__gte=archived_before).delete()
+        DailyRollup.objects.filter(user=user, day__gte=timezone.localtime(archived_before).date()).delete()
+    else:
+        HourlyRollup.objects.filter(user=user).delete()
+        DailyRollup.objects.filter(user=user).delete()
+
+    # Итоги начинаются с оставшихся (архивных) суток, пересчёт окон прибавляет к ним остальное
+    bounds = HourlySample.objects.filter(user=user).aggregate(start=Min('timestamp'), end=Max('timestamp'))
+    stats, _ = ActivityStats.objects.get_or_create(user=user)
+    for total, value in _daily_totals(user).items():
+        setattr(stats, total, value)
+    stats.last_sample_at = bounds['end'] or stats.last_sample_at
+    # Сводки перезаписаны: новая версия данных сбрасывает ETag API и кэш графиков
+    stats.last_ingested_at = timezone.now()
+    stats.save(update_fields=[*TOTAL_FIELDS, 'last_sample_at', 'last_ingested_at'])
+    if not bounds['start']:
+        return
+
+    # Окна выравниваются по локальной полуночи, чтобы соседние окна не перетирали сутки друг друга
+    first = max(bounds['start'], archived_before) if archived_before else bounds['start']
+    _, _, window_start, _ = _local_day_bounds(first, first)
+    end = bounds['end']
+    while window_start <= end:
+        window_end = window_start + REBUILD_WINDOW
+        refresh_rollups(user, window_start, window_end - timedelta(microseconds=1))
+        window_start = window_end
+
+
+def lifetime_totals(user_ids=None):
+    """
+    Итоги за всё время, пересчитанные с нуля двумя GROUP BY: {user_id: {поле ActivityStats: значение}}.
+
+    last_sample_at берётся по сырым данным в базе; если они целиком в архиве, он равен None.
+    """
+    daily = DailyRollup.objects.all()
+    samples = HourlySample.objects.all()
+    if user_ids is not None:
+        daily = daily.filter(user_id__in=user_ids)
+        samples = samples.filter(user_id__in=user_ids)
+    totals = {}
+    for row in daily.values('user_id').annotate(
+            **{total: Sum(field) for total, field in TOTAL_FIELDS.items()}).order_by().iterator():
+        totals[row.pop('user_id')] = {**row, 'last_sample_at': None}
+    for row in samples.values('user_id').annotate(last=Max('timestamp')).order_by().iterator():
+        totals.setdefault(row['user_id'], dict.fromkeys(TOTAL_FIELDS, 0))['last_sample_at'] = row['last']
+    return totals
+
+
+def totals_mismatch(stats, expected):
+    """Поля, в которых сохранённые итоги расходятся с пересчитанными."""
+    fields = [total for total in ('total_steps', 'total_calories') if getattr(stats, total) != expected[total]]
+    if abs(stats.total_distance - expected['total_distance']) > DISTANCE_TOLERANCE * max(1, expected['total_distance']):
+        fields.append('total_distance')
+    # Без сырых данных в базе (всё в архиве) последний час проверить не по чему
+    if expected['last_sample_at'] is not None and stats.last_sample_at != expected['last_sample_at']:
+        fields.append('last_sample_at')
+    return fields
@@ -0,0 +1,144 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django import db
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import Device, HourlySample, Profile
+from utils.activity_generator import generate_history
+from utils.coverage import mark_hours
+from utils.rollups import rebuild_rollups
+from utils.write_queue import process_write_lock
+
+# Строк HourlySample в одной транзакции записи
+SEED_BATCH_SIZE = 5000
+USERNAME_PREFIX = 'seed'
+
+
+def create_seed_users(count, prefix=USERNAME_PREFIX):
+    """
+    Создаёт (или находит уже созданных) пользователей prefix_0..prefix_{count-1} с профилем и устройством.
+
+    Пароль не задаётся: хеширование PBKDF2 для тысяч пользователей заняло бы больше
+    времени, чем сама генерация. Возвращает тройки (индекс, id пользователя, id устройства).
+    """
+    usernames = [f'{prefix}_{index}' for index in range(count)]
+    User.objects.bulk_create(
+        [User(username=username, password=make_password(None)) for username in usernames], ignore_conflicts=True
+    )
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+    with_profile = set(Profile.objects.filter(user_id__in=user_ids.values()).values_list('user_id', flat=True))
+    Profile.objects.bulk_create([
+        Profile(user_id=user_id, gender='M', birthdate='1990-01-01', email=f'{username}@example.com')
+        for username, user_id in user_ids.items() if user_id not in with_profile
+    ])
+    with_device = set(Device.objects.filter(user_id__in=user_ids.values()).values_list('user_id', flat=True))
+    Device.objects.bulk_create([
+        Device(user_id=user_id, device_name='seed', device_type='tracker')
+        for user_id in user_ids.values() if user_id not in with_device
+    ])
+    devices = {}
+    for user_id, device_id in Device.objects.filter(user_id__in=user_ids.values()).order_by('-id').values_list(
+            'user_id', 'id'):
+        devices[user_id] = device_id
+    return [(index, user_ids[username], devices[user_ids[username]]) for index, username in enumerate(usernames)]
+
+
+def _write_lock():
+    # SQLite допускает одного писателя: процессы ждут друг друга на файловой блокировке,
+    # а не на busy_timeout. Остальные СУБД пишут параллельно.
+    return process_write_lock() if connection.vendor == 'sqlite' else nullcontext()
+
+
+def _samples(user_id, device_id, history, base, start, stop):
+    # Смещения в часах переводятся в UTC-метки одним векторным сложением
+    stamps = (np.datetime64(base, 'h') + history["hour"][start:stop]).astype('datetime64[us]').tolist()
+    columns = [history[name][start:stop].tolist() for name in ('steps', 'calories', 'distance_m', 'standups', 'movements')]
+    return [
+        HourlySample(
+            user_id=user_id, device_id=device_id, timestamp=stamp.replace(tzinfo=dt_timezone.utc),
+            steps=steps, calories=calories, distance_m=distance_m, standups=standups, movements=movements,
+        )
+        for stamp, steps, calories, distance_m, standups, movements in zip(stamps, *columns)
+    ]
+
+
+def seed_user(index, user_id, device_id, days, end_date, seed, batch_size=SEED_BATCH_SIZE):
+    """
+    Генерирует историю одного пользователя и пишет её пачками через bulk_create.
+
+    Зерно генератора составляется из общего seed и индекса пользователя, поэтому
+    результат не зависит от числа процессов и порядка их выполнения. На SQLite каждая
+    пачка и итоговая перестройка сводок выполняются под межпроцессной блокировкой записи.
+    Возвращает число сгенерированных строк.
+    """
+    rng = np.random.default_rng([seed, index])
+    start_date = end_date - timedelta(days=days)
+    start = timezone.make_aware(datetime.combine(start_date, dt_time.min))
+    history = generate_history(rng, start_date, days)
+    base = start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
+    user, device = User(id=user_id), Device(id=device_id)
+    total = len(history["hour"])
+    for offset in range(0, total, batch_size):
+        samples = _samples(user_id, device_id, history, base, offset, offset + batch_size)
+        with _write_lock(), transaction.atomic():
+            HourlySample.objects.bulk_create(samples, batch_size=batch_size, ignore_conflicts=True)
+            mark_hours(user, device, [sample.timestamp for sample in samples])
+
+    last_hour = start + timedelta(hours=total - 1)
+    with _write_lock(), transaction.atomic():
+        # Перестройка сводок сдвигает версию данных, кэш графиков пользователя перестаёт совпадать
+        rebuild_rollups(user)
+        Device.objects.filter(Q(last_record_at__isnull=True) | Q(last_record_at__lt=last_hour), id=device_id).update(
+            last_record_at=last_hour
+        )
+    return total
+
+
+def _seed_chunk(items, days, end_date, seed, batch_size):
+    return sum(seed_user(*item, days, end_date, seed, batch_size) for item in items)
+
+
+def run_seed(users=100, days=365, workers=1, seed=0, end_date=None, batch_size=SEED_BATCH_SIZE,
+             prefix=USERNAME_PREFIX, log=None):
+    """
+    Заполняет базу синтетической историей users пользователей за days суток до end_date.
+
+    Пользователи делятся между workers процессами; генерация идёт параллельно, запись
+    на SQLite сериализуется блокировкой INGEST_WRITE_LOCK. Возвращает сводку с числом строк и скоростью.
+    """
+    end_date = end_date or timezone.localdate()
+    items = create_seed_users(users, prefix)
+    started = time.perf_counter()
+    if workers <= 1:
+        rows = _seed_chunk(items, days, end_date, seed, batch_size)
+    else:
+        # Процессы получают собственные соединения; унаследованные от родителя закрываются
+        db.connections.close_all()
+        chunks = [items[worker::workers] for worker in range(workers)]
+        task = partial(_seed_chunk, days=days, end_date=end_date, seed=seed, batch_size=batch_size)
+        with ProcessPoolExecutor(max_workers=workers, initializer=db.connections.close_all) as executor:
+            rows = 0
+            for done in executor.map(task, chunks):
+                rows += done
+                if log:
+                    log(f'Процесс завершён, строк: {done}')
+    elapsed = time.perf_counter() - started
+    return {
+        'users': users,
+        'days': days,
+        'workers': workers,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_s': rows / elapsed if elapsed else None,
+    }
@@ -0,0 +1,264 @@
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from main.models import Device, SyncJob
+from utils.activity_generator import archive_activity_data, generate_activity_records
+from utils.activity_processor import process_activity_records
+from utils.coverage import BACKFILL_DAYS, missing_spans
+from utils.write_queue import serialized_writes
+
+logger = logging.getLogger(__name__)
+
+# Задача в статусе running без отметки дольше этого времени считается брошенной упавшим воркером
+RUNNING_TIMEOUT = timedelta(minutes=10)
+# Как часто выполняющаяся задача обновляет updated_at, чтобы её не перехватили как брошенную
+HEARTBEAT_INTERVAL = timedelta(minutes=1)
+# Пауза перед повтором: RETRY_DELAY * номер попытки
+RETRY_DELAY = timedelta(seconds=30)
+POLL_INTERVAL = 1.0
+# Глубина первой синхронизации устройства без курсора и предел догрузки после долгого перерыва, часов
+INITIAL_SYNC_HOURS = 24
+MAX_SYNC_HOURS = 24 * 30
+
+
+class JobReclaimed(Exception):
+    """Задачу, пока она выполнялась, счёл брошенной и забрал другой воркер."""
+
+
+def enqueue_sync(device):
+    """Ставит синхронизацию устройства в очередь; повторный вызов возвращает уже ожидающую задачу."""
+    job = SyncJob.objects.filter(device=device, status=SyncJob.PENDING).first()
+    if job:
+        return job
+    try:
+        with transaction.atomic():
+            return SyncJob.objects.create(device=device, user_id=device.user_id)
+    except IntegrityError:
+        # Параллельный запрос успел поставить задачу раньше
+        return SyncJob.objects.get(device=device, status=SyncJob.PENDING)
+
+
+async def aenqueue_sync(device):
+    """Асинхронный вариант enqueue_sync для ASGI-представлений."""
+    job = await SyncJob.objects.filter(device=device, status=SyncJob.PENDING).afirst()
+    if job:
+        return job
+    try:
+        return await SyncJob.objects.acreate(device=device, user_id=device.user_id)
+    except IntegrityError:
+        return await SyncJob.objects.aget(device=device, status=SyncJob.PENDING)
+
+
+def _unqueued_devices(user):
+    pending = SyncJob.objects.filter(user=user, status=SyncJob.PENDING).values('device_id')
+    return Device.objects.filter(user=user).exclude(id__in=pending).values_list('id', flat=True)
+
+
+def enqueue_user_devices(user):
+    """
+    Ставит в очередь все устройства пользователя, у которых ещё нет ожидающей задачи.
+
+    Каждое устройство получает свою задачу, поэтому воркеры синхронизируют их параллельно.
+    """
+    SyncJob.objects.bulk_create(
+        [SyncJob(device_id=device_id, user=user) for device_id in _unqueued_devices(user)], ignore_conflicts=True
+    )
+
+
+async def aenqueue_user_devices(user):
+    """Асинхронный вариант enqueue_user_devices."""
+    await SyncJob.objects.abulk_create(
+        [SyncJob(device_id=device_id, user=user) async for device_id in _unqueued_devices(user)],
+        ignore_conflicts=True
+    )
+
+
+def latest_jobs(user):
+    """Последняя задача по каждому устройству пользователя: {device_id: SyncJob}."""
+    last_ids = SyncJob.objects.filter(user=user).values('device_id').annotate(last_id=Max('id')).values('last_id')
+    return {job.device_id: job for job in SyncJob.objects.filter(id__in=last_ids).select_related('device')}
+
+
+async def alatest_jobs(user):
+    """Асинхронный вариант latest_jobs."""
+    last_ids = SyncJob.objects.filter(user=user).values('device_id').annotate(last_id=Max('id')).values('last_id')
+    return {job.device_id: job async for job in SyncJob.objects.filter(id__in=last_ids).select_related('device')}
+
+
+def claim_next_job():
+    """
+    Забирает следующую готовую к запуску задачу.
+
+    Захват выполняется условным UPDATE по статусу, поэтому несколько воркеров
+    не получат одну и ту же задачу.
+    Выполняющаяся задача отмечается через heartbeat, поэтому по RUNNING_TIMEOUT
+    перехватываются только задачи упавших воркеров.
+    """
+    now = timezone.now()
+    ready = Q(status=SyncJob.PENDING, run_after__lte=now) | Q(
+        status=SyncJob.RUNNING, updated_at__lt=now - RUNNING_TIMEOUT
+    )
+    for job in SyncJob.objects.filter(ready).order_by('run_after', 'id')[:10]:
+        claimed = SyncJob.objects.filter(id=job.id, status=job.status, updated_at=job.updated_at).update(
+            status=SyncJob.RUNNING, attempts=job.attempts + 1, updated_at=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _current_run(job):
+    """Строка задачи, пока она принадлежит этому запуску: захват увеличивает attempts."""
+    return SyncJob.objects.filter(id=job.id, status=SyncJob.RUNNING, attempts=job.attempts)
+
+
+def heartbeat(job):
+    """
+    Отмечает, что задача ещё выполняется: раз в HEARTBEAT_INTERVAL обновляет updated_at.
+
+    Если строку уже захватил другой воркер (задача была признана брошенной), поднимает
+    JobReclaimed — текущий запуск должен остановиться, не дописывая результат.
+    """
+    now = timezone.now()
+    if now - job.updated_at < HEARTBEAT_INTERVAL:
+        return
+    if not _current_run(job).update(updated_at=now):
+        raise JobReclaimed(job.id)
+    job.updated_at = now
+
+
+def _with_heartbeat(records, job):
+    # Отметка ставится между записями, то есть между пачками загрузки, вне их транзакций
+    for record in records:
+        heartbeat(job)
+        yield record
+
+
+def pending_hours(device, now):
+    """
+    Сколько часов запросить у устройства: от курсора last_record_at до текущего часа включительно.
+
+    Час курсора запрашивается повторно — на момент прошлой синхронизации он мог быть неполным.
+    """
+    if device.last_record_at is None:
+        return INITIAL_SYNC_HOURS
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    cursor_hour = timezone.localtime(device.last_record_at).replace(minute=0, second=0, microsecond=0)
+    hours = int((current_hour - cursor_hour) / timedelta(hours=1)) + 1
+    return min(max(hours, 1), MAX_SYNC_HOURS)
+
+
+def backfill_records(device, now, fresh_hours):
+    """
+    Дозагрузка пропусков: у устройства запрашиваются только часы без данных за последние
+    BACKFILL_DAYS суток до окна обычной синхронизации (по битовым маскам покрытия).
+    """
+    if device.last_record_at is None:
+        return []
+    fresh_start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=fresh_hours - 1)
+    records = []
+    for first, hours in missing_spans(device, now - timedelta(days=BACKFILL_DAYS), fresh_start):
+        last = timezone.localtime(first + timedelta(hours=hours - 1)).replace(tzinfo=None)
+        records.extend(generate_activity_records(hours=hours, now_time=last))
+    return records
+
+
+def _save_result(job):
+    fields = ('status', 'inserted', 'skipped', 'updated', 'error', 'run_after', 'updated_at')
+    return _current_run(job).update(**{name: getattr(job, name) for name in fields})
+
+
+def run_job(job):
+    """
+    Загружает с устройства записи новее его курсора и недостающие часы последних суток,
+    фиксируя результат или планируя повтор.
+    """
+    try:
+        device = job.device
+        now = timezone.localtime()
+        hours = pending_hours(device, now)
+        records = list(generate_activity_records(hours=hours, now_time=now.replace(tzinfo=None)))
+        records.extend(backfill_records(device, now, hours))
+        archive_activity_data(records, device.device_name, device.device_type, device.user)
+        heartbeat(job)
+        # Повторно присланный час курсора перезаписывается, остальные часы новые
+        result = process_activity_records(_with_heartbeat(records, job), device.user, update_existing=True,
+                                          device=device)
+        if result is None:
+            raise ValueError("У пользователя нет устройств")
+
+        device.last_import_date = timezone.now()
+        if records:
+            device.last_record_at = timezone.make_aware(max(record["date"] for record in records))
+        device.save(update_fields=['last_import_date', 'last_record_at'])
+
+        job.status = SyncJob.DONE
+        job.inserted, job.skipped, job.updated = result.inserted, result.skipped, result.updated
+        job.error = ''
+    except JobReclaimed:
+        logger.warning("Задачу синхронизации %s перехватил другой воркер", job.id)
+        return job
+    except Exception:
+        logger.exception("Синхронизация устройства %s не удалась", job.device_id)
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = SyncJob.PENDING
+            job.run_after = timezone.now() + RETRY_DELAY * job.attempts
+        else:
+            job.status = SyncJob.FAILED
+
+    job.updated_at = timezone.now()
+    try:
+        with transaction.atomic():
+            saved = _save_result(job)
+    except IntegrityError:
+        # Пока задача выполнялась, для устройства поставили новую — повтор не нужен
+        job.status = SyncJob.FAILED
+        saved = _save_result(job)
+    if not saved:
+        # Итог пишет только текущий владелец задачи, а не запуск, который сочли брошенным
+        logger.warning("Задачу синхронизации %s перехватил другой воркер", job.id)
+    return job
+
+
+def run_worker(once=False, poll_interval=POLL_INTERVAL):
+    """Цикл воркера: выполняет задачи по одной; с once=True выходит, когда очередь пуста."""
+    processed = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+
+
+def _worker_thread(once, poll_interval):
+    try:
+        # Загрузки потоков пула всегда идут через одного писателя, иначе в SQLite без BEGIN IMMEDIATE
+        # параллельные транзакции получают "database is locked" при повышении блокировки
+        with serialized_writes():
+            return run_worker(once=once, poll_interval=poll_interval)
+    finally:
+        connections.close_all()
+
+
+def run_worker_pool(threads, once=False, poll_interval=POLL_INTERVAL):
+    """
+    Несколько циклов воркера в потоках одного процесса: задачи разных устройств
+    (например, после «Синхронизировать все») выполняются параллельно, а запись в базу
+    сериализуется очередью писателя.
+    """
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sync-worker') as pool:
+        futures = [pool.submit(_worker_thread, once, poll_interval) for _ in range(threads)]
+        return sum(future.result() for future in futures)
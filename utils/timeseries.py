@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from django.utils import timezone
+
+from main.models import HourlyRollup, DailyRollup
+
+METRICS = ('steps', 'calories', 'distance', 'standups', 'movements')
+# Число суток в каждом диапазоне (для масштабирования дневных целей)
+RANGE_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+# Дневные цели; для недели, месяца и года умножаются на число суток в диапазоне
+DAILY_GOALS = {'steps': 10000, 'distance': 8, 'standups': 24}
+DEFAULT_RANGE = 'day'
+
+
+@dataclass
+class Series:
+    """Непрерывный ряд корзин графика: подписи, начала корзин и значения по каждой метрике."""
+    time_range: str
+    labels: list = field(default_factory=list)
+    buckets: list = field(default_factory=list)
+    values: dict = field(default_factory=dict)
+
+    def total(self, metric):
+        return sum(self.values[metric])
+
+
+def _month_start(value, months_back):
+    year, month = divmod(value.year * 12 + value.month - 1 - months_back, 12)
+    return value.replace(year=year, month=month + 1, day=1)
+
+
+def normalize_range(time_range):
+    return time_range if time_range in RANGE_DAYS else DEFAULT_RANGE
+
+
+def range_window(time_range, now):
+    """Локальные границы [start, end) окна диапазона, последняя корзина которого содержит now."""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if time_range == 'year':
+        return _month_start(midnight, 11), _month_start(midnight, -1)
+    end = midnight + timedelta(days=1)
+    return end - timedelta(days=RANGE_DAYS[time_range]), end
+
+
+def bucket_end(time_range, now):
+    """Метка последней корзины диапазона: месяц для года, иначе текущие сутки."""
+    return now.strftime('%Y-%m') if time_range == 'year' else now.date().isoformat()
+
+
+def _hour_label(bucket):
+    return f"{bucket.hour}:00"
+
+
+def _day_label(bucket):
+    return bucket.strftime('%Y-%m-%d')
+
+
+def _month_label(bucket):
+    return bucket.strftime('%Y-%m')
+
+
+def _bucket_plan(time_range, now):
+    """Источник, функция усечения и ожидаемые начала корзин для диапазона."""
+    today = now.date()
+    if time_range == 'week':
+        buckets = [today - timedelta(days=delta) for delta in range(6, -1, -1)]
+        return DailyRollup, 'day', TruncDay, buckets, _day_label
+    if time_range == 'month':
+        buckets = [today - timedelta(days=delta) for delta in range(29, -1, -1)]
+        return DailyRollup, 'day', TruncDay, buckets, _day_label
+    if time_range == 'year':
+        buckets = [_month_start(today, delta) for delta in range(11, -1, -1)]
+        return DailyRollup, 'day', TruncMonth, buckets, _month_label
+    start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)  # Начало текущих суток
+    buckets = [timezone.localtime(start_time + timedelta(hours=hour)) for hour in range(24)]
+    return HourlyRollup, 'hour', TruncHour, buckets, _hour_label
+
+
+def _series_query(user, metrics, time_range, now):
+    """План корзин и GROUP BY-запрос к сводкам для build_series/abuild_series."""
+    time_range = normalize_range(time_range)
+    tz = timezone.get_current_timezone()
+    now = timezone.localtime(now, tz) if now else timezone.localtime(timezone=tz)
+    model, date_field, trunc, buckets, label = _bucket_plan(time_range, now)
+
+    trunc_kwargs = {'tzinfo': tz} if date_field == 'hour' else {}
+    if date_field == 'hour':
+        date_filter = {'hour__gte': buckets[0], 'hour__lte': now}
+    else:
+        date_filter = {'day__gte': buckets[0], 'day__lte': now.date()}
+    rows = (
+        model.objects.filter(user=user, **date_filter)
+        .annotate(bucket=trunc(date_field, **trunc_kwargs))
+        .values('bucket')
+        .annotate(**{f'{metric}_sum': Sum(metric) for metric in metrics})
+        .order_by()
+    )
+    return Series(time_range=time_range, buckets=buckets, labels=[label(bucket) for bucket in buckets]), rows
+
+
+def _fill_series(series, metrics, rows):
+    by_bucket = {row['bucket']: row for row in rows}
+    for metric in metrics:
+        series.values[metric] = [
+            (by_bucket[bucket][f'{metric}_sum'] or 0) if bucket in by_bucket else 0 for bucket in series.buckets
+        ]
+    return series
+
+
+def build_series(user, metrics=METRICS, time_range=DEFAULT_RANGE, now=None):
+    """
+    Ряд для графика за день (по часам), неделю и месяц (по дням) или год (по месяцам).
+
+    Строится одним GROUP BY-запросом к сводкам с усечением дат в текущем часовом поясе;
+    пустые корзины заполняются нулями.
+    """
+    series, rows = _series_query(user, metrics, time_range, now)
+    return _fill_series(series, metrics, rows)
+
+
+async def abuild_series(user, metrics=METRICS, time_range=DEFAULT_RANGE, now=None):
+    """Асинхронный вариант build_series для ASGI-представлений."""
+    series, rows = _series_query(user, metrics, time_range, now)
+    return _fill_series(series, metrics, [row async for row in rows.aiterator()])
@@ -0,0 +1,114 @@
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection, connections
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, остаётся busy_timeout
+    fcntl = None
+
+
+@contextmanager
+def process_write_lock():
+    """Межпроцессная блокировка записи (воркеры синхронизации запускаются отдельными процессами)."""
+    path = getattr(settings, 'INGEST_WRITE_LOCK', None)
+    if not path or fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class WriteQueue:
+    """
+    Очередь записей с одним потоком-писателем на процесс.
+
+    Задачи выполняются строго по одной в порядке поступления через одно постоянное
+    соединение, поэтому транзакции загрузки не борются за блокировку SQLite
+    ни между собой, ни (через INGEST_WRITE_LOCK) с воркерами в других процессах.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                future, func, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with process_write_lock():
+                        future.set_result(func(*args, **kwargs))
+                except BaseException as exc:
+                    future.set_exception(exc)
+        finally:
+            connections.close_all()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def stop(self):
+        """Дожидается выполнения поставленных задач и останавливает поток-писатель."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def is_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+
+_write_queue = WriteQueue()
+# Включает очередь для текущего потока независимо от INGEST_WRITE_QUEUE (пул воркеров синхронизации)
+_forced = ContextVar('forced_write_queue', default=False)
+
+
+@contextmanager
+def serialized_writes():
+    token = _forced.set(True)
+    try:
+        yield
+    finally:
+        _forced.reset(token)
+
+
+def run_serialized(func, *args, **kwargs):
+    """
+    Выполняет запись через очередь писателя, если включён INGEST_WRITE_QUEUE или serialized_writes().
+
+    Внутри уже открытой транзакции вызывающего и в самом потоке-писателе функция
+    выполняется на месте: другой поток не увидел бы незафиксированных данных.
+    """
+    enabled = _forced.get() or getattr(settings, 'INGEST_WRITE_QUEUE', False)
+    if not enabled or connection.in_atomic_block or _write_queue.is_writer_thread():
+        return func(*args, **kwargs)
+    return _write_queue.submit(func, *args, **kwargs).result()
+
+
+def stop_write_queue():
+    _write_queue.stop()